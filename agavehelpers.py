@@ -4,8 +4,11 @@ from tenacity import retry
 from tenacity import stop_after_delay
 from tenacity import wait_exponential
 
+import timing
 
-@retry(stop=stop_after_delay(32), wait=wait_exponential(multiplier=2, max=8))
+
+@retry(stop=stop_after_delay(32), wait=wait_exponential(multiplier=2, max=8),
+       before_sleep=timing.retry_counter('files_pems_retries'))
 def resilient_files_pems(agaveClient, agaveUri, username, permission, recursive=False):
     response = None
     try:
@@ -14,9 +17,10 @@ def resilient_files_pems(agaveClient, agaveUri, username, permission, recursive=
         pemBody = {'username': username,
                    'permission': permission,
                    'recursive': recursive}
-        response = agaveClient.files.updatePermissions(systemId=systemId,
-                                                       filePath=agaveAbsolutePath,
-                                                       body=pemBody)
+        with timing.span('files_pems'):
+            response = agaveClient.files.updatePermissions(systemId=systemId,
+                                                           filePath=agaveAbsolutePath,
+                                                           body=pemBody)
         return True
     except Exception:
         raise
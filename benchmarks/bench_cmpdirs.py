@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Compare per-file cmpfiles() with directory-level cmpdirs() on a synthetic tree
+
+Usage: bench_cmpdirs.py [--files 100000] [--per-dir 500] [--workdir DIR]
+
+A source tree and a destination copy are generated under --workdir, with a
+fraction of destination files missing or of a different size. Run with
+--workdir on the NFS or Lustre filesystem of interest; on local disks the
+difference mostly reflects Python overhead rather than metadata latency.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from common import write_results
+from cmpfiles import cmpfiles, cmpdirs
+
+
+def make_tree(root, files, per_dir, missing=0.1, changed=0.05):
+    src_root = os.path.join(root, 'src')
+    dest_root = os.path.join(root, 'dest')
+    pairs = list()
+    for idx in range(files):
+        reldir = 'd{:05d}'.format(idx // per_dir)
+        name = 'file-{:07d}.dat'.format(idx)
+        src = os.path.join(src_root, reldir, name)
+        dest = os.path.join(dest_root, reldir, name)
+        if idx % per_dir == 0:
+            os.makedirs(os.path.dirname(src))
+            os.makedirs(os.path.dirname(dest))
+        with open(src, 'wb') as f:
+            f.write(b'x' * (idx % 64))
+        fraction = (idx * 7919 % 1000) / 1000.0
+        if fraction >= missing:
+            with open(dest, 'wb') as f:
+                if fraction < missing + changed:
+                    f.write(b'y' * (idx % 64 + 1))
+                else:
+                    f.write(b'x' * (idx % 64))
+        pairs.append((src, dest))
+    return pairs
+
+
+def per_file(pairs):
+    return sum(1 for src, dest in pairs
+               if not cmpfiles(src, dest, mtime=False))
+
+
+def bulk(pairs):
+    def items():
+        for src, dest in pairs:
+            yield src, os.stat(src), dest, None
+    return sum(1 for payload, same in cmpdirs(items(), mtime=False)
+               if not same)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--per-dir', type=int, default=500)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench-cmpdirs-', dir=args.workdir)
+    results = list()
+    try:
+        pairs = make_tree(root, args.files, args.per_dir)
+        for name, func in (('cmpfiles', per_file), ('cmpdirs', bulk)):
+            start = time.perf_counter()
+            to_copy = func(pairs)
+            elapsed = time.perf_counter() - start
+            results.append({'method': name, 'files': args.files,
+                            'to_copy': to_copy, 'seconds': elapsed,
+                            'files_per_s': args.files / elapsed})
+            print('{:>10} {:>8} files {:>7} to copy {:8.3f}s {:12.1f} files/s'
+                  .format(name, args.files, to_copy, elapsed,
+                          args.files / elapsed))
+    finally:
+        shutil.rmtree(root)
+
+    write_results(args.output, 'cmpdirs', results)
+
+
+if __name__ == '__main__':
+    main()
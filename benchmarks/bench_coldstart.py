@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""Measure how long a fresh interpreter takes to import a module
+
+Usage: bench_coldstart.py [--module reactor] [--repeat 10] [--top 15]
+
+Each repeat starts a new Python process that imports --module from the
+repository root, recording the import time and the wall time of the whole
+process. The slowest imports by cumulative time, from -X importtime, are
+listed to show what is worth deferring. Run it inside the container image
+so that agavepy, datacatalog and reactors are the real packages.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from common import PARENT, write_results
+
+IMPORT = ('import time; start = time.perf_counter(); import {}; '
+          'print(time.perf_counter() - start)')
+
+
+def cold_start(module):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', IMPORT.format(module)],
+                         cwd=PARENT, check=True, stdout=subprocess.PIPE,
+                         universal_newlines=True).stdout
+    return float(out.strip().splitlines()[-1]), time.perf_counter() - start
+
+
+def slowest_imports(module, top):
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          'import {}'.format(module)],
+                         cwd=PARENT, check=True, stderr=subprocess.PIPE,
+                         universal_newlines=True).stderr
+    imports = list()
+    for line in err.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = [field.strip() for field in line[12:].split('|')]
+        if fields[1].isdigit():
+            imports.append((int(fields[1]), fields[2].strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='reactor')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    timings = [cold_start(args.module) for _ in range(args.repeat)]
+    imports = [item[0] for item in timings]
+    walls = [item[1] for item in timings]
+    result = {'module': args.module, 'repeat': args.repeat,
+              'import_s_min': min(imports),
+              'import_s_median': statistics.median(imports),
+              'process_s_min': min(walls),
+              'process_s_median': statistics.median(walls),
+              'slowest_imports_us': [{'module': name, 'cumulative_us': us}
+                                     for us, name in slowest_imports(
+                                         args.module, args.top)]}
+    print('import {}: {:.3f}s median, {:.3f}s min; process {:.3f}s median'
+          .format(args.module, result['import_s_median'],
+                  result['import_s_min'], result['process_s_median']))
+    for item in result['slowest_imports_us']:
+        print('{:>12} us  {}'.format(item['cumulative_us'], item['module']))
+
+    write_results(args.output, 'coldstart', [result])
+
+
+if __name__ == '__main__':
+    main()
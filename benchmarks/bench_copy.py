@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Compare fastcopy engines with shutil.copy across file sizes
+
+Usage: bench_copy.py [--sizes 1M,64M,1G] [--src-dir DIR] [--dest-dir DIR]
+                     [--threads 2,4,8] [--range-size 64M]
+
+Pass --src-dir and --dest-dir on the filesystems of interest (e.g. Corral and
+/work) to include cross-filesystem effects. Each engine copies every test file
+--repeat times and the best time is reported. Ranged copies split each file
+into --range-size ranges copied by each of the --threads thread counts, to
+compare against the single-stream engines.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from common import UNITS, parse_size, make_file, write_results
+from fastcopy import copy_atomic
+
+
+def make_engines(threads=(), range_size=None):
+    engines = [('shutil.copy', shutil.copy)]
+    for engine in ('copy_file_range', 'sendfile', 'chunked'):
+        engines.append(('fastcopy.' + engine,
+                        lambda src, dest, engine=engine: copy_atomic(
+                            src, dest, engine=engine, resume=False)))
+    for count in threads:
+        engines.append(('fastcopy.ranged x{}'.format(count),
+                        lambda src, dest, count=count: copy_atomic(
+                            src, dest, resume=False, ranged_threshold=1,
+                            range_size=range_size, threads=count)))
+    return engines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='4K,1M,64M,1G')
+    parser.add_argument('--src-dir', default=None)
+    parser.add_argument('--dest-dir', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', default='2,4,8',
+                        help='Thread counts for ranged copies')
+    parser.add_argument('--range-size', type=parse_size, default='64M')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    src_dir = tempfile.mkdtemp(prefix='bench-copy-src-', dir=args.src_dir)
+    dest_dir = tempfile.mkdtemp(prefix='bench-copy-dest-', dir=args.dest_dir)
+    threads = [int(count) for count in args.threads.split(',') if count]
+    results = []
+    try:
+        for size_text in args.sizes.split(','):
+            size = parse_size(size_text)
+            src = os.path.join(src_dir, 'file-{}'.format(size_text))
+            make_file(src, size)
+            for name, func in make_engines(threads, args.range_size):
+                timings = []
+                for _ in range(args.repeat):
+                    dest = os.path.join(dest_dir, os.path.basename(src))
+                    if os.path.exists(dest):
+                        os.unlink(dest)
+                    start = time.perf_counter()
+                    func(src, dest)
+                    timings.append(time.perf_counter() - start)
+                best = max(min(timings), 1e-9)
+                results.append({'method': name, 'bytes': size,
+                                'seconds': best,
+                                'mb_per_s': size / best / UNITS['M']})
+                print('{:>26} {:>8} {:10.4f}s {:10.1f} MB/s'.format(
+                    name, size_text, best, size / best / UNITS['M']))
+            os.unlink(src)
+    finally:
+        shutil.rmtree(src_dir)
+        shutil.rmtree(dest_dir)
+
+    write_results(args.output, 'copy', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Compare sampled and full fingerprints with a full sha256 pass
+
+Usage: bench_fingerprint.py [--sizes 1G,4G] [--workdir DIR] [--output FILE]
+
+Test files are filled with random data and are removed afterwards. Results
+are only meaningful for cold reads if the page cache is dropped between runs
+(echo 3 > /proc/sys/vm/drop_caches as root), otherwise they measure hashing
+throughput from memory.
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from common import UNITS, parse_size, make_file, write_results
+from fingerprint import sampled_fingerprint, full_fingerprint, BLOCK_SIZE
+
+
+def sha256_file(path, size=None):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+METHODS = [('sampled', sampled_fingerprint),
+           ('full-xxhash', full_fingerprint),
+           ('sha256', sha256_file)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='64M,1G,4G')
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='bench-fingerprint-', dir=args.workdir)
+    try:
+        for size_text in args.sizes.split(','):
+            size = parse_size(size_text)
+            path = os.path.join(workdir, 'file-{}'.format(size_text))
+            make_file(path, size)
+            for name, func in METHODS:
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    func(path, size=size)
+                    timings.append(time.perf_counter() - start)
+                best = min(timings)
+                results.append({'method': name, 'bytes': size,
+                                'seconds': best,
+                                'mb_per_s': size / best / UNITS['M']})
+                print('{:>12} {:>8} {:10.4f}s {:10.1f} MB/s'.format(
+                    name, size_text, best, size / best / UNITS['M']))
+            os.unlink(path)
+    finally:
+        os.rmdir(workdir)
+
+    write_results(args.output, 'fingerprint', results)
+
+
+if __name__ == '__main__':
+    main()
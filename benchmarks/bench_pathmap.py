@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Compare per-call path mapping with PathMapper on synthetic tree paths
+
+Usage: bench_pathmap.py [--files 1000000] [--odd-fraction 0.05]
+
+The per-call method is what reactor.map_paths() did for every file before
+PathMapper: safen the whole path, then map the source and destination with
+S3Helper and AgaveHelper. No files are created.
+"""
+import argparse
+import os
+import time
+
+from common import write_results
+from treegen import tree_paths
+from datacatalog.agavehelpers import AgaveHelper
+from datacatalog.utils import safen_path
+from pathmapper import AGAVE_PREFIX, PathMapper
+from s3helpers import S3Helper
+
+
+def per_call(sh, ah, relpaths):
+    for s3_full_relpath in relpaths:
+        ag_full_relpath = safen_path(s3_full_relpath, no_unicode=True,
+                                     no_spaces=True)
+        (ag_full_relpath, AGAVE_PREFIX + ag_full_relpath,
+         sh.mapped_catalog_path(s3_full_relpath),
+         ah.mapped_posix_path(os.path.join('/', ag_full_relpath)))
+    return len(relpaths)
+
+
+def mapper(sh, ah, relpaths):
+    return sum(1 for item in PathMapper(sh, ah).map_many(relpaths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000000)
+    parser.add_argument('--odd-fraction', type=float, default=0.05)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    relpaths = [os.path.join('uploads', relpath) for relpath, size in
+                tree_paths(args.files, odd_fraction=args.odd_fraction)]
+    sh = S3Helper()
+    ah = AgaveHelper()
+    results = list()
+    for name, func in (('per_call', per_call), ('PathMapper', mapper)):
+        start = time.perf_counter()
+        func(sh, ah, relpaths)
+        elapsed = time.perf_counter() - start
+        results.append({'method': name, 'files': args.files,
+                        'seconds': elapsed,
+                        'files_per_s': args.files / elapsed})
+        print('{:>12} {:>8} files {:8.3f}s {:12.1f} files/s'.format(
+            name, args.files, elapsed, args.files / elapsed))
+
+    write_results(args.output, 'pathmap', results)
+
+
+if __name__ == '__main__':
+    main()
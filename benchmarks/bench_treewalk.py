@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Measure tree walk throughput as the number of walker threads grows
+
+Usage: bench_treewalk.py [--files 100000] [--threads 1,2,4,8,16,32]
+                         [--latency 0.002] [--root DIR]
+
+Walks a synthetic tree (see treegen.py) with treewalk.walk(), the walker
+behind S3Helper.iterdir_s3_lustre(), once per thread count; one thread
+reads directories one at a time, like iterdir_s3_posix(). A local disk
+answers directory reads from cache in microseconds, so --latency adds a
+delay to every directory read to stand in for the metadata round trip of
+Lustre or NFS; use --latency 0 with --root on a real parallel filesystem to
+measure it directly.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from common import write_results
+from treegen import generate
+import treewalk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--width', type=int, default=8)
+    parser.add_argument('--per-dir', type=int, default=50)
+    parser.add_argument('--threads', default='1,2,4,8,16,32')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='Seconds added to each directory read')
+    parser.add_argument('--ordered', action='store_true')
+    parser.add_argument('--root', default=None,
+                        help='Existing tree to walk instead of a new one')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    workdir = None
+    root = args.root
+    if root is None:
+        workdir = tempfile.mkdtemp(prefix='bench_treewalk.')
+        root = os.path.join(workdir, 'uploads')
+        generate(root, args.files, args.depth, args.width, args.per_dir)
+
+    def scandir(dirpath):
+        time.sleep(args.latency)
+        return os.scandir(dirpath)
+
+    results = list()
+    try:
+        for threads in [int(t) for t in args.threads.split(',')]:
+            start = time.perf_counter()
+            dirs = entries = 0
+            for reldir, subdirs, files in treewalk.walk(
+                    root, threads, args.ordered, scandir=scandir):
+                dirs += 1
+                entries += len(subdirs) + len(files)
+            elapsed = time.perf_counter() - start
+            results.append({'threads': threads, 'directories': dirs,
+                            'entries': entries, 'seconds': elapsed,
+                            'dirs_per_s': dirs / elapsed,
+                            'entries_per_s': entries / elapsed})
+            print('{:>3} threads {:>6} dirs {:>8} entries {:8.3f}s '
+                  '{:10.1f} dirs/s'.format(threads, dirs, entries, elapsed,
+                                           dirs / elapsed))
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir)
+
+    write_results(args.output, 'treewalk', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""Shared helpers for the benchmark scripts"""
+import json
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+if PARENT not in sys.path:
+    sys.path.insert(0, PARENT)
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+BLOCK_SIZE = 1024 * 1024
+
+
+def parse_size(text):
+    """Parse sizes such as 512, 64K, 1.5G into a byte count"""
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def make_file(path, size):
+    """Write size bytes of incompressible data to path"""
+    block = os.urandom(BLOCK_SIZE)
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:min(remaining, BLOCK_SIZE)])
+            remaining -= BLOCK_SIZE
+
+
+def write_results(path, benchmark, results):
+    """Store results as JSON so runs can be compared"""
+    if path is None:
+        return
+    with open(path, 'w') as out:
+        json.dump({'benchmark': benchmark, 'results': results}, out, indent=2)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""Time the per-file hot paths of a directory sync on synthetic trees
+
+Usage: run_benchmarks.py [--scales 1000,100000,1000000] [--workdir DIR]
+                         [--output results.json] [--baseline old.json]
+
+For each scale a tree is generated with treegen.py and the following are
+timed over every file in it: S3Helper.listdir, from_s3_uri plus
+mapped_catalog_path, safen_path (when datacatalog is installed), cmpfiles
+against a partially populated destination, and routing table matching.
+copyfile is timed on a sample of --copy-sample files. Results are written as
+JSON; pass a previous run as --baseline to print the change per operation.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from attrdict import AttrDict
+import yaml
+
+from common import PARENT, write_results
+from treegen import generate
+from cmpfiles import cmpfiles, sync_policy
+from copyfile import copyfile
+from routemsg import routing_table
+from s3helpers import S3Helper
+
+
+class BenchReactor(object):
+    """The parts of a Reactor that copyfile() uses, running locally"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.logger = logging.getLogger('benchmark')
+        self.local = True
+        self.client = None
+
+    def on_failure(self, message, exc=None):
+        raise RuntimeError('{}: {}'.format(message, exc))
+
+
+def load_settings():
+    with open(os.path.join(PARENT, 'config.yml'), 'r') as conf:
+        return AttrDict(yaml.safe_load(conf))
+
+
+def load_safen_path():
+    try:
+        from datacatalog.utils import safen_path
+    except ImportError:
+        return None
+    return safen_path
+
+
+def timed(operation, files, func):
+    start = time.perf_counter()
+    items = func()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    result = {'operation': operation, 'files': files, 'items': items,
+              'seconds': elapsed, 'items_per_s': items / elapsed}
+    print('{:>22} {:>8} files {:>8} items {:9.3f}s {:12.1f} items/s'.format(
+        operation, files, items, elapsed, items / elapsed))
+    return result
+
+
+def run_scale(root, files, settings, copy_sample, seed):
+    bucket_root = os.path.join(root, 'uploads')
+    dest_root = os.path.join(root, 'dest')
+    relpaths = generate(os.path.join(bucket_root, 'bench'), files, seed=seed)
+    relpaths = [os.path.join('bench', relpath) for relpath in relpaths]
+    uris = ['s3://uploads/' + relpath for relpath in relpaths]
+    agave_uris = [os.path.join(settings.destination.bucket, relpath)
+                  for relpath in relpaths]
+    sh = S3Helper()
+    sh.STORAGE_PREFIX = root
+    r = BenchReactor(settings)
+    results = list()
+
+    results.append(timed('listdir', files, lambda: len(
+        sh.listdir('uploads/bench', directories=False))))
+
+    def map_uris():
+        for uri in uris:
+            s3_bucket, srcpath, srcfile = sh.from_s3_uri(uri)
+            sh.mapped_catalog_path(os.path.join(s3_bucket, srcpath, srcfile))
+        return len(uris)
+    results.append(timed('from_s3_uri+mapped', files, map_uris))
+
+    safen_path = load_safen_path()
+    if safen_path is not None:
+        results.append(timed('safen_path', files, lambda: len(
+            [safen_path(relpath, no_unicode=True, no_spaces=True)
+             for relpath in relpaths])))
+
+    sample = relpaths[::max(1, len(relpaths) // copy_sample)][:copy_sample]
+
+    def copy_sample_files():
+        for relpath in sample:
+            copyfile(r, os.path.join(bucket_root, relpath),
+                     os.path.join(dest_root, relpath))
+        return len(sample)
+    results.append(timed('copyfile', files, copy_sample_files))
+
+    policy = sync_policy(settings)
+
+    def compare():
+        for relpath in relpaths:
+            cmpfiles(os.path.join(bucket_root, relpath),
+                     os.path.join(dest_root, relpath), **policy)
+        return len(relpaths)
+    results.append(timed('cmpfiles', files, compare))
+
+    table = routing_table(settings)
+    results.append(timed('routemsg match', files, lambda: len(
+        [table.match(agave_uri) for agave_uri in agave_uris])))
+    return results
+
+
+def compare_baseline(path, results):
+    with open(path, 'r') as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    previous = dict(((item['operation'], item['files']), item)
+                    for item in baseline)
+    for item in results:
+        before = previous.get((item['operation'], item['files']))
+        if before is None:
+            continue
+        change = item['items_per_s'] / before['items_per_s'] - 1
+        print('{:>22} {:>8} files {:+8.1%}'.format(
+            item['operation'], item['files'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='1000,100000,1000000')
+    parser.add_argument('--copy-sample', type=int, default=1000)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    args = parser.parse_args()
+
+    settings = load_settings()
+    results = list()
+    for files in [int(scale) for scale in args.scales.split(',')]:
+        root = tempfile.mkdtemp(prefix='bench-tree-', dir=args.workdir)
+        try:
+            results.extend(run_scale(root, files, settings,
+                                     args.copy_sample, args.seed))
+        finally:
+            shutil.rmtree(root)
+
+    write_results(args.output, 'sync', results)
+    if args.baseline is not None:
+        compare_baseline(args.baseline, results)
+
+
+if __name__ == '__main__':
+    main()
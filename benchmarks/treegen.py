@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Generate a synthetic upload tree
+
+Usage: treegen.py ROOT [--files 100000] [--depth 6] [--width 8] [--seed 0]
+
+Files are spread over a tree that is both deep (--depth levels of nested
+directories) and wide (--width subdirectories per level, and many files in
+each leaf). A fraction of directory and file names contain spaces and
+non-ASCII characters so that safen_path() has work to do. File sizes are
+drawn from SIZE_MIX; files are written sparse with truncate() so that large
+trees are cheap to create, which makes the tree suitable for listing and
+comparison benchmarks but not for copy throughput (see bench_copy.py).
+"""
+import argparse
+import os
+import random
+
+from common import parse_size
+
+# (weight, smallest, largest) in bytes. Mostly small files with a long tail
+SIZE_MIX = ((0.90, 0, 4 * 1024),
+            (0.09, 4 * 1024, 1024 * 1024),
+            (0.01, 1024 * 1024, 64 * 1024 * 1024))
+WORDS = ('plate', 'sample', 'run', 'replicate', 'flow', 'sequence', 'assay',
+         'strain', 'growth', 'media')
+ODD_WORDS = ('proteína', 'ゲノム', 'plate map', 'Ωmega', 'café au lait',
+             'naïve', 'copy (1)', 'µL', 'über run', 'day #3')
+
+
+def _name(rng, odd_fraction):
+    if rng.random() < odd_fraction:
+        return rng.choice(ODD_WORDS)
+    return rng.choice(WORDS)
+
+
+def _size(rng, max_size=None):
+    pick = rng.random()
+    for weight, low, high in SIZE_MIX:
+        if pick < weight:
+            break
+        pick -= weight
+    size = rng.randint(low, high)
+    return size if max_size is None else min(size, max_size)
+
+
+def leaf_dirs(files, depth, width, per_dir):
+    """Number of leaf directories needed, capped by the shape of the tree"""
+    return max(1, min(width ** depth, -(-files // per_dir)))
+
+
+def tree_paths(files, depth=6, width=8, per_dir=1000, odd_fraction=0.05,
+               max_size=None, seed=0):
+    """Yield (relpath, size) for the files of a tree without creating it"""
+    rng = random.Random(seed)
+    leaves = leaf_dirs(files, depth, width, per_dir)
+    for leaf in range(leaves):
+        # Leaf index in base width gives the path through the tree
+        parts = list()
+        number = leaf
+        for level in range(depth):
+            number, branch = divmod(number, width)
+            parts.append('{}-{}-{}'.format(level, branch,
+                                           _name(rng, odd_fraction)))
+        reldir = os.path.join(*parts)
+        count = files // leaves + (1 if leaf < files % leaves else 0)
+        for idx in range(count):
+            base, ext = os.path.splitext(rng.choice(
+                ('data.fcs', 'reads.fastq', 'meta.json', 'plate.csv',
+                 'image.png')))
+            if rng.random() < odd_fraction:
+                name = '{} {}-{:06d}{}'.format(_name(rng, odd_fraction),
+                                               base, idx, ext)
+            else:
+                name = '{}-{:06d}{}'.format(base, idx, ext)
+            yield os.path.join(reldir, name), _size(rng, max_size)
+
+
+def generate(root, files, depth=6, width=8, per_dir=1000,
+             odd_fraction=0.05, max_size=None, seed=0):
+    """Create files under root and return their paths relative to root"""
+    relpaths = list()
+    made = None
+    for relpath, size in tree_paths(files, depth, width, per_dir,
+                                    odd_fraction, max_size, seed):
+        path = os.path.join(root, relpath)
+        if os.path.dirname(path) != made:
+            made = os.path.dirname(path)
+            os.makedirs(made, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        relpaths.append(relpath)
+    return relpaths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root')
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--width', type=int, default=8)
+    parser.add_argument('--per-dir', type=int, default=1000)
+    parser.add_argument('--odd-fraction', type=float, default=0.05,
+                        help='Fraction of names with spaces or unicode')
+    parser.add_argument('--max-size', type=parse_size, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    relpaths = generate(args.root, args.files, args.depth, args.width,
+                        args.per_dir, args.odd_fraction, args.max_size,
+                        args.seed)
+    print('Generated {} files under {}'.format(len(relpaths), args.root))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Resumable progress for directory syncs
+
+A checkpointed sync lists its source in the order of S3Helper.iterdir() with
+ordered, which every lister can produce: depth-first, with the files of each
+directory sorted by name ahead of its subdirectories (see order_key), and
+numbers each file as it is listed. Files are
+completed out of order because of shuffling and batching, so progress is
+saved as a cursor, the last file of the longest fully completed prefix of
+the listing, plus the set of files completed beyond it. Files that failed
+count as done for the cursor, so one failure cannot hold it back and leave
+every later file in the set, and are saved in a list of their own. A retried
+sync of the same URI skips everything at or before the cursor and everything
+in the set, but not the failed files, without stat'ing or comparing it.
+Completions may come from copy threads. Subdirectories messaged to other
+executions by fan-out (see fanout.py) are recorded by name and not messaged
+again. Schedulers that hold files back (smallest_first, route_priority) keep
+the cursor behind them, so at most max_done files completed beyond the
+cursor are remembered; later ones are simply redone by a retry. Files
+added to the source behind the cursor after the checkpoint was written are
+not picked up by the resumed sync; they are covered by their own upload
+notifications.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+SUFFIX = '.checkpoint.json'
+MAX_DONE = 100000
+# Saved with each checkpoint. Checkpoints saved in another order are ignored
+ORDER = 'files-first'
+
+
+def order_key(parts):
+    """Sort key for path components in the order of an ordered listing"""
+    return tuple((1, name) for name in parts[:-1]) + ((0, parts[-1]), )
+
+
+def checkpoint_dir(posix_path):
+    """Default location: a dot directory alongside the destination root"""
+    posix_path = posix_path.rstrip('/')
+    return os.path.join(os.path.dirname(posix_path),
+                        '.{}.checkpoints'.format(os.path.basename(posix_path)))
+
+
+def checkpoint_path(directory, s3_uri, only_sync=True):
+    key = '{}#{}'.format(s3_uri.rstrip('/'), only_sync).encode('utf-8')
+    return os.path.join(directory, hashlib.sha1(key).hexdigest() + SUFFIX)
+
+
+def expire(directory, max_age, now=None):
+    """Delete checkpoints last saved more than max_age seconds ago"""
+    if now is None:
+        now = time.time()
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith(SUFFIX) and \
+                    now - os.stat(path).st_mtime > max_age:
+                os.unlink(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
+
+
+def open_checkpoint(settings, s3_uri, only_sync=True, logger=None):
+    """Return the SyncCheckpoint for s3_uri, resuming a saved one if it
+    has not expired, or None if checkpointing is disabled"""
+    if not settings.checkpoint.enabled:
+        return None
+    directory = settings.checkpoint.dir
+    if directory is None:
+        directory = checkpoint_dir(settings.destination.posix_path)
+    os.makedirs(directory, exist_ok=True)
+    expire(directory, settings.checkpoint.max_age)
+    path = checkpoint_path(directory, s3_uri, only_sync)
+    checkpoint = SyncCheckpoint.load(path, every=settings.checkpoint.every,
+                                     max_done=settings.checkpoint.max_done,
+                                     logger=logger)
+    if checkpoint is None:
+        return SyncCheckpoint(path, s3_uri, every=settings.checkpoint.every,
+                              max_done=settings.checkpoint.max_done,
+                              logger=logger)
+    if logger is not None:
+        logger.info('Resuming {} after {} ({} more done)'.format(
+            s3_uri, '/'.join(checkpoint.cursor or ()), len(checkpoint.done)))
+    return checkpoint
+
+
+class SyncCheckpoint(object):
+    def __init__(self, path, s3_uri, cursor=None, done=(), failed=(),
+                 fanned_out=(), created=None, every=30, max_done=MAX_DONE,
+                 logger=None, clock=time.time):
+        self.path = path
+        self.s3_uri = s3_uri
+        self.cursor = cursor
+        self.cursor_key = None if cursor is None else order_key(cursor)
+        self.done = set(done)
+        self.failed = set(failed)
+        self.fanned_out = set(fanned_out)
+        self.created = clock() if created is None else created
+        self.every = every
+        self.max_done = max_done
+        self.capped = False
+        self.logger = logger
+        self.clock = clock
+        self.saved = self.clock()
+        # Files listed in this run: sequence number -> path parts
+        self.next_seq = 0
+        self.low = -1
+        self.outstanding = dict()
+        self.finished = dict()
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path, every=30, max_done=MAX_DONE, logger=None,
+             clock=time.time):
+        """Read a saved checkpoint, or return None if there is none"""
+        try:
+            with open(path, 'r') as saved:
+                doc = json.load(saved)
+        except (FileNotFoundError, ValueError):
+            return None
+        if doc.get('order') != ORDER:
+            return None
+        cursor = doc.get('cursor')
+        return cls(path, doc['uri'],
+                   cursor=tuple(cursor) if cursor is not None else None,
+                   done=[tuple(parts) for parts in doc.get('done', [])],
+                   failed=[tuple(parts) for parts in doc.get('failed', [])],
+                   fanned_out=doc.get('fanned_out', []),
+                   created=doc.get('created'), every=every,
+                   max_done=max_done, logger=logger, clock=clock)
+
+    def passed(self, parts):
+        """True if the file at parts is at or before the cursor"""
+        if self.cursor is None:
+            return False
+        return order_key(parts) <= self.cursor_key
+
+    def pending(self, parts):
+        """True if the file at parts still needs to be processed"""
+        if parts in self.failed:
+            return True
+        if self.passed(parts):
+            return False
+        return parts not in self.done
+
+    def issue(self, parts):
+        """Register the next file of the listing. Returns its number"""
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.outstanding[seq] = parts
+            return seq
+
+    def complete(self, seq, ok=True):
+        """Mark a listed file done, or failed unless ok, and save if enough
+        time has passed"""
+        with self.lock:
+            parts = self.outstanding.pop(seq)
+            if ok:
+                self.failed.discard(parts)
+            else:
+                self.failed.add(parts)
+            if seq == self.low + 1 or len(self.finished) < self.max_done:
+                self.finished[seq] = parts
+            elif not self.capped:
+                # The cursor cannot pass a file that is not remembered
+                self.capped = True
+                if self.logger is not None:
+                    self.logger.warning(
+                        'Checkpoint holds {} files beyond its cursor; later '
+                        'files will be redone by a retry'.format(
+                            self.max_done))
+            while self.low + 1 in self.finished:
+                self.low += 1
+                self.cursor = self.finished.pop(self.low)
+                self.cursor_key = order_key(self.cursor)
+            self.save_if_due()
+
+    def fan_out(self, name):
+        """Record that subdirectory name was messaged to another execution"""
+        with self.lock:
+            self.fanned_out.add(name)
+            self.save_if_due()
+
+    def save_if_due(self):
+        """Save if enough time has passed since the last save"""
+        with self.lock:
+            if self.clock() - self.saved < self.every:
+                return
+            try:
+                self.save()
+            except OSError as exc:
+                # Losing a save only costs rework on a retry
+                self.saved = self.clock()
+                if self.logger is not None:
+                    self.logger.warning(
+                        'Checkpoint not saved: {}'.format(exc))
+
+    def save(self):
+        """Write the checkpoint atomically"""
+        with self.lock:
+            done = set(self.finished.values()) - self.failed
+            done.update(parts for parts in self.done
+                        if not self.passed(parts))
+            doc = {'uri': self.s3_uri,
+                   'order': ORDER,
+                   'created': self.created,
+                   'saved': self.clock(),
+                   'cursor': self.cursor,
+                   'done': sorted(done, key=order_key),
+                   'failed': sorted(self.failed, key=order_key),
+                   'fanned_out': sorted(self.fanned_out)}
+            temp = self.path + '.tmp'
+            with open(temp, 'w') as out:
+                json.dump(doc, out)
+            os.replace(temp, self.path)
+            self.saved = doc['saved']
+
+    def remove(self):
+        """Delete the checkpoint once the sync has completed"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,147 @@
+import os
+from collections import OrderedDict
+from fingerprint import fingerprint, matches_s3_etag
+
+# Destination directory listings kept in memory by cmpdirs()
+DIRECTORY_CACHE_SIZE = 8
+
+
+def sync_policy(settings):
+    """Return cmpfiles() keyword arguments from config.yml#sync"""
+    return {'mtime': settings.sync.mtime,
+            'size': settings.sync.size,
+            'cksum': settings.sync.cksum}
+
+
+def cmpfiles(posix_src, posix_dest, mtime=True, size=True, cksum=False,
+             index=None, stat_src=None):
+    """Return True if posix_dest is an up-to-date copy of posix_src
+
+    cksum may be False, 'sampled' (True is an alias), or 'full'. If a
+    SyncIndex is passed, it is consulted first so that only the source is
+    stat'd for files already known to be in sync. A source stat_src that
+    is already in hand (e.g. from os.DirEntry.stat()) saves a syscall.
+    """
+    if cksum is True:
+        cksum = 'sampled'
+    if index is not None and index.matches(posix_src, posix_dest,
+                                           stat_src=stat_src, cksum=cksum):
+        return True
+
+    # Existence
+    if not os.path.exists(posix_dest):
+        return False
+
+    if stat_src is None:
+        if not os.path.exists(posix_src):
+            return False
+        stat_src = os.stat(posix_src)
+
+    # Both files exist, so read in POSIX stat
+    stat_dest = os.stat(posix_dest)
+    return cmpstats(posix_src, stat_src, posix_dest, stat_dest, mtime=mtime,
+                    size=size, cksum=cksum, index=index)
+
+
+def cmpstats(posix_src, stat_src, posix_dest, stat_dest, mtime=True,
+             size=True, cksum=False, index=None):
+    """Apply the cmpfiles() policy to stat results that are already known"""
+    if cksum is True:
+        cksum = 'sampled'
+
+    # Modification time (conditional)
+    if mtime:
+        # Mtime on source should never be more recent than
+        # destination, as destination is a result of a copy
+        # operation. We might need to add ability to account
+        # for clock skew but at present we assume source and
+        # destination filesystems are managed by the same host
+        if stat_src.st_mtime > stat_dest.st_mtime:
+            return False
+    # Size (conditional)
+    if size:
+        if stat_src.st_size != stat_dest.st_size:
+            return False
+    # Content fingerprint (conditional). Cheaper checks above run first
+    # so that fingerprinting only happens for plausible matches
+    fp_src = None
+    if cksum:
+        fp_src = fingerprint(posix_src, cksum, stat_src.st_size)
+        if fp_src != fingerprint(posix_dest, cksum, stat_dest.st_size):
+            return False
+
+    # None of the False tests returned so we can safely return True
+    if index is not None:
+        index.record(posix_dest, stat_src, fp_src)
+    return True
+
+
+def cmpobject(entry, posix_dest, etag=False):
+    """Return True if posix_dest is a copy of an object from a native S3
+    listing (s3helpers.S3Entry), by size and optionally by ETag"""
+    try:
+        stat_dest = os.stat(posix_dest)
+    except FileNotFoundError:
+        return False
+    if entry.size != stat_dest.st_size:
+        return False
+    if etag and entry.etag is not None:
+        return matches_s3_etag(posix_dest, entry.etag, stat_dest.st_size)
+    return True
+
+
+def _listdir_entries(dirpath):
+    """Map names to os.DirEntry for the files in dirpath"""
+    entries = dict()
+    try:
+        with os.scandir(dirpath) as listing:
+            for entry in listing:
+                entries[entry.name] = entry
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    return entries
+
+
+def cmpdirs(items, mtime=True, size=True, cksum=False, index=None,
+            cached_dirs=DIRECTORY_CACHE_SIZE):
+    """Compare a stream of files against their destinations in bulk
+
+    items yields (posix_src, stat_src, posix_dest, payload) tuples. Instead
+    of testing existence and stat'ing each destination, every destination
+    directory is read once with os.scandir and joined with the source by
+    name, so a missing destination costs no syscalls and a present one is
+    stat'd through its DirEntry (attributes are usually already cached by
+    NFS READDIRPLUS). The same policy as cmpfiles() decides whether the
+    files match. Yields (payload, same) in input order.
+
+    Items from one source directory should arrive together, as they do from
+    S3Helper.iterdir(); a small LRU of destination listings is kept.
+    """
+    if cksum is True:
+        cksum = 'sampled'
+    listings = OrderedDict()
+    for posix_src, stat_src, posix_dest, payload in items:
+        if index is not None and index.matches(posix_src, posix_dest,
+                                               stat_src=stat_src,
+                                               cksum=cksum):
+            yield payload, True
+            continue
+        dest_dir, dest_name = os.path.split(posix_dest)
+        if dest_dir in listings:
+            listings.move_to_end(dest_dir)
+        else:
+            listings[dest_dir] = _listdir_entries(dest_dir)
+            if len(listings) > cached_dirs:
+                listings.popitem(last=False)
+        entry = listings[dest_dir].get(dest_name)
+        if entry is None:
+            yield payload, False
+            continue
+        # Anything unreadable is reported as different so the copy itself
+        # surfaces the error for this file alone
+        try:
+            same = cmpstats(posix_src, stat_src, posix_dest, entry.stat(),
+                            mtime=mtime, size=size, cksum=cksum, index=index)
+        except OSError:
+            same = False
+        yield payload, same
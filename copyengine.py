@@ -0,0 +1,105 @@
+"""
+In-process parallel copy engine for directory syncs
+
+Rather than messaging one Abaco execution per file, a ParallelCopier runs the
+usual copyfile + routemsg path for each file on a bounded thread pool. The
+number of bytes being copied at once is capped so that a burst of very large
+files cannot overcommit the filesystems, and the number of files queued or
+being copied is capped so that a listing of small files is not queued in
+memory all at once.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from copyfile import copyfile
+from routemsg import routemsg
+
+
+class ParallelCopier(object):
+    def __init__(self, r, workers=16, max_inflight_bytes=None, index=None,
+                 cksum=False, max_inflight_files=None):
+        self.r = r
+        self.index = index
+        self.cksum = cksum
+        self.max_inflight_bytes = max_inflight_bytes
+        if max_inflight_files is None:
+            max_inflight_files = workers * 4
+        self.max_inflight_files = max(workers, max_inflight_files)
+        self.inflight_bytes = 0
+        self.inflight_files = 0
+        self.cond = threading.Condition()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.started = time.time()
+
+    def admits(self, size):
+        """True if a file of size bytes fits within the in-flight limits"""
+        if self.inflight_files >= self.max_inflight_files:
+            return False
+        if self.max_inflight_bytes is None or self.inflight_bytes == 0:
+            return True
+        return self.inflight_bytes + size <= self.max_inflight_bytes
+
+    def submit(self, posix_src, posix_dest, agave_dest, stat_src,
+               done=None):
+        """Queue a copy, blocking while an in-flight limit is reached
+
+        A file larger than the byte limit is admitted once nothing else is
+        in flight so that it cannot stall the engine. done, if given, is
+        called from the copying thread with True once the file has been
+        copied and routed, or with False if that failed.
+        """
+        size = stat_src.st_size
+        with self.cond:
+            while not self.admits(size):
+                self.cond.wait()
+            self.inflight_bytes += size
+            self.inflight_files += 1
+        return self.pool.submit(self._copy, posix_src, posix_dest,
+                                agave_dest, stat_src, done)
+
+    def _copy(self, posix_src, posix_dest, agave_dest, stat_src, done=None):
+        ok = False
+        try:
+            details = copyfile(self.r, posix_src, posix_dest, agave_dest)
+            if self.index is not None:
+                self.index.record_copy(posix_src, posix_dest, stat_src,
+                                       self.cksum)
+            routemsg(self.r, agave_dest, details)
+            ok = True
+        # Reactor.on_failure() exits, which must not take down the pool
+        except BaseException as exc:
+            self.r.logger.error('Copy operation failed for {}: {}'.format(
+                posix_src, exc))
+        finally:
+            with self.cond:
+                self.inflight_bytes -= stat_src.st_size
+                self.inflight_files -= 1
+                if ok:
+                    self.files += 1
+                    self.bytes += stat_src.st_size
+                else:
+                    self.failed += 1
+                self.cond.notify_all()
+        if done is not None:
+            done(ok)
+        return ok
+
+    def join(self):
+        """Wait for all queued copies and return throughput statistics"""
+        self.pool.shutdown(wait=True)
+        elapsed = max(time.time() - self.started, 1e-6)
+        stats = {'files': self.files,
+                 'bytes': self.bytes,
+                 'failed': self.failed,
+                 'seconds': round(elapsed, 3),
+                 'files_per_s': round(self.files / elapsed, 2),
+                 'mb_per_s': round(self.bytes / elapsed / (1024 * 1024), 2)}
+        self.r.logger.info(
+            'Copied {files} files ({bytes} bytes, {failed} failed) in '
+            '{seconds}s: {files_per_s} files/s, {mb_per_s} MB/s'.format(
+                **stats))
+        return stats
@@ -1,47 +1,110 @@
 import os
 import re
 import shutil
-from agavehelpers import resilient_files_pems
+import time
+
+import timing
+from fastcopy import copy_file
+from fingerprint import new_digests
+from grants import grant_manager
+from posixhelpers import get_agave_parents
+
+
+def missing_parent(path):
+    """Return the highest directory in path that does not yet exist"""
+    missing = None
+    while not os.path.isdir(path):
+        missing = path
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return missing
+
+
+def created_agave_parents(created_path, posix_dest, agave_dest):
+    """Agave URIs for directories from created_path down to posix_dest"""
+    # The Agave path of the file is a suffix of its POSIX path, which
+    # gives the POSIX directory corresponding to the storage system root
+    system_end = agave_dest.find('/', len('agave://'))
+    agave_system = agave_dest[:system_end]
+    agave_path = agave_dest[system_end:]
+    if system_end == -1 or not posix_dest.endswith(agave_path):
+        return []
+    posix_base = posix_dest[:-len(agave_path)]
+    created_uri = created_path.replace(posix_base, agave_system, 1)
+    return [ag_uri for ag_uri in get_agave_parents(
+        os.path.dirname(posix_dest), posix_base, agave_system)
+        if ag_uri == created_uri or ag_uri.startswith(created_uri + '/')]
 
 
 def copyfile(r, posix_src, posix_dest, agave_dest=None):
+    """Copy posix_src to posix_dest and grant on it and created parents
+
+    Returns the size, mtime and any transfer.digests of the copied file,
+    for inclusion in routed messages.
+    """
     # Create POSIX directory path at destination
     do_validate = not r.local
+    created_path = None
     try:
         dest_parent = os.path.dirname(posix_dest)
+        created_path = missing_parent(dest_parent)
         os.makedirs(dest_parent, exist_ok=True)
     except Exception as exc:
         r.on_failure('Mkdir {} failed.'.format(dest_parent), exc)
 
-    # Do POSIX copy with forced overwrite
+    # Do POSIX copy with forced overwrite. Unless the legacy shutil engine
+    # is selected, the destination is replaced atomically, by a clone or
+    # link of the source where transfer settings and the filesystem allow.
+    # Checksums are computed from the bytes as they are copied
+    hashers = None
     try:
-        shutil.copy(posix_src, posix_dest)
+        start = time.perf_counter()
+        if r.settings.transfer.engine == 'shutil':
+            shutil.copy(posix_src, posix_dest)
+            copied = os.path.getsize(posix_dest)
+        else:
+            if len(r.settings.transfer.digests) > 0:
+                hashers = new_digests(r.settings.transfer.digests)
+            ranged = r.settings.transfer.ranged
+            strategy, copied = copy_file(
+                posix_src, posix_dest,
+                reflink=r.settings.transfer.reflink,
+                hardlink=r.settings.transfer.hardlink,
+                hashers=hashers,
+                engine=r.settings.transfer.engine,
+                resume=r.settings.transfer.resume,
+                fsync=r.settings.transfer.fsync,
+                ranged_threshold=ranged.threshold,
+                range_size=ranged.range_size,
+                threads=ranged.threads)
+            r.logger.debug('Published {} by {}'.format(posix_dest, strategy))
+            timing.count('copy_' + strategy)
+        timing.record('copy', time.perf_counter() - start, copied)
+        stat_dest = os.stat(posix_dest)
     except Exception as exc:
         r.on_failure('Copy from {} failed.'.format(posix_src), exc)
 
+    details = {'size': stat_dest.st_size, 'mtime': stat_dest.st_mtime}
+    if hashers is not None:
+        details['digests'] = dict((name, hasher.hexdigest())
+                                  for name, hasher in hashers.items())
+
     if agave_dest is not None:
-        # Do Agave permission grants on the copied file
-        for grant in r.settings.destination.grants:
-            r.logger.debug('Grant {} to {} on {}'.format(
-                grant.pem, grant.username, agave_dest))
-            if r.local is False:
-                try:
-                    resilient_files_pems(r.client, agave_dest, grant.username,
-                                         grant.pem, grant.recursive)
-                except Exception:
-                    r.logger.warning('Grant failed for {}'.format(agave_dest))
-
-    # # Do Agave permission grants on created parent directories
-    # if created_path is not None:
-    #     agave_path_list = get_agave_parents(
-    #         created_path, r.settings.destination.posix_path,
-    #         r.settings.destination.bucket)
-    #     r.logger.debug('Do grants for {}'.format(agave_path_list))
-    #     if r.local is False:
-    #         for ag_uri in agave_path_list:
-    #             for grant in r.settings.destination.grants:
-    #                 try:
-    #                     resilient_files_pems(r.client, ag_uri, grant.username,
-    #                                          grant.pem, grant.recursive)
-    #                 except Exception:
-    #                     r.logger.warning('Grant failed for {}'.format(ag_uri))
+        # Do Agave permission grants on the copied file. The grant manager
+        # skips grants already made recently and issues the rest in parallel
+        manager = grant_manager(r)
+        grants = r.settings.destination.grants
+        manager.request(agave_dest, grants)
+
+        # Do Agave permission grants on created parent directories
+        if created_path is not None:
+            agave_path_list = created_agave_parents(
+                created_path, posix_dest, agave_dest)
+            r.logger.debug('Do grants for {}'.format(agave_path_list))
+            for ag_uri in agave_path_list:
+                manager.request(ag_uri, grants)
+        with timing.span('grants'):
+            manager.flush()
+    return details
@@ -0,0 +1,180 @@
+"""
+Suppress repeated upload notifications for the same object
+
+An event is keyed on its URI plus the source size and mtime (or a sampled
+fingerprint). The first execution to see a key claims it in a SQLite file
+shared by all executions; the same key arriving again within the window is
+a duplicate and is counted rather than processed. A claim is released if
+processing fails so that a retried notification is not suppressed. Should
+the store be unusable for an event, for instance locked by another execution
+for longer than the timeout, the event is processed without deduplication.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from fingerprint import fingerprint
+from syncindex import journal_mode
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS events (
+    key TEXT PRIMARY KEY,
+    seen REAL NOT NULL,
+    suppressed INTEGER NOT NULL DEFAULT 0
+)"""
+# Expired events are purged once every this many claims
+EVICT_EVERY = 1000
+
+
+class DedupException(Exception):
+    pass
+
+
+def store_path(posix_path):
+    """Default store location: a dotfile alongside the destination root"""
+    posix_path = posix_path.rstrip('/')
+    return os.path.join(os.path.dirname(posix_path),
+                        '.{}.dedup.sqlite'.format(
+                            os.path.basename(posix_path)))
+
+
+def open_store(settings):
+    """Return a DedupStore configured by config.yml#dedup or None"""
+    if not settings.dedup.window:
+        return None
+    path = settings.dedup.path
+    if path is None:
+        path = store_path(settings.destination.posix_path)
+    return DedupStore(path, settings.dedup.window,
+                      fingerprinted=settings.dedup.fingerprint)
+
+
+def event_key(s3_uri, posix_src, fingerprinted=False):
+    """Key for an upload event on s3_uri whose source file is posix_src"""
+    stat_src = os.stat(posix_src)
+    if fingerprinted:
+        version = fingerprint(posix_src, 'sampled', stat_src.st_size)
+    else:
+        version = '{:x}:{}'.format(stat_src.st_size, stat_src.st_mtime)
+    return '{}#{}'.format(s3_uri, version)
+
+
+def claim_event(store, s3_uri, posix_src, logger=None):
+    """Claim the upload event for s3_uri in store
+
+    Returns (claimed, key). claimed is False for a duplicate. If the store
+    cannot be used, a warning is logged and (True, None) returned so that
+    the event is processed anyway.
+    """
+    try:
+        key = event_key(s3_uri, posix_src, store.fingerprinted)
+        if store.claim(key):
+            return True, key
+        if logger is not None:
+            logger.info('Duplicate event suppressed: {} ({})'.format(
+                s3_uri, store.suppressed(key)))
+        return False, key
+    except (sqlite3.Error, OSError) as exc:
+        if logger is not None:
+            logger.warning('Event deduplication unavailable for {}: {}'.format(
+                s3_uri, exc))
+        return True, None
+
+
+def release_event(store, key, logger=None):
+    """Release a claim, logging rather than raising if the store fails"""
+    try:
+        store.release(key)
+    except sqlite3.Error as exc:
+        if logger is not None:
+            logger.warning('Unable to release {}: {}'.format(key, exc))
+
+
+class DedupStore(object):
+    def __init__(self, path, window, fingerprinted=False, timeout=30,
+                 clock=time.time):
+        self.path = path
+        self.window = window
+        self.fingerprinted = fingerprinted
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.claims = 0
+        try:
+            # Autocommit, so that claim() can take the write lock itself
+            self.db = sqlite3.connect(path, timeout=timeout,
+                                      isolation_level=None,
+                                      check_same_thread=False)
+            # WAL is unsafe on network filesystems (see syncindex.py)
+            mode = journal_mode(path)
+            self.db.execute('PRAGMA journal_mode={}'.format(mode))
+            self.db.execute('PRAGMA synchronous={}'.format(
+                'NORMAL' if mode == 'WAL' else 'FULL'))
+            self.db.execute(SCHEMA)
+        except sqlite3.Error as exc:
+            raise DedupException(
+                'Unable to open dedup store {}'.format(path), exc)
+        self.evict()
+
+    def claim(self, key):
+        """Return True if key is new within the window, else count it as a
+        suppressed duplicate and return False"""
+        now = self.clock()
+        with self.lock:
+            self.claims += 1
+            # Take the write lock up front so that concurrent executions
+            # cannot both claim the same key
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute(
+                    'SELECT seen FROM events WHERE key = ?',
+                    (key, )).fetchone()
+                if row is not None and now - row[0] < self.window:
+                    self.db.execute(
+                        'UPDATE events SET suppressed = suppressed + 1 '
+                        'WHERE key = ?', (key, ))
+                    claimed = False
+                else:
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO events VALUES (?, ?, 0)',
+                        (key, now))
+                    claimed = True
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        if self.claims % EVICT_EVERY == 0:
+            try:
+                self.evict()
+            except sqlite3.Error:
+                # Housekeeping only; the next eviction catches up
+                pass
+        return claimed
+
+    def release(self, key):
+        """Forget a claim so the event can be processed again"""
+        with self.lock:
+            self.db.execute('DELETE FROM events WHERE key = ?', (key, ))
+
+    def evict(self):
+        """Delete events older than the window. Returns the number deleted"""
+        with self.lock:
+            return self.db.execute('DELETE FROM events WHERE seen < ?',
+                                   (self.clock() - self.window, )).rowcount
+
+    def suppressed(self, key=None):
+        """Duplicates suppressed for key, or in total, within the window"""
+        with self.lock:
+            if key is None:
+                row = self.db.execute(
+                    'SELECT SUM(suppressed) FROM events').fetchone()
+            else:
+                row = self.db.execute(
+                    'SELECT suppressed FROM events WHERE key = ?',
+                    (key, )).fetchone()
+        if row is None or row[0] is None:
+            return 0
+        return row[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,59 @@
+"""
+Split syncs of very large directories across executions
+
+A directory sync normally lists and dispatches its whole tree from one
+execution. When the tree is large, fan_out() returns its immediate
+subdirectories instead: the execution messages the actor once per
+subdirectory, each of which is synced the same way by another execution, and
+only handles the files at its own level. Messages carry fanout_depth so that
+splitting stops max_depth levels below the original URI, and a directory
+with more than max_width subdirectories is synced whole rather than
+flooding the actor.
+"""
+import os
+
+
+def survey(path, min_entries=0, min_depth=0):
+    """True if the tree under path holds at least min_entries entries or
+    has directories min_depth levels down. Reads only as far as it must"""
+    entries = 0
+    # Depth-first, so that deep trees are recognized early
+    stack = [(path, 0)]
+    while len(stack) > 0:
+        dirpath, depth = stack.pop()
+        if min_depth > 0 and depth >= min_depth:
+            return True
+        try:
+            with os.scandir(dirpath) as listing:
+                for entry in listing:
+                    entries += 1
+                    if min_entries > 0 and entries >= min_entries:
+                        return True
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, depth + 1))
+        except OSError:
+            continue
+    return False
+
+
+def fan_out(settings, posix_src, depth=0):
+    """Return the subdirectories of posix_src, as os.DirEntry sorted by
+    name, to sync in executions of their own, or None to sync the whole
+    tree in this one"""
+    fanout = settings.batch.fanout
+    if settings.batch.mode != 'message' or depth >= fanout.max_depth:
+        return None
+    if fanout.min_entries <= 0 and fanout.min_depth <= 0:
+        return None
+    try:
+        with os.scandir(posix_src) as listing:
+            # Symlinked directories are not followed, as in S3Helper.iterdir
+            subdirs = [entry for entry in listing
+                       if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return None
+    if len(subdirs) == 0 or len(subdirs) > fanout.max_width:
+        return None
+    if not survey(posix_src, fanout.min_entries, fanout.min_depth):
+        return None
+    return sorted(subdirs, key=lambda entry: entry.name)
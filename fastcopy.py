@@ -0,0 +1,433 @@
+"""
+Atomic, kernel-accelerated file copies
+
+Data is written to a hidden temporary file in the destination directory and
+published with an atomic rename, so a reader (or a later size comparison)
+never sees a partially written destination. Bytes are moved with
+os.copy_file_range() where the kernel and filesystems support it, then
+os.sendfile(), and finally with plain chunked reads tuned by posix_fadvise().
+An interrupted copy leaves its temporary file behind and can be resumed.
+The temporary file is locked while it is written; a copy that finds it
+locked, as when two executions handle the same notification, writes to a
+temporary file of its own instead.
+
+Files of at least ranged_threshold bytes are instead split into byte ranges
+that several threads copy at once into a preallocated temporary file, each
+with positional I/O (copy_file_range or pread/pwrite), which lets a single
+large file use the aggregate bandwidth of parallel filesystems. Ranged
+copies start over rather than resume.
+
+Copies that must also produce checksums use chunked reads, whichever engine
+is selected, and pass each block through the hashers on its way, so the
+source is read only once.
+
+When source and destination are on the same filesystem, copy_file() first
+tries to share data instead of copying it: a reflink (FICLONE) clone, which
+is copy-on-write, then, if allowed, a hard link, which makes the destination
+the same inode as the source.
+"""
+import errno
+import fcntl
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 8 * 1024 * 1024
+RANGE_SIZE = 256 * 1024 * 1024
+RANGE_THREADS = 8
+PART_SUFFIX = '.uploads-manager.part'
+# A ranged copy fills its file out of order, so it is never resumed and
+# gets its own temporary file
+RANGED_PART_SUFFIX = '.uploads-manager.ranged.part'
+ENGINES = ('auto', 'copy_file_range', 'sendfile', 'chunked')
+
+STRATEGIES = ('reflink', 'hardlink', 'copy')
+# ioctl request to clone a whole file (linux/fs.h)
+FICLONE = 0x40049409
+
+# Errors that mean "this mechanism is unavailable here", not "copy failed"
+FALLBACK_ERRNOS = set([errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                       errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF])
+# Likewise for clones (ENOTTY: no FICLONE support) and links (EPERM:
+# protected_hardlinks, EMLINK: too many links to the source)
+SHARE_FALLBACK_ERRNOS = FALLBACK_ERRNOS | set([errno.ENOTTY, errno.EPERM,
+                                               errno.EMLINK])
+# flock() on filesystems mounted without lock support
+NOLOCK_ERRNOS = set([errno.ENOSYS, errno.ENOLCK, errno.EOPNOTSUPP])
+
+
+class FastCopyException(IOError):
+    pass
+
+
+def temp_path(posix_dest, suffix=PART_SUFFIX):
+    """Path of the in-progress copy for posix_dest"""
+    return os.path.join(os.path.dirname(posix_dest),
+                        '.' + os.path.basename(posix_dest) + suffix)
+
+
+def unique_temp_path(posix_dest):
+    """Path of a temporary file for posix_dest that no other copy uses"""
+    return '{}.{}'.format(temp_path(posix_dest), uuid.uuid4().hex[:12])
+
+
+def open_part(posix_dest, suffix=PART_SUFFIX):
+    """Open and lock the temporary file for posix_dest
+
+    Returns (fd, path, shared). shared is True for the usual temporary
+    file, which may hold an earlier partial copy. If another process holds
+    it, or the filesystem does not support locks (Lustre mounted noflock,
+    NFS mounted nolock), a new uniquely named file is created instead and
+    shared is False. The lock is released when fd is closed.
+    """
+    part_path = temp_path(posix_dest, suffix)
+    while True:
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            break
+        except OSError as exc:
+            os.close(fd)
+            if exc.errno not in NOLOCK_ERRNOS:
+                raise
+            break
+        try:
+            # The file may have been published or removed by its previous
+            # holder between open() and flock()
+            same = os.path.samestat(os.fstat(fd), os.stat(part_path))
+        except FileNotFoundError:
+            same = False
+        if same:
+            return fd, part_path, True
+        os.close(fd)
+    part_path = unique_temp_path(posix_dest)
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    return fd, part_path, False
+
+
+def _copy_file_range(fd_in, fd_out, offset, end):
+    while offset < end:
+        copied = os.copy_file_range(fd_in, fd_out,
+                                    min(CHUNK_SIZE, end - offset),
+                                    offset, offset)
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+
+def _sendfile(fd_in, fd_out, offset, end):
+    os.lseek(fd_out, offset, os.SEEK_SET)
+    while offset < end:
+        sent = os.sendfile(fd_out, fd_in, offset,
+                           min(CHUNK_SIZE, end - offset))
+        if sent == 0:
+            break
+        offset += sent
+    return offset
+
+
+def _chunked(fd_in, fd_out, offset, end, hashers=None):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd_in, offset, end - offset,
+                         os.POSIX_FADV_SEQUENTIAL)
+    os.lseek(fd_out, offset, os.SEEK_SET)
+    while offset < end:
+        block = os.pread(fd_in, min(CHUNK_SIZE, end - offset), offset)
+        if not block:
+            break
+        view = memoryview(block)
+        while len(view) > 0:
+            written = os.write(fd_out, view)
+            view = view[written:]
+        if hashers is not None:
+            for hasher in hashers.values():
+                hasher.update(block)
+        if hasattr(os, 'posix_fadvise'):
+            # Copied data will not be read again by this process
+            os.posix_fadvise(fd_in, offset, len(block),
+                             os.POSIX_FADV_DONTNEED)
+        offset += len(block)
+    return offset
+
+
+def _pread_pwrite(fd_in, fd_out, offset, end):
+    # Positional reads and writes, so threads can share the descriptors
+    while offset < end:
+        block = os.pread(fd_in, min(CHUNK_SIZE, end - offset), offset)
+        if not block:
+            break
+        view = memoryview(block)
+        position = offset
+        while len(view) > 0:
+            written = os.pwrite(fd_out, view, position)
+            view = view[written:]
+            position += written
+        offset += len(block)
+    return offset
+
+
+def copy_range_at(fd_in, fd_out, offset, end, engine='auto'):
+    """Copy bytes [offset, end) like copy_range(), but without moving
+    either file offset, so that threads may copy ranges of the same pair
+    of descriptors at once. The sendfile and chunked engines both use
+    pread/pwrite here"""
+    if engine in ('auto', 'copy_file_range') and \
+            hasattr(os, 'copy_file_range'):
+        try:
+            return _copy_file_range(fd_in, fd_out, offset, end)
+        except OSError as exc:
+            if exc.errno not in FALLBACK_ERRNOS or engine != 'auto':
+                raise
+            # Bytes already copied are simply copied again
+    return _pread_pwrite(fd_in, fd_out, offset, end)
+
+
+def preallocate(fd, size):
+    """Reserve size bytes for fd, or at least set its length"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as exc:
+            if exc.errno not in FALLBACK_ERRNOS:
+                raise
+    os.ftruncate(fd, size)
+
+
+def ranges(size, range_size=RANGE_SIZE):
+    """Split size bytes into [start, end) ranges of at most range_size"""
+    return [(start, min(start + range_size, size))
+            for start in range(0, size, max(1, range_size))]
+
+
+def copy_ranged(fd_in, fd_out, size, range_size=RANGE_SIZE,
+                threads=RANGE_THREADS, engine='auto'):
+    """Copy the first size bytes between descriptors, one range per task"""
+    if engine not in ENGINES:
+        raise ValueError('Unknown copy engine {}. Valid: {}'.format(
+            engine, ', '.join(ENGINES)))
+    preallocate(fd_out, size)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [(end, pool.submit(copy_range_at, fd_in, fd_out,
+                                     start, end, engine))
+                   for start, end in ranges(size, range_size)]
+        for end, future in futures:
+            if future.result() != end:
+                return future.result()
+    return size
+
+
+def copy_range(fd_in, fd_out, offset, end, engine='auto', hashers=None):
+    """Copy bytes [offset, end) between file descriptors at the same offsets
+
+    Returns the offset reached, which is less than end if the source is
+    shorter than expected. If hashers ({name: hash object}) is given, the
+    bytes are copied by chunked reads so that each hasher sees them too.
+    """
+    if engine not in ENGINES:
+        raise ValueError('Unknown copy engine {}. Valid: {}'.format(
+            engine, ', '.join(ENGINES)))
+    if hashers is not None:
+        return _chunked(fd_in, fd_out, offset, end, hashers)
+    if engine in ('auto', 'copy_file_range') and \
+            hasattr(os, 'copy_file_range'):
+        try:
+            return _copy_file_range(fd_in, fd_out, offset, end)
+        except OSError as exc:
+            if exc.errno not in FALLBACK_ERRNOS or engine != 'auto':
+                raise
+            # Nothing is written by a failing call, but earlier calls may
+            # have made progress
+            offset = os.fstat(fd_out).st_size
+    if engine in ('auto', 'sendfile') and hasattr(os, 'sendfile'):
+        try:
+            return _sendfile(fd_in, fd_out, offset, end)
+        except OSError as exc:
+            if exc.errno not in FALLBACK_ERRNOS or engine != 'auto':
+                raise
+            offset = os.fstat(fd_out).st_size
+    return _chunked(fd_in, fd_out, offset, end)
+
+
+def hash_prefix(path, length, hashers):
+    """Feed the first length bytes of path to hashers"""
+    with open(path, 'rb') as f:
+        while length > 0:
+            block = f.read(min(CHUNK_SIZE, length))
+            if not block:
+                break
+            for hasher in hashers.values():
+                hasher.update(block)
+            length -= len(block)
+
+
+def resume_offset(part_path, stat_src):
+    """Return how many bytes of an existing partial copy can be kept
+
+    A partial copy is only trusted if it was last written after the source
+    was last modified and is no longer than the source.
+    """
+    try:
+        stat_part = os.stat(part_path)
+    except FileNotFoundError:
+        return 0
+    if stat_part.st_size <= stat_src.st_size and \
+            stat_part.st_mtime >= stat_src.st_mtime:
+        return stat_part.st_size
+    return 0
+
+
+def copy_atomic(posix_src, posix_dest, engine='auto', resume=True,
+                fsync=False, ranged_threshold=0, range_size=RANGE_SIZE,
+                threads=RANGE_THREADS, hashers=None):
+    """Copy posix_src to posix_dest via a temporary file and atomic rename
+
+    Returns the number of bytes copied in this call, which excludes any
+    bytes kept from a resumed partial copy. Sources of at least
+    ranged_threshold bytes (0 disables) are copied with copy_ranged().
+    Hash objects in hashers ({name: hash object}) are updated with the
+    whole content of the file as it is copied; hashed copies are never
+    ranged, since hashes need the bytes in order.
+    """
+    fd_in = os.open(posix_src, os.O_RDONLY)
+    try:
+        stat_src = os.fstat(fd_in)
+        ranged = 0 < ranged_threshold <= stat_src.st_size and \
+            threads > 1 and hashers is None
+        suffix = RANGED_PART_SUFFIX if ranged else PART_SUFFIX
+        fd_out, part_path, shared = open_part(posix_dest, suffix)
+        try:
+            offset = 0
+            if resume and shared and not ranged:
+                offset = resume_offset(part_path, stat_src)
+            if hashers is not None and offset > 0:
+                # Kept bytes are read back from the partial copy
+                hash_prefix(part_path, offset, hashers)
+            os.ftruncate(fd_out, offset)
+            if ranged:
+                reached = copy_ranged(fd_in, fd_out, stat_src.st_size,
+                                      range_size, threads, engine)
+                if os.fstat(fd_in).st_size != stat_src.st_size:
+                    reached = os.fstat(fd_in).st_size
+            else:
+                reached = copy_range(fd_in, fd_out, offset,
+                                     stat_src.st_size, engine, hashers)
+            if reached != stat_src.st_size:
+                raise FastCopyException(
+                    '{} changed size during copy ({} != {})'.format(
+                        posix_src, reached, stat_src.st_size))
+            if fsync:
+                os.fsync(fd_out)
+            # Match shutil.copy(), which copies permission bits
+            shutil.copymode(posix_src, part_path)
+            # Published while still locked, so no other copy can write to
+            # the file in between
+            os.replace(part_path, posix_dest)
+        except BaseException:
+            if ranged or not shared:
+                # Nobody can resume a ranged or uniquely named partial copy
+                os.unlink(part_path)
+            raise
+        finally:
+            os.close(fd_out)
+    finally:
+        os.close(fd_in)
+    return stat_src.st_size - offset
+
+
+def same_filesystem(posix_src, posix_dest):
+    """True if posix_dest would be created on the filesystem of posix_src"""
+    try:
+        return os.stat(posix_src).st_dev == \
+            os.stat(os.path.dirname(posix_dest)).st_dev
+    except OSError:
+        return False
+
+
+def reflink_atomic(posix_src, posix_dest, fsync=False):
+    """Clone posix_src to posix_dest via a temporary file and atomic rename
+
+    Returns False, leaving posix_dest alone, if the filesystem cannot clone
+    posix_src. The clone is made in a file of its own, so a partial copy
+    that copy_atomic() could resume is kept if cloning fails.
+    """
+    part_path = unique_temp_path(posix_dest)
+    fd_in = os.open(posix_src, os.O_RDONLY)
+    try:
+        fd_out = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o644)
+        try:
+            fcntl.ioctl(fd_out, FICLONE, fd_in)
+            if fsync:
+                os.fsync(fd_out)
+            shutil.copymode(posix_src, part_path)
+            os.replace(part_path, posix_dest)
+        except BaseException as exc:
+            os.unlink(part_path)
+            if isinstance(exc, OSError) and \
+                    exc.errno in SHARE_FALLBACK_ERRNOS:
+                return False
+            raise
+        finally:
+            os.close(fd_out)
+    finally:
+        os.close(fd_in)
+    return True
+
+
+def link_atomic(posix_src, posix_dest):
+    """Hard link posix_src as posix_dest, replacing it atomically
+
+    Returns False if the filesystem will not link posix_src there.
+    """
+    try:
+        if os.path.samefile(posix_src, posix_dest):
+            return True
+    except FileNotFoundError:
+        pass
+    part_path = unique_temp_path(posix_dest)
+    try:
+        os.link(posix_src, part_path)
+    except OSError as exc:
+        if exc.errno not in SHARE_FALLBACK_ERRNOS:
+            raise
+        return False
+    try:
+        os.replace(part_path, posix_dest)
+    finally:
+        # rename() does nothing if posix_dest became a link to posix_src
+        # in the meantime, leaving the link behind
+        if os.path.lexists(part_path):
+            os.unlink(part_path)
+    return True
+
+
+def copy_file(posix_src, posix_dest, reflink=True, hardlink=False,
+              hashers=None, **kwargs):
+    """Publish posix_src at posix_dest by the cheapest strategy allowed
+
+    On a shared filesystem a reflink clone is tried if reflink is set, then
+    a hard link if hardlink is set; otherwise, or if neither works, the
+    bytes are copied by copy_atomic(), which takes the remaining keyword
+    arguments. Returns (strategy, bytes copied), strategy being one of
+    STRATEGIES. hashers are updated with the content of the file whatever
+    the strategy, by reading it if it was not copied.
+    """
+    if (reflink or hardlink) and same_filesystem(posix_src, posix_dest):
+        strategy = None
+        if reflink and reflink_atomic(posix_src, posix_dest,
+                                      kwargs.get('fsync', False)):
+            strategy = 'reflink'
+        elif hardlink and link_atomic(posix_src, posix_dest):
+            strategy = 'hardlink'
+        if strategy is not None:
+            if hashers is not None:
+                hash_prefix(posix_dest, os.stat(posix_dest).st_size,
+                            hashers)
+            return strategy, 0
+    return 'copy', copy_atomic(posix_src, posix_dest, hashers=hashers,
+                               **kwargs)
@@ -0,0 +1,144 @@
+"""
+Fast content fingerprints for comparing source and destination files
+
+The sampled fingerprint follows the imohash approach: hash the file size plus
+fixed-size blocks from the head, middle, and tail of the file so that the cost
+of a comparison is constant regardless of file size. The full fingerprint
+streams every byte through xxhash (falling back to blake2b when xxhash is not
+installed) and is meant for cases where a sampled check is not trustworthy.
+"""
+import os
+import hashlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Bytes read from each of the head, middle, and tail of a file
+SAMPLE_SIZE = 16 * 1024
+# Files smaller than this are hashed in full by sampled_fingerprint
+SAMPLE_THRESHOLD = 128 * 1024
+# Read size for streaming hashes
+BLOCK_SIZE = 1024 * 1024
+
+MODES = ('sampled', 'full')
+
+# Multipart part sizes tried when checking an S3 multipart ETag. 8 MiB is
+# the boto3/aws-cli default and 5 MiB the S3 minimum
+MULTIPART_SIZES = (8 * 1024 * 1024, 16 * 1024 * 1024, 5 * 1024 * 1024)
+
+
+def new_hasher():
+    """Return a fast non-cryptographic hash object"""
+    if xxhash is not None:
+        return xxhash.xxh64()
+    return hashlib.blake2b(digest_size=8)
+
+
+def new_digests(names):
+    """Return {name: hash object} for digest algorithms named in names
+
+    Names are hashlib algorithms such as md5 or sha256, or xxhash
+    algorithms such as xxh64 or xxh3_128, which need xxhash installed.
+    """
+    digests = dict()
+    for name in names:
+        if name.startswith('xxh'):
+            if xxhash is None or not hasattr(xxhash, name):
+                raise ValueError('Digest {} needs xxhash'.format(name))
+            digests[name] = getattr(xxhash, name)()
+        elif name in hashlib.algorithms_available:
+            digests[name] = hashlib.new(name)
+        else:
+            raise ValueError('Unknown digest algorithm {}'.format(name))
+    return digests
+
+
+def sampled_fingerprint(path, size=None, sample_size=SAMPLE_SIZE,
+                        sample_threshold=SAMPLE_THRESHOLD):
+    """Return a constant-time fingerprint of size + head/middle/tail blocks"""
+    if size is None:
+        size = os.stat(path).st_size
+    h = new_hasher()
+    with open(path, 'rb') as f:
+        if size < sample_threshold:
+            h.update(f.read())
+        else:
+            h.update(f.read(sample_size))
+            f.seek(size // 2)
+            h.update(f.read(sample_size))
+            f.seek(size - sample_size)
+            h.update(f.read(sample_size))
+    return '{:x}:{}'.format(size, h.hexdigest())
+
+
+def full_fingerprint(path, size=None, block_size=BLOCK_SIZE):
+    """Return a fingerprint computed by streaming the entire file"""
+    if size is None:
+        size = os.stat(path).st_size
+    h = new_hasher()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return '{:x}:{}'.format(size, h.hexdigest())
+
+
+def fingerprint(path, mode='sampled', size=None):
+    """Return the fingerprint of path using the named mode"""
+    if mode == 'sampled':
+        return sampled_fingerprint(path, size=size)
+    elif mode == 'full':
+        return full_fingerprint(path, size=size)
+    raise ValueError('Unknown fingerprint mode {}. Valid: {}'.format(
+        mode, ', '.join(MODES)))
+
+
+def s3_etag(path, part_size=None, block_size=BLOCK_SIZE):
+    """Return the ETag S3 would give path if uploaded in parts of part_size
+
+    Without part_size this is the MD5 of the whole file, which is the ETag
+    of a single-part upload.
+    """
+    whole = hashlib.md5()
+    parts = list()
+    part = hashlib.md5()
+    in_part = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            if part_size is None:
+                whole.update(block)
+                continue
+            while len(block) > 0:
+                take = block[:part_size - in_part]
+                part.update(take)
+                in_part += len(take)
+                block = block[len(take):]
+                if in_part == part_size:
+                    parts.append(part.digest())
+                    part = hashlib.md5()
+                    in_part = 0
+    if part_size is None:
+        return whole.hexdigest()
+    if in_part > 0 or len(parts) == 0:
+        parts.append(part.digest())
+    return '{}-{}'.format(hashlib.md5(b''.join(parts)).hexdigest(), len(parts))
+
+
+def matches_s3_etag(path, etag, size=None, part_sizes=MULTIPART_SIZES):
+    """Return True if path has the content described by an S3 ETag"""
+    if '-' not in etag:
+        return s3_etag(path) == etag
+    count = int(etag.rsplit('-', 1)[1])
+    if size is None:
+        size = os.stat(path).st_size
+    # The smallest whole MiB part size giving count parts is also tried
+    mib = 1024 * 1024
+    derived = -(-size // count // mib) * mib if count > 0 else None
+    for part_size in list(part_sizes) + [derived]:
+        if part_size is None or part_size <= 0 or \
+                -(-size // part_size) != count:
+            continue
+        if s3_etag(path, part_size) == etag:
+            return True
+    return False
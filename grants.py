@@ -0,0 +1,139 @@
+"""
+Coalesced and cached Agave permission grants
+
+Grants are queued with request() and issued by flush(). Before anything is
+sent, grants already made within the cache TTL are dropped, recursive grants
+are pruned to the fewest paths that cover the request (optionally collapsing
+siblings into their common parent), and the remainder are issued from a
+bounded thread pool.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agavehelpers import resilient_files_pems
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def _covers(parent, path):
+    return path == parent or path.startswith(parent.rstrip('/') + '/')
+
+
+def coalesce(paths, floor=None):
+    """Reduce paths to the fewest that cover all of them recursively
+
+    Paths beneath another path in the set are dropped. If a floor is given,
+    the remaining paths are collapsed into their common parent as long as
+    that parent lies strictly beneath the floor.
+    """
+    kept = list()
+    for path in sorted(set(paths)):
+        if len(kept) > 0 and _covers(kept[-1], path):
+            continue
+        kept.append(path)
+    if floor is not None and len(kept) > 1:
+        parent = os.path.commonpath(kept)
+        # os.path.commonpath collapses the // in agave://
+        if parent.startswith('agave:/') and not parent.startswith('agave://'):
+            parent = 'agave://' + parent[len('agave:/'):]
+        if _covers(floor, parent) and parent.rstrip('/') != floor.rstrip('/'):
+            kept = [parent]
+    return kept
+
+
+class GrantManager(object):
+    def __init__(self, client, ttl=3600, workers=8, floor=None, logger=None,
+                 local=False, clock=time.monotonic):
+        self.client = client
+        self.ttl = ttl
+        self.floor = floor
+        self.logger = logger
+        self.local = local
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.cache = dict()
+        self.pending = dict()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def _cached(self, key, now):
+        expires = self.cache.get(key)
+        return expires is not None and expires > now
+
+    def _covered(self, agave_uri, username, pem, now):
+        # A live recursive grant on agave_uri or any parent covers it
+        path = agave_uri
+        while True:
+            if self._cached((path, username, pem, True), now):
+                return True
+            parent = os.path.dirname(path)
+            if parent == path or parent.endswith(':/'):
+                return False
+            path = parent
+
+    def request(self, agave_uri, grants):
+        """Queue grants (objects with username, pem, recursive) on agave_uri"""
+        now = self.clock()
+        with self.lock:
+            for grant in grants:
+                key = (agave_uri, grant.username, grant.pem, grant.recursive)
+                if self._cached(key, now) or self._covered(
+                        agave_uri, grant.username, grant.pem, now):
+                    continue
+                self.pending.setdefault(
+                    (grant.username, grant.pem, grant.recursive),
+                    set()).add(agave_uri)
+
+    def _grant(self, agave_uri, username, pem, recursive):
+        if self.logger is not None:
+            self.logger.debug('Grant {} to {} on {}'.format(
+                pem, username, agave_uri))
+        if self.local is False:
+            try:
+                resilient_files_pems(self.client, agave_uri, username, pem,
+                                     recursive)
+            except Exception:
+                if self.logger is not None:
+                    self.logger.warning('Grant failed for {}'.format(
+                        agave_uri))
+                return False
+        with self.lock:
+            self.cache[(agave_uri, username, pem, recursive)] = \
+                self.clock() + self.ttl
+        return True
+
+    def flush(self):
+        """Issue all pending grants. Returns (issued, failed)"""
+        with self.lock:
+            pending, self.pending = self.pending, dict()
+        futures = list()
+        for (username, pem, recursive), uris in pending.items():
+            if recursive:
+                uris = coalesce(uris, self.floor)
+            for agave_uri in uris:
+                futures.append(self.pool.submit(
+                    self._grant, agave_uri, username, pem, recursive))
+        results = [future.result() for future in futures]
+        return results.count(True), results.count(False)
+
+    def grant(self, agave_uris, grants):
+        """Request and immediately issue grants on each of agave_uris"""
+        for agave_uri in agave_uris:
+            self.request(agave_uri, grants)
+        return self.flush()
+
+
+def grant_manager(r):
+    """Return the GrantManager for this process, creating it on first use"""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = GrantManager(r.client,
+                                    ttl=r.settings.grant_manager.ttl,
+                                    workers=r.settings.grant_manager.workers,
+                                    floor=r.settings.destination.bucket,
+                                    logger=r.logger,
+                                    local=r.local)
+    return _MANAGER
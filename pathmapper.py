@@ -0,0 +1,67 @@
+"""
+Map bucket-relative upload paths to Agave URIs and POSIX paths in bulk
+
+Files in a directory sync share a handful of parent directories, so the
+safened Agave path and both POSIX directories are worked out once per parent
+and kept in an LRU cache; each file then only safens and joins its own name.
+This relies on safen_path() treating path components independently, which
+holds for the unicode and whitespace substitutions it makes.
+"""
+import os
+from functools import lru_cache
+
+from datacatalog.utils import safen_path
+
+AGAVE_PREFIX = 'agave://data-sd2e-community/'
+DIRECTORY_CACHE_SIZE = 65536
+
+
+def _safen(path):
+    return safen_path(path, no_unicode=True, no_spaces=True)
+
+
+class PathMapper(object):
+    def __init__(self, sh, ah, safen=True, agave_prefix=AGAVE_PREFIX,
+                 cache_size=DIRECTORY_CACHE_SIZE):
+        self.sh = sh
+        self.ah = ah
+        self.safen = safen
+        self.agave_prefix = agave_prefix
+        self.directory = lru_cache(maxsize=cache_size)(self._directory)
+
+    def _directory(self, s3_dirpath):
+        # Prefixes for names in a directory: safened Agave path, POSIX
+        # source and POSIX destination, each ending in a separator
+        ag_dirpath = _safen(s3_dirpath) if self.safen else s3_dirpath
+        return (os.path.join(ag_dirpath, ''),
+                os.path.join(self.sh.mapped_catalog_path(s3_dirpath), ''),
+                os.path.join(self.ah.mapped_posix_path(
+                    os.path.join('/', ag_dirpath)), ''))
+
+    def map(self, s3_full_relpath):
+        """Map one bucket-relative path
+
+        Returns (ag_full_relpath, ag_uri, posix_src, posix_dest), the same
+        as safening the whole path and mapping it with the helpers.
+        """
+        s3_dirpath, sep, s3_name = s3_full_relpath.rpartition('/')
+        ag_dirpath, src_dir, dest_dir = self.directory(s3_dirpath)
+        ag_name = _safen(s3_name) if self.safen else s3_name
+        ag_full_relpath = ag_dirpath + ag_name
+        return (ag_full_relpath,
+                self.agave_prefix + ag_full_relpath,
+                src_dir + s3_name,
+                dest_dir + ag_name)
+
+    def map_uri(self, s3_uri):
+        """Map an s3:// URI. Returns the same tuple as map()"""
+        s3_bucket, srcpath, srcfile = self.sh.from_s3_uri(s3_uri)
+        return self.map(os.path.join(s3_bucket, srcpath, srcfile))
+
+    def map_many(self, s3_full_relpaths):
+        """Yield (s3_full_relpath, mapping) for each bucket-relative path"""
+        for s3_full_relpath in s3_full_relpaths:
+            yield s3_full_relpath, self.map(s3_full_relpath)
+
+    def cache_info(self):
+        return self.directory.cache_info()
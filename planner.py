@@ -0,0 +1,217 @@
+"""
+Plan a directory sync without copying anything, then execute the plan
+
+    python planner.py plan s3://uploads/path/to/dir [--output plan.jsonl]
+    python planner.py execute plan.jsonl [--workers 32]
+
+Planning merge-joins the source tree behind an s3:// URI with the matching
+tree under destination.posix_path and writes one JSON line per source file
+with its action (copy, rename, or skip) and byte count, followed by a summary
+line with totals and an estimated copy time. A 'rename' is a copy whose
+destination name was safened. Execution copies, grants and routes every
+copy/rename line of a plan on the in-process ParallelCopier.
+
+Both trees are walked on the POSIX mount with walk_sorted(), which orders
+the source by safened name so it can be merge-joined with the destination.
+Sources only reachable through the S3 API are not supported and are
+refused rather than planned as empty.
+"""
+import argparse
+import json
+import os
+import sys
+
+import yaml
+from attrdict import AttrDict
+
+from cmpfiles import cmpstats, sync_policy
+from posixhelpers import walk_sorted
+from s3helpers import S3Helper
+
+ACTIONS = ('copy', 'rename', 'skip')
+
+
+def load_settings(path='config.yml'):
+    with open(path, 'r') as conf:
+        return AttrDict(yaml.safe_load(conf))
+
+
+def _safen_name(settings):
+    if not settings.safen_paths:
+        return None
+    from datacatalog.utils import safen_path
+
+    def safen(name):
+        return safen_path(name, no_unicode=True, no_spaces=True)
+    return safen
+
+
+def _single_entry(root, name, name_key=None):
+    # The walk_sorted() record for one file in root, without walking root
+    try:
+        with os.scandir(root) as listing:
+            entries = [entry for entry in listing
+                       if entry.name == name and not entry.is_dir()]
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    for entry in entries:
+        yield (name if name_key is None else name_key(name), ), entry
+
+
+def plan(settings, s3_uri, out, sh=None):
+    """Write a JSONL sync plan for s3_uri to the file-like out
+
+    Returns the summary dictionary, which is also written as the last line.
+    Raises ValueError if the source is not on the POSIX mount.
+    """
+    if sh is None:
+        sh = S3Helper()
+    safen = _safen_name(settings)
+    policy = sync_policy(settings)
+    s3_bucket, srcpath, srcfile = sh.from_s3_uri(s3_uri.rstrip('/'))
+    subpath = os.path.join(srcpath, srcfile)
+    src_root = sh.mapped_catalog_path(os.path.join(s3_bucket, subpath))
+    if not os.path.exists(src_root):
+        raise ValueError('{} is not on the POSIX mount at {}; S3-native '
+                         'sources cannot be planned'.format(s3_uri, src_root))
+    dest_subpath = subpath
+    if safen is not None:
+        dest_subpath = '/'.join(safen(part) for part in subpath.split('/'))
+    dest_root = os.path.join(settings.destination.posix_path, dest_subpath)
+    agave_root = os.path.join(settings.destination.bucket, dest_subpath)
+
+    summary = {'uri': s3_uri, 'files': 0, 'bytes': 0, 'dest_only': 0}
+    for action in ACTIONS:
+        summary[action + '_files'] = 0
+        summary[action + '_bytes'] = 0
+
+    if os.path.isfile(src_root):
+        # Plan a single file as a one-entry listing of its parent
+        srcname = os.path.basename(src_root)
+        src_root = os.path.dirname(src_root)
+        dest_root = os.path.dirname(dest_root)
+        agave_root = os.path.dirname(agave_root)
+        subpath = os.path.dirname(subpath)
+        source = _single_entry(src_root, srcname, safen)
+        destination = _single_entry(
+            dest_root, srcname if safen is None else safen(srcname))
+    else:
+        source = walk_sorted(src_root, safen)
+        destination = walk_sorted(dest_root)
+    src_item = next(source, None)
+    dest_item = next(destination, None)
+    while src_item is not None:
+        src_parts, src_entry = src_item
+        # Advance the destination side up to the current source key
+        while dest_item is not None and dest_item[0] < src_parts:
+            summary['dest_only'] += 1
+            dest_item = next(destination, None)
+        stat_src = src_entry.stat()
+        posix_dest = os.path.join(dest_root, *src_parts)
+        action = 'copy'
+        if dest_item is not None and dest_item[0] == src_parts:
+            if cmpstats(src_entry.path, stat_src, posix_dest,
+                        dest_item[1].stat(), **policy):
+                action = 'skip'
+            dest_item = next(destination, None)
+        relpath = os.path.relpath(src_entry.path, src_root)
+        if action == 'copy' and os.path.join(*src_parts) != relpath:
+            action = 'rename'
+        decision = {'action': action,
+                    'uri': 's3://' + os.path.join(s3_bucket, subpath,
+                                                  relpath),
+                    'src': src_entry.path,
+                    'dest': posix_dest,
+                    'agave_uri': os.path.join(agave_root, *src_parts),
+                    'bytes': stat_src.st_size}
+        out.write(json.dumps(decision) + '\n')
+        summary['files'] += 1
+        summary['bytes'] += stat_src.st_size
+        summary[action + '_files'] += 1
+        summary[action + '_bytes'] += stat_src.st_size
+        src_item = next(source, None)
+    while dest_item is not None:
+        summary['dest_only'] += 1
+        dest_item = next(destination, None)
+
+    to_copy_files = summary['copy_files'] + summary['rename_files']
+    to_copy_bytes = summary['copy_bytes'] + summary['rename_bytes']
+    throughput = settings.planner.throughput_mb_s * 1024 * 1024
+    transfer_seconds = to_copy_bytes / throughput
+    file_seconds = to_copy_files * settings.planner.per_file_seconds
+    summary['estimated_seconds'] = round(transfer_seconds + file_seconds, 1)
+    out.write(json.dumps({'summary': summary}) + '\n')
+    return summary
+
+
+def read_plan(plan_path):
+    """Yield the decisions in a plan file, skipping its summary"""
+    with open(plan_path, 'r') as plan_file:
+        for line in plan_file:
+            line = line.strip()
+            if line == '':
+                continue
+            decision = json.loads(line)
+            if 'summary' not in decision:
+                yield decision
+
+
+def execute(r, plan_path, workers=None):
+    """Copy, grant and route every copy/rename decision in a plan"""
+    from copyengine import ParallelCopier
+    from syncindex import open_index
+    if workers is None:
+        workers = r.settings.batch.workers
+    index = open_index(r.settings)
+    copier = ParallelCopier(
+        r, workers=workers,
+        max_inflight_bytes=r.settings.batch.max_inflight_bytes,
+        max_inflight_files=r.settings.batch.max_inflight_files,
+        index=index, cksum=r.settings.sync.cksum)
+    for decision in read_plan(plan_path):
+        if decision['action'] == 'skip':
+            continue
+        try:
+            stat_src = os.stat(decision['src'])
+        except OSError as exc:
+            r.logger.error('Unable to stat {}: {}'.format(
+                decision['src'], exc))
+            continue
+        copier.submit(decision['src'], decision['dest'],
+                      decision['agave_uri'], stat_src)
+    return copier.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--config', default='config.yml')
+    commands = parser.add_subparsers(dest='command')
+    plan_cmd = commands.add_parser('plan', help='Write a sync plan')
+    plan_cmd.add_argument('uri', help='s3:// URI of a directory or file')
+    plan_cmd.add_argument('--output', default=None,
+                          help='Plan file (default: stdout)')
+    exec_cmd = commands.add_parser('execute', help='Carry out a sync plan')
+    exec_cmd.add_argument('plan', help='Plan file written by plan')
+    exec_cmd.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        settings = load_settings(args.config)
+        try:
+            if args.output is None:
+                summary = plan(settings, args.uri, sys.stdout)
+            else:
+                with open(args.output, 'w') as out:
+                    summary = plan(settings, args.uri, out)
+        except ValueError as exc:
+            parser.error(str(exc))
+        print(json.dumps(summary, indent=2), file=sys.stderr)
+    elif args.command == 'execute':
+        from reactors.runtime import Reactor
+        execute(Reactor(), args.plan, args.workers)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -45,8 +45,41 @@ def get_agave_parents(posix_dest_path, posix_base, bucket):
     '''Get list of Agave uri paths including self and parents from POSIX path'''
     # Strip filesystem mount path
     path_list = []
-    agave_path = posix_dest_path.replace(posix_base, bucket)
-    while agave_path != bucket:
+    if not posix_dest_path.startswith(posix_base):
+        return path_list
+    agave_path = posix_dest_path.replace(posix_base, bucket, 1)
+    while agave_path != bucket and agave_path.startswith(bucket):
         path_list.append(agave_path)
         agave_path = os.path.dirname(agave_path)
     return path_list
+
+
+def walk_sorted(root, name_key=None, parts=(), recurse=True):
+    '''Yield (parts, entry) for files under root in sorted path order
+
+    parts is the tuple of path components below root, each transformed by
+    name_key if given. Files and directories are visited interleaved in
+    order of their transformed names, so the output is sorted by parts and
+    two trees can be merge-joined on it. Without recurse, only the files
+    directly in root are yielded.'''
+    try:
+        with os.scandir(root) as listing:
+            entries = list(listing)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    if name_key is None:
+        keyed = [(entry.name, entry) for entry in entries]
+    else:
+        keyed = [(name_key(entry.name), entry) for entry in entries]
+    keyed.sort(key=lambda item: item[0])
+    for name, entry in keyed:
+        if entry.is_dir(follow_symlinks=False):
+            if not recurse:
+                continue
+            for item in walk_sorted(entry.path, name_key, parts + (name, )):
+                yield item
+        elif entry.is_dir():
+            # Symlinked directories are not followed, as in S3Helper.iterdir
+            continue
+        else:
+            yield parts + (name, ), entry
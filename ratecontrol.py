@@ -0,0 +1,124 @@
+"""
+Adaptive pacing of self-messages sent during directory syncs
+
+A token bucket releases submissions at a rate that is adjusted additively
+upward while Abaco responds quickly and multiplicatively downward (AIMD) when
+send_message is slow, fails, or returns no executionId. Failures also hold
+off all submissions for an exponentially growing, bounded period.
+"""
+import json
+import threading
+import time
+
+
+class SubmissionController(object):
+    def __init__(self, min_rate, max_rate, initial_rate=None, burst=1,
+                 increase=1.0, decrease=0.5, latency_target=2.0,
+                 max_backoff=10, logger=None, log_every=100,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        if initial_rate is None:
+            initial_rate = self.min_rate
+        self.rate = min(max(float(initial_rate), self.min_rate),
+                        self.max_rate)
+        self.burst = max(float(burst), 1.0)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.max_backoff = max_backoff
+        self.logger = logger
+        self.log_every = log_every
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.last_refill = clock()
+        self.hold_until = 0
+        self.failures = 0
+        self.submitted = 0
+        self.failed = 0
+        self.slow = 0
+        self.latency = None
+
+    def _refill(self, now):
+        earned = (now - self.last_refill) * self.rate
+        self.tokens = min(self.burst, self.tokens + earned)
+        self.last_refill = now
+
+    def acquire(self):
+        """Block until a submission may be sent. Returns seconds waited"""
+        with self.lock:
+            now = self.clock()
+            self._refill(now)
+            wait = max(0, self.hold_until - now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            # Reserve the token now; a negative balance is repaid by refill
+            self.tokens -= 1
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    def record(self, latency, ok=True):
+        """Report the outcome of a submission so the rate can adapt"""
+        with self.lock:
+            self.submitted += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                # Exponentially weighted moving average
+                self.latency = 0.8 * self.latency + 0.2 * latency
+            if ok and latency <= self.latency_target:
+                self.failures = 0
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                changed = False
+            else:
+                if ok:
+                    self.slow += 1
+                else:
+                    self.failed += 1
+                    self.failures += 1
+                    backoff = min(self.max_backoff,
+                                  (2 ** self.failures) / self.rate)
+                    self.hold_until = self.clock() + backoff
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                changed = True
+            log = changed or self.submitted % self.log_every == 0
+        if log:
+            self.log_state()
+
+    def state(self):
+        return {'rate': round(self.rate, 3),
+                'tokens': round(self.tokens, 3),
+                'latency': None if self.latency is None
+                else round(self.latency, 3),
+                'submitted': self.submitted,
+                'failed': self.failed,
+                'slow': self.slow,
+                'consecutive_failures': self.failures}
+
+    def log_state(self):
+        if self.logger is not None:
+            self.logger.info('Submission controller: {}'.format(
+                json.dumps(self.state())))
+
+
+def from_settings(settings, logger=None):
+    """Build a SubmissionController bounded by config.yml#batch
+
+    One submission every batch.sleep_duration is the slowest rate and
+    batch.size submissions per batch.sleep_duration the fastest. Pacing
+    starts at one submission every batch.task_sleep_duration.
+    """
+    batch = settings.batch
+    return SubmissionController(
+        min_rate=1.0 / batch.sleep_duration,
+        max_rate=float(batch.size) / batch.sleep_duration,
+        initial_rate=1.0 / batch.task_sleep_duration,
+        burst=batch.rate.burst,
+        increase=batch.rate.increase,
+        decrease=batch.rate.decrease,
+        latency_target=batch.rate.latency_target,
+        max_backoff=batch.sleep_duration,
+        logger=logger)
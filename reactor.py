@@ -3,39 +3,43 @@ Copy from (TACC) S3 storage to Agave-managed storage and route filename to
 downstream processors based on rules defined in config.yml#routings
 """
 import json
-import re
 import os
-import shutil
 import sys
 
-from pprint import pprint
-from time import sleep
-from random import random, shuffle
+from functools import partial
+from time import sleep, monotonic
+from random import random
 from attrdict import AttrDict
-from datetime import datetime, timedelta
-from agavepy.agave import AgaveError
 
-from datacatalog.agavehelpers import AgaveHelper, AgaveHelperException
-from datacatalog.identifiers import abaco
-from datacatalog.utils import safen_path
+from datacatalog.agavehelpers import AgaveHelper
 
-from reactors.runtime import Reactor, agaveutils, process
-from agavehelpers import resilient_files_pems
-from s3helpers import S3Helper, S3HelperException
+from reactors.runtime import Reactor
+from s3helpers import S3Helper
+from pathmapper import PathMapper
 from copyfile import copyfile
+from cmpfiles import cmpfiles, cmpdirs, cmpobject, sync_policy
+from syncindex import open_index, SyncIndexException
+from dedup import open_store, claim_event, release_event, DedupException
 from routemsg import routemsg
+import timing
 
-from posixhelpers import get_posix_paths, get_posix_mkdir, get_posix_copy
-from posixhelpers import get_agave_dest, get_agave_parents
+# Modules only needed for directory syncs or self-messaging (copyengine,
+# schedulers, ratecontrol, checkpoint, fanout, agavepy) are imported where
+# they are used so that single-file executions start faster
 
 EXCLUDES = ['.placeholder$']
 
 
 def main():
+    r = Reactor()
+    handle_message(r, setup(r), read_message(r))
+
+
+def read_message(r):
     # Minimal Message Body:
     # { "uri": "s3://uploads/path/to/target.txt"}
-
-    r = Reactor()
+    # Batched Message Body (sent by directory syncs to self):
+    # { "uris": ["s3://uploads/path/to/a.txt", "s3://uploads/path/to/b.txt"]}
     m = AttrDict(r.context.message_dict)
     # ! This code fixes an edge case and will be moved lower in the stack
     if m == {}:
@@ -44,167 +48,405 @@ def main():
             m = jsonmsg
         except Exception:
             pass
+    return m
+
 
+def setup(r):
+    """Build the helpers and stores shared by every message r handles"""
+    sh = S3Helper()
+    ah = AgaveHelper(r.client)
+    mapper = PathMapper(sh, ah, safen=r.settings.safen_paths)
+
+    sync_kwargs = sync_policy(r.settings)
+    try:
+        index = open_index(r.settings)
+    except SyncIndexException as exc:
+        r.logger.warning('Sync index unavailable: {}'.format(exc))
+        index = None
+    sync_kwargs['index'] = index
+    try:
+        dedup = open_store(r.settings)
+    except DedupException as exc:
+        r.logger.warning('Event deduplication unavailable: {}'.format(exc))
+        dedup = None
+    return {'sh': sh, 'mapper': mapper, 'sync_kwargs': sync_kwargs,
+            'dedup': dedup}
+
+
+def handle_message(r, context, m):
+    """Validate and process one message using helpers from setup()"""
     # Use JSONschema-based message validator
     if not r.validate_message(m):
         r.on_failure('Message was invalid', None)
 
+    only_sync = m.get('sync', True)
+    generated_by = m.get('generated_by', [])
+    fanout_depth = m.get('fanout_depth', 0)
+    s3_uris = m.get('uris', [])
+    if len(s3_uris) == 0:
+        s3_uris = [m.get('uri')]
+
+    # Batches come from directory syncs, which have already compared
+    # source and destination, so only upload notifications are deduplicated
+    dedup = None
+    if len(m.get('uris', [])) == 0:
+        dedup = context['dedup']
+
+    failed = list()
+    try:
+        with timing.span('execution'):
+            for s3_uri in s3_uris:
+                try:
+                    process_uri(r, context['sh'], context['mapper'], s3_uri,
+                                only_sync, generated_by,
+                                context['sync_kwargs'], dedup, fanout_depth)
+                # r.on_failure() exits. In a batch, one failed URI must not
+                # cost the rest of the batch, so they are reported at the end
+                except (Exception, SystemExit) as exc:
+                    if len(s3_uris) == 1:
+                        raise
+                    failed.append(s3_uri)
+                    timing.count('uri_failures')
+                    r.logger.error('Sync failed for {}: {!r}'.format(
+                        s3_uri, exc))
+            if len(failed) > 0:
+                r.on_failure('{} of {} URIs were not synced: {}'.format(
+                    len(failed), len(s3_uris), ', '.join(failed)), None)
+    finally:
+        # One structured line per execution, even if it failed
+        directories = timing.summary()['counters'].get('directories', 0)
+        timing.log_summary(
+            r, histograms=directories > 0 and r.settings.logs.histograms,
+            uris=len(s3_uris), sync=only_sync)
+
+
+def process_uri(r, sh, mapper, s3_uri, only_sync, generated_by, sync_kwargs,
+                dedup=None, fanout_depth=0):
     # Rename m.Key so it makes semantic sense elsewhere in the code
-    s3_uri = m.get('uri')
     if s3_uri.endswith('/'):
         s3_uri = s3_uri[:-1]
-    only_sync = m.get('sync', True)
-    generated_by = m.get('generated_by', [])
     r.logger.info('Received S3 URI {}'.format(s3_uri))
-
-    sh = S3Helper()
-    ah = AgaveHelper(r.client)
+    index = sync_kwargs['index']
 
     # Map POSIX source and destination
-    s3_bucket, srcpath, srcfile = sh.from_s3_uri(s3_uri)
+    with timing.span('parse_uri'):
+        s3_bucket, srcpath, srcfile = sh.from_s3_uri(s3_uri)
     # print(s3_bucket, srcpath, srcfile)
     s3_full_relpath = os.path.join(s3_bucket, srcpath, srcfile)
-    if r.settings.safen_paths:
-        # Munge out unicode characters on upload. Default for safen_path
-        # also transforms spaces into hyphen character
-        ag_full_relpath = safen_path(s3_full_relpath,
-                                     no_unicode=True,
-                                     no_spaces=True)
-        if ag_full_relpath != s3_full_relpath:
-            r.logger.warning('Safened path: {} => {}'.format(
-                s3_full_relpath, ag_full_relpath))
-    else:
-        ag_full_relpath = s3_full_relpath
-
-    ag_uri = 'agave://data-sd2e-community/' + ag_full_relpath
+    ag_full_relpath, ag_uri, posix_src, posix_dest = map_paths(
+        r, mapper, s3_full_relpath)
     r.logger.info('Generated Tapis resource: {}'.format(ag_uri))
-
-    posix_src = sh.mapped_catalog_path(s3_full_relpath)
-    posix_dest = ah.mapped_posix_path(os.path.join('/', ag_full_relpath))
     # agave_full_path = agave_dest
     r.logger.debug('POSIX src: {}'.format(posix_src))
     r.logger.debug('POSIX dst: {}'.format(posix_dest))
 
-    def cmpfiles(posix_src, posix_dest, mtime=True, size=True, cksum=False):
-
-        # Existence
-        if not os.path.exists(posix_dest):
-            return False
-
-        if not os.path.exists(posix_src):
-            return False
-
-        # Both files exist, so read in POSIX stat
-        stat_src = os.stat(posix_src)
-        stat_dest = os.stat(posix_dest)
-
-        # Modification time (conditional)
-        if mtime:
-            # Mtime on source should never be more recent than
-            # destination, as destination is a result of a copy
-            # operation. We might need to add ability to account
-            # for clock skew but at present we assume source and
-            # destination filesystems are managed by the same host
-            if stat_src.st_mtime > stat_dest.st_mtime:
-                return False
-        # Size (conditional)
-        if size:
-            if stat_src.st_size != stat_dest.st_size:
-                return False
-        if cksum:
-            # Not implemented
-            # TODO Implement very fast hasher instead of sha256 for sync
-            #      1. https://github.com/kalafut/py-imohash
-            #      2. https://pypi.org/project/xxhash/
-            raise NotImplementedError(
-                'Checksum comparison is not yet implemented')
-
-        # None of the False tests returned so we can safely return True
-        return True
-
     to_process = list()
     # Is the source physically a FILE?
     if sh.isfile(posix_src):
-        # If in sync mode, check if source and destination differ
-        if only_sync is True and cmpfiles(posix_src, posix_dest, mtime=False):
-            # if os.path.exists(posix_dest) and only_sync is True:
-            r.logger.debug('Compared: src == dest {}, {}'.format(
-                posix_src, posix_dest))
-        else:
-            # Not in sync mode - force overwrite destination with source
-            r.logger.debug('Compared: src != dest {}, {}'.format(
-                posix_src, posix_dest))
-            copyfile(r, posix_src, posix_dest, ag_uri)
-            routemsg(r, ag_uri)
-    elif sh.isdir(posix_src):
+        # Repeat notifications for an unchanged object are dropped unless
+        # a copy was explicitly forced
+        key = None
+        if dedup is not None and only_sync is True:
+            claimed, key = claim_event(dedup, s3_uri, posix_src, r.logger)
+            if not claimed:
+                timing.count('duplicates_suppressed')
+                return
+        try:
+            sync_file(r, posix_src, posix_dest, ag_uri, only_sync,
+                      sync_kwargs)
+        except BaseException:
+            if key is not None:
+                release_event(dedup, key, r.logger)
+            raise
+    # Without a POSIX view of the source, the S3 API may still list it
+    elif sh.isdir(posix_src) or sh.use_native(posix_src, s3_bucket):
         # It's a directory. Recurse through it and launch file messages to self
         r.logger.debug('Directory found: {}'.format(posix_src))
-        to_process = sh.listdir(posix_src,
-                                recurse=True,
-                                bucket=s3_bucket,
-                                directories=False)
-        pprint(to_process)
-        r.logger.info('Sync tasks found: {}'.format(len(to_process)))
-
-        # List to_list is constructed in POSIX ls order. Adding a shuffle
-        # spreads the processing evenly over all files
-        shuffle(to_process)
+        timing.count('directories')
+        from copyengine import ParallelCopier
+        import schedulers
+        import ratecontrol
+        from checkpoint import open_checkpoint
+        from fanout import fan_out
+        # Very large trees are split: subdirectories are messaged to new
+        # executions and only the files at this level are synced here
+        subdirs = fan_out(r.settings, posix_src, fanout_depth)
+        recurse = subdirs is None
+        try:
+            checkpoint = open_checkpoint(r.settings, s3_uri, only_sync,
+                                         r.logger)
+        except OSError as exc:
+            r.logger.warning('Checkpoint unavailable: {}'.format(exc))
+            checkpoint = None
+        # Checkpoints need a deterministic listing order
+        listing = sh.iterdir(posix_src,
+                             recurse=recurse,
+                             bucket=s3_bucket,
+                             directories=False,
+                             ordered=checkpoint is not None)
+
+        def mapped(listing):
+            for procpath, entry in listing:
+                if checkpoint is not None:
+                    parts = tuple(os.path.relpath(
+                        procpath, s3_full_relpath).split('/'))
+                    # Files done in an earlier attempt are skipped before
+                    # being stat'd
+                    if not checkpoint.pending(parts):
+                        continue
+                try:
+                    with timing.span('stat'):
+                        stat_src = entry.stat()
+                except OSError as exc:
+                    r.logger.error('Unable to stat {}: {}'.format(
+                        procpath, exc))
+                    continue
+                seq = None
+                if checkpoint is not None:
+                    seq = checkpoint.issue(parts)
+                proc_relpath, proc_uri, proc_src, proc_dest = map_paths(
+                    r, mapper, procpath)
+                yield (proc_src, stat_src, proc_dest,
+                       (procpath, proc_uri, proc_src, proc_dest, stat_src,
+                        seq), entry)
+
+        def completed(seqs, ok=True):
+            if checkpoint is not None:
+                for seq in seqs:
+                    checkpoint.complete(seq, ok)
+
+        if only_sync is True and sh.use_native(posix_src, s3_bucket):
+            # Listed objects match by size and, if content is checked, by
+            # ETag, since the source may not be readable here
+            compared = ((payload, cmpobject(entry, proc_dest,
+                                            etag=bool(sync_kwargs['cksum'])))
+                        for proc_src, stat_src, proc_dest, payload, entry
+                        in mapped(listing))
+        elif only_sync is True:
+            # Compare against each destination directory in one pass
+            compared = cmpdirs((item[:4] for item in mapped(listing)),
+                               **sync_kwargs)
+        else:
+            compared = ((item[3], False) for item in mapped(listing))
+
+        # Listing is streamed in POSIX ls order. Reordering it within a
+        # bounded window spreads the processing evenly over all files, or
+        # gets small or routed files to downstream actors sooner
+        order = schedulers.from_settings(
+            r.settings, uri=lambda item: item[0][1],
+            size=lambda item: item[0][4].st_size)
+        to_process = order(compared)
+        tasks_found = 0
         batch_sub = 0
-        for procpath in to_process:
+        copier = None
+        if r.settings.batch.mode == 'local':
+            # Copy in this execution instead of messaging self
+            copier = ParallelCopier(
+                r, workers=r.settings.batch.workers,
+                max_inflight_bytes=r.settings.batch.max_inflight_bytes,
+                max_inflight_files=r.settings.batch.max_inflight_files,
+                index=index, cksum=sync_kwargs['cksum'])
+        chunk = list()
+        chunk_seqs = list()
+        failures = 0
+
+        controller = None
+        if r.settings.batch.rate.adaptive:
+            controller = ratecontrol.from_settings(r.settings, r.logger)
+
+        def dispatch_chunk(s3_msg_uris, seqs):
+            nonlocal failures
             try:
-                r.logger.debug('Processing {}'.format(procpath))
-                # Here is the meat of the directory syncing behavior
-                posix_src = sh.mapped_catalog_path(procpath)
-                posix_dest = ah.mapped_posix_path(os.path.join('/', procpath))
-                if (only_sync is False or
-                        cmpfiles(posix_src, posix_dest, mtime=False) is False):
-                    r.logger.info('Copying {}'.format(procpath))
-                    actor_id = r.uid
-                    resp = dict()
-                    s3_msg_uri = 's3://' + procpath
-                    message = {
-                        'uri': s3_msg_uri,
-                        'generated_by': generated_by,
-                        'sync': only_sync
-                    }
-
-                    if r.local is False:
-                        try:
-                            r.logger.debug(
-                                'Messaging {} with copy request'.format(
-                                    actor_id))
-                            resp = r.send_message(actor_id,
-                                                  message,
-                                                  retryMaxAttempts=3,
-                                                  ignoreErrors=False)
-                            if 'executionId' in resp:
-                                r.logger.info('Message response: {}'.format(
-                                    resp['executionId']))
-                            else:
-                                raise AgaveError('Message failed')
-                        except Exception:
-                            raise
-                    else:
-                        r.logger.debug(message)
-
-                    batch_sub += 1
-                    # Always sleep a little bit between task submissions
-                    sleep(random() * r.settings.batch.task_sleep_duration)
-                    # Sleep a little longer every N submissions
-                    if batch_sub > r.settings.batch.size:
-                        batch_sub = 0
-                        if r.settings.batch.randomize_sleep:
-                            sleep(random() * r.settings.batch.sleep_duration)
-                        else:
-                            sleep(r.settings.batch.sleep_duration)
-                else:
-                    r.logger.debug('Copy not required for {}'.format(procpath))
+                dispatch(s3_msg_uris)
             except Exception as exc:
+                failures += 1
+                completed(seqs, ok=False)
                 r.logger.error('Copy operation failed for {}: {}'.format(
-                    ag_full_relpath, exc))
+                    ', '.join(s3_msg_uris), exc))
+                return
+            completed(seqs)
+
+        def dispatch(s3_msg_uris, depth=None):
+            nonlocal batch_sub
+            if controller is not None:
+                # Pace submissions by observed send_message behavior
+                controller.acquire()
+                start = monotonic()
+                try:
+                    send_sync_message(r, s3_msg_uris, only_sync, generated_by,
+                                      depth)
+                except Exception:
+                    controller.record(monotonic() - start, ok=False)
+                    raise
+                controller.record(monotonic() - start, ok=True)
+                return
+            send_sync_message(r, s3_msg_uris, only_sync, generated_by, depth)
+            batch_sub += 1
+            # Always sleep a little bit between task submissions
+            sleep(random() * r.settings.batch.task_sleep_duration)
+            # Sleep a little longer every N submissions
+            if batch_sub > r.settings.batch.size:
+                batch_sub = 0
+                if r.settings.batch.randomize_sleep:
+                    sleep(random() * r.settings.batch.sleep_duration)
+                else:
+                    sleep(r.settings.batch.sleep_duration)
+
+        # Whatever happens to the listing, copies already submitted are
+        # waited for and the checkpoint is kept for a retry
+        finished = False
+        try:
+            if subdirs is not None:
+                r.logger.info('Fanning out {} subdirectories of {}'.format(
+                    len(subdirs), s3_uri))
+                for entry in subdirs:
+                    if checkpoint is not None and \
+                            entry.name in checkpoint.fanned_out:
+                        # Messaged by an earlier attempt
+                        continue
+                    sub_uri = 's3://' + os.path.join(s3_full_relpath, entry.name)
+                    try:
+                        dispatch([sub_uri], fanout_depth + 1)
+                        timing.count('fanout_messages')
+                        if checkpoint is not None:
+                            checkpoint.fan_out(entry.name)
+                    except Exception as exc:
+                        failures += 1
+                        r.logger.error('Fan-out failed for {}: {}'.format(
+                            sub_uri, exc))
+
+            for (procpath, proc_uri, posix_src, posix_dest,
+                    stat_src, seq), same in to_process:
+                tasks_found += 1
+                timing.count('files_listed')
+                try:
+                    r.logger.debug('Processing {}'.format(procpath))
+                    # Here is the meat of the directory syncing behavior
+                    if same is False:
+                        r.logger.info('Copying {}'.format(procpath))
+                        timing.count('files_to_copy')
+                        if copier is not None:
+                            # Done only once the copy has succeeded; failures
+                            # are counted from the copier's statistics
+                            copier.submit(posix_src, posix_dest, proc_uri,
+                                          stat_src,
+                                          done=partial(completed, [seq]))
+                            continue
+                        chunk.append('s3://' + procpath)
+                        chunk_seqs.append(seq)
+                        if len(chunk) >= r.settings.batch.uris_per_message:
+                            pending, chunk = chunk, list()
+                            pending_seqs, chunk_seqs = chunk_seqs, list()
+                            dispatch_chunk(pending, pending_seqs)
+                    else:
+                        r.logger.debug('Copy not required for {}'.format(procpath))
+                        completed([seq])
+                except Exception as exc:
+                    failures += 1
+                    completed([seq], ok=False)
+                    r.logger.error('Copy operation failed for {}: {}'.format(
+                        ag_full_relpath, exc))
+            # Send the remainder that did not fill a whole chunk
+            if len(chunk) > 0:
+                dispatch_chunk(chunk, chunk_seqs)
+            finished = True
+        finally:
+            if copier is not None:
+                failures += copier.join()['failed']
+            if checkpoint is not None:
+                # Keep the checkpoint so that a retry only redoes what
+                # failed
+                if failures > 0 or not finished:
+                    try:
+                        checkpoint.save()
+                    except OSError as exc:
+                        r.logger.warning('Checkpoint not saved: {}'.format(
+                            exc))
+                else:
+                    checkpoint.remove()
+        r.logger.info('Sync tasks found: {}'.format(tasks_found))
+        if controller is not None:
+            controller.log_state()
     else:
         r.on_failure('Process failed and {} was not synced'.format(posix_src))
 
 
+def sync_file(r, posix_src, posix_dest, ag_uri, only_sync, sync_kwargs):
+    """Copy, grant and route one file unless it is already in sync"""
+    index = sync_kwargs['index']
+    # If in sync mode, check if source and destination differ
+    with timing.span('compare'):
+        same = only_sync is True and cmpfiles(posix_src, posix_dest,
+                                              **sync_kwargs)
+    if same:
+        # if os.path.exists(posix_dest) and only_sync is True:
+        r.logger.debug('Compared: src == dest {}, {}'.format(
+            posix_src, posix_dest))
+    else:
+        # Not in sync mode - force overwrite destination with source
+        r.logger.debug('Compared: src != dest {}, {}'.format(
+            posix_src, posix_dest))
+        with timing.span('stat'):
+            stat_src = os.stat(posix_src)
+        details = copyfile(r, posix_src, posix_dest, ag_uri)
+        if index is not None:
+            index.record_copy(posix_src, posix_dest, stat_src,
+                              sync_kwargs['cksum'])
+        routemsg(r, ag_uri, details)
+
+
+def map_paths(r, mapper, s3_full_relpath):
+    """Map a bucket-relative path to its Agave path, URI and POSIX paths"""
+    # Munge out unicode characters on upload if safen_paths is set. Default
+    # for safen_path also transforms spaces into hyphen character
+    with timing.span('map_paths'):
+        ag_full_relpath, ag_uri, posix_src, posix_dest = mapper.map(
+            s3_full_relpath)
+    if ag_full_relpath != s3_full_relpath:
+        r.logger.warning('Safened path: {} => {}'.format(
+            s3_full_relpath, ag_full_relpath))
+    return ag_full_relpath, ag_uri, posix_src, posix_dest
+
+
+def send_sync_message(r, s3_uris, only_sync, generated_by, fanout_depth=None):
+    """Message this actor to sync one or more file URIs, or a directory
+    URI split off at fanout_depth"""
+    actor_id = r.uid
+    resp = dict()
+    message = {
+        'generated_by': generated_by,
+        'sync': only_sync
+    }
+    if fanout_depth is not None:
+        message['fanout_depth'] = fanout_depth
+    if len(s3_uris) == 1:
+        message['uri'] = s3_uris[0]
+    else:
+        message['uris'] = s3_uris
+
+    if r.local is False:
+        from agavepy.agave import AgaveError
+        try:
+            r.logger.debug(
+                'Messaging {} with copy request for {} files'.format(
+                    actor_id, len(s3_uris)))
+            with timing.span('sync_message'):
+                resp = r.send_message(actor_id,
+                                      message,
+                                      retryMaxAttempts=3,
+                                      ignoreErrors=False)
+            timing.count('sync_message_uris', len(s3_uris))
+            if 'executionId' in resp:
+                r.logger.info('Message response: {}'.format(
+                    resp['executionId']))
+            else:
+                raise AgaveError('Message failed')
+        except Exception:
+            raise
+    else:
+        r.logger.debug(message)
+    return resp
+
+
 if __name__ == '__main__':
-    main()
+    timing.run_profiled(main)
@@ -1,27 +1,124 @@
 import json
 import re
+import threading
+from concurrent.futures import Future, TimeoutError
 from pprint import pprint
 
+import timing
 
-def routemsg(r, agave_dest):
-    # Kick off downstream Reactors by filename glob match
+# Seconds to wait for a downstream actor to accept a message, unless
+# linked_reactors.<route>.timeout says otherwise
+DEFAULT_TIMEOUT = 60
+
+_TABLES = {}
+
+
+class RoutingTable(object):
+    """Routes from config.yml#routings compiled into a single matcher
+
+    Each route's patterns are joined into one alternation inside an optional
+    lookahead with a named group, so one match() reports every route whose
+    patterns would be found by re.search() on the path.
+    """
+
+    def __init__(self, routings, linked_reactors):
+        self.routes = list()
+        lookaheads = list()
+        for idx, (routename, globs) in enumerate(routings.items()):
+            linked = linked_reactors.get(routename, {})
+            self.routes.append({'name': routename,
+                                'group': 'r{}'.format(idx),
+                                'actor_id': linked.get('id'),
+                                'ignore_err': linked.get('ignore_err', False),
+                                'timeout': linked.get('timeout',
+                                                      DEFAULT_TIMEOUT)})
+            alternation = '|'.join('(?:{})'.format(g) for g in globs)
+            lookaheads.append('(?:(?=.*?(?P<r{}>{})))?'.format(
+                idx, alternation))
+        self.matcher = re.compile(''.join(lookaheads), re.DOTALL)
+
+    def match(self, path):
+        """Return the routes whose patterns match path"""
+        groups = self.matcher.match(path).groupdict()
+        return [route for route in self.routes
+                if groups[route['group']] is not None]
+
+
+def routing_table(settings):
+    """Return the RoutingTable for settings, built once per process"""
+    key = json.dumps([settings.routings, settings.linked_reactors],
+                     sort_keys=True)
+    if key not in _TABLES:
+        _TABLES[key] = RoutingTable(settings.routings,
+                                    settings.linked_reactors)
+    return _TABLES[key]
+
+
+def _send(r, actor_id, message):
+    """Send message to actor_id from a daemon thread and return a Future
+
+    The client call takes no timeout, so a route that times out is only
+    given up on: its send keeps running and may still be delivered. Daemon
+    threads let the execution exit without waiting for it.
+    """
+    future = Future()
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(r.send_message(actor_id, message=message))
+        except Exception as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=target, name='routemsg', daemon=True).start()
+    return future
+
+
+def routemsg(r, agave_dest, details=None):
+    with timing.span('route'):
+        _routemsg(r, agave_dest, details)
+
+
+def _routemsg(r, agave_dest, details=None):
+    # Kick off downstream Reactors by filename glob match. details from
+    # copyfile() (size, mtime, digests) save them from re-reading the file
     message = {'uri': agave_dest}
-    for routename, globs in r.settings.routings.items():
-        actor_id = r.settings.linked_reactors.get(routename, {}).get('id')
-        for glob in globs:
-            if re.compile(glob).search(agave_dest):
-                r.logger.debug('Route: dest={}, content={}'.format(actor_id, message))
-                try:
-                    if r.local is False:
-                        resp = r.send_message(actor_id, message=message)
-                        if resp is not None:
-                            if 'executionId' in resp:
-                                r.logger.debug(
-                                    'Route: executionId={}, actorId={}'.format(
-                                        resp['executionId'], actor_id))
-                    else:
-                        pprint(message)
-                    break
-                except Exception as exc:
-                    r.on_failure('Route: Failed to launch {}:{} for {}'.format(
-                        routename, actor_id, agave_dest), exc)
+    if details is not None:
+        message.update(details)
+    routes = routing_table(r.settings).match(agave_dest)
+    timing.count('route_messages', len(routes))
+    if r.local is not False:
+        for route in routes:
+            r.logger.debug('Route: dest={}, content={}'.format(
+                route['actor_id'], message))
+            pprint(message)
+        return
+
+    # Message every matching route at once so that one slow downstream
+    # actor does not hold up the others
+    futures = list()
+    for route in routes:
+        r.logger.debug('Route: dest={}, content={}'.format(
+            route['actor_id'], message))
+        futures.append((route, _send(r, route['actor_id'], message)))
+
+    for route, future in futures:
+        try:
+            resp = future.result(timeout=route['timeout'])
+            if resp is not None:
+                if 'executionId' in resp:
+                    r.logger.debug(
+                        'Route: executionId={}, actorId={}'.format(
+                            resp['executionId'], route['actor_id']))
+        except Exception as exc:
+            if isinstance(exc, TimeoutError):
+                exc = TimeoutError('No response after {}s'.format(
+                    route['timeout']))
+            errmsg = 'Route: Failed to launch {}:{} for {}'.format(
+                route['name'], route['actor_id'], agave_dest)
+            timing.count('route_failures')
+            if route['ignore_err']:
+                r.logger.warning('{}: {}'.format(errmsg, exc))
+            else:
+                r.on_failure(errmsg, exc)
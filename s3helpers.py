@@ -1,6 +1,14 @@
 import sys
 import os
 import re
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+import treewalk
+
+S3_URI = re.compile(r's3:\/\/(.*)$')
+# ListObjectsV2 returns at most this many keys per page
+S3_MAX_PAGESIZE = 1000
 
 
 class S3HelperException(Exception):
@@ -11,8 +19,17 @@ class S3Helper(object):
     def __init__(self, client=None):
         self.BUCKET = os.environ.get('TACC_S3_BUCKET', 'uploads')
         self.STORAGE_PREFIX = os.environ.get('TACC_S3_ROOTDIR', '/corral/s3/ingest')
-        self.STORAGE_PAGESIZE = -1
+        # Keys per ListObjectsV2 page for native listings (-1: the maximum)
+        self.STORAGE_PAGESIZE = int(os.environ.get('TACC_S3_PAGESIZE', -1))
+        # Native S3 API, used when the POSIX view of the bucket is missing.
+        # TACC_S3_LISTING is posix (default), lustre, native, or auto
+        self.ENDPOINT = os.environ.get('TACC_S3_ENDPOINT', None)
+        self.LISTING = os.environ.get('TACC_S3_LISTING', 'posix')
+        # Directories read at once by the parallel (lustre) walker
+        self.WALK_THREADS = int(os.environ.get('TACC_S3_WALK_THREADS',
+                                               treewalk.DEFAULT_THREADS))
         self.client = client
+        self.s3_client = None
 
     def from_s3_uri(self, uri=None, validate=False):
         """Parse an S3 URI into a tuple (bucketName, directoryPath, fileName)
@@ -21,15 +38,14 @@ class S3Helper(object):
         bucketName = None
         dirPath = None
         fileName = None
-        proto = re.compile(r's3:\/\/(.*)$')
         if uri is None:
             raise ValueError("URI cannot be empty")
-        resourcepath = proto.search(uri)
+        resourcepath = S3_URI.search(uri)
         if resourcepath is None:
             raise ValueError("Unable resolve URI")
         resourcepath = resourcepath.group(1)
         firstSlash = resourcepath.find('/')
-        if firstSlash is -1:
+        if firstSlash == -1:
             raise ValueError("Unable to resolve bucketName")
         try:
             bucketName = resourcepath[0:firstSlash]
@@ -155,24 +171,96 @@ class S3Helper(object):
         if bucket is None:
             bucket = self.BUCKET
         try:
+            if self.use_native(path, bucket):
+                return self.listdir_s3native(path, recurse, bucket, directories)
+            if self.LISTING == 'lustre':
+                return self.listdir_s3_lustre(path, recurse, bucket, directories)
             return self.listdir_s3_posix(path, recurse, bucket, directories)
         except Exception as exc:
             raise S3HelperException('Function failed', exc)
 
     def listdir_s3_posix(self, path, recurse=True, bucket=None, directories=True, current_listing=[]):
+        return [relpath for relpath, entry in
+                self.iterdir_s3_posix(path, recurse, bucket, directories)]
+
+    def iterdir(self, path, recurse=True, bucket=None, directories=True, ordered=False):
+        """Yield (relpath, entry) for the entries in the directory given by path.
+
+        Streaming counterpart of listdir(). Items are produced in the same
+        order as listdir() without materializing the listing, and entry is
+        the os.DirEntry for the item, whose stat() result is cached. If
+        ordered is True, every lister yields the same order: depth-first,
+        each directory's entries sorted by name, subdirectories last.
+
+        Parameters:
+        path:str - storage system-absolute path to list
+        Arguments:
+        bucket:str - non-default Agave storage system
+        Yields:
+        item:tuple - (relpath:str, entry:os.DirEntry)
+        """
+        if bucket is None:
+            bucket = self.BUCKET
+        try:
+            if self.use_native(path, bucket):
+                listing = self.iterdir_s3native(path, recurse, bucket, directories,
+                                                ordered=ordered)
+            elif self.LISTING == 'lustre':
+                listing = self.iterdir_s3_lustre(path, recurse, bucket, directories,
+                                                 ordered)
+            else:
+                listing = self.iterdir_s3_posix(path, recurse, bucket, directories,
+                                                ordered)
+            for item in listing:
+                yield item
+        except Exception as exc:
+            raise S3HelperException('Function failed', exc)
+
+    def use_native(self, path, bucket=None):
+        # Whether listings of path should come from the S3 API
+        if self.LISTING == 'native':
+            return True
+        if self.LISTING == 'auto':
+            return not os.path.isdir(self.mapped_catalog_path(path, bucket))
+        return False
+
+    def iterdir_s3_posix(self, path, recurse=True, bucket=None, directories=True, ordered=False):
         if bucket is None:
             bucket = self.BUCKET
         abspath = self.mapped_catalog_path(path, bucket)
-        listing = list()
-        for dirname, dirnames, filenames in os.walk(abspath):
+        # Depth-first, top-down traversal matching os.walk() ordering. Each
+        # directory's relative path is derived once and extended by name
+        # rather than re-deriving it for every entry
+        stack = [(abspath, self.relativepath(abspath))]
+        while len(stack) > 0:
+            dirpath, reldir = stack.pop()
+            subdirs = []
+            files = []
+            try:
+                with os.scandir(dirpath) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            subdirs.append(entry)
+                        else:
+                            files.append(entry)
+            except OSError:
+                continue
+            if ordered:
+                subdirs.sort(key=lambda entry: entry.name)
+                files.sort(key=lambda entry: entry.name)
             if directories is True:
-                for subdirname in dirnames:
-                    itempath = os.path.join(dirname, subdirname)
-                    listing.append(self.relativepath(itempath))
-            for filename in filenames:
-                itempath = os.path.join(dirname, filename)
-                listing.append(self.relativepath(itempath))
-        return listing
+                for entry in subdirs:
+                    yield os.path.join(reldir, entry.name), entry
+            for entry in files:
+                yield os.path.join(reldir, entry.name), entry
+            if recurse:
+                for entry in reversed(subdirs):
+                    if not entry.is_symlink():
+                        stack.append((entry.path, os.path.join(reldir, entry.name)))
 
     def relativepath(self, path, bucket=None):
         if bucket is None:
@@ -182,37 +270,165 @@ class S3Helper(object):
             retpath = retpath[1:]
         return retpath
 
-    def listdir_s3_lustre(self, path, recurse=True, bucket=None, directories=True, current_listing=[]):
-        raise NotImplementedError(
-            'Lustre support is not implemented. Consider using listdir_s3_posix().')
+    def listdir_s3_lustre(self, path, recurse=True, bucket=None, directories=True, current_listing=[], ordered=False):
+        return [relpath for relpath, entry in
+                self.iterdir_s3_lustre(path, recurse, bucket, directories,
+                                       ordered)]
 
-    def listdir_s3native(self, path, recurse, bucket=None, directories=True, current_listing=[]):
-        raise NotImplementedError(
-            'Native S3 support is not implemented. Consider using listdir_s3_posix().')
+    def iterdir_s3_lustre(self, path, recurse=True, bucket=None, directories=True, ordered=False):
+        """Yield (relpath, entry) like iterdir_s3_posix(), reading up to
+        WALK_THREADS directories at once (see treewalk.py).
 
-    def from_s3_uri(self, uri=None, validate=False):
-        """Parse an S3 URI into a tuple (bucketName, directoryPath, fileName)
-        Validation that it points to a real resource is not implemented. The
-        same caveats about validation apply here as in to_agave_uri()"""
-        bucketName = None
-        dirPath = None
-        fileName = None
-        proto = re.compile(r's3:\/\/(.*)$')
-        if uri is None:
-            raise ValueError("URI cannot be empty")
-        resourcepath = proto.search(uri)
-        if resourcepath is None:
-            raise ValueError("Unable resolve URI")
-        resourcepath = resourcepath.group(1)
-        firstSlash = resourcepath.find('/')
-        if firstSlash is -1:
-            raise ValueError("Unable to resolve bucketName")
-        try:
-            bucketName = resourcepath[0:firstSlash]
-            origDirPath = resourcepath[firstSlash + 1:]
-            dirPath = os.path.dirname(origDirPath)
-            fileName = os.path.basename(origDirPath)
-            return (bucketName, dirPath, fileName)
-        except Exception as e:
-            raise ValueError(
-                "Unable to resolve directoryPath or fileName: {}".format(e))
+        Entries of a directory stay together, directories first, but the
+        directories come in the order they are read unless ordered is True,
+        which reproduces the order of iterdir_s3_posix() with ordered.
+        """
+        if bucket is None:
+            bucket = self.BUCKET
+        abspath = self.mapped_catalog_path(path, bucket)
+        for reldir, subdirs, files in treewalk.walk(
+                abspath, self.WALK_THREADS, ordered, recurse,
+                reldir=self.relativepath(abspath)):
+            if directories is True:
+                for entry in subdirs:
+                    yield os.path.join(reldir, entry.name), entry
+            for entry in files:
+                yield os.path.join(reldir, entry.name), entry
+
+    def listdir_s3native(self, path, recurse=True, bucket=None, directories=True, current_listing=[]):
+        return [relpath for relpath, entry in
+                self.iterdir_s3native(path, recurse, bucket, directories)]
+
+    def get_s3_client(self):
+        # boto3 is only needed for native listings, so import it on demand
+        if self.s3_client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise S3HelperException('Native S3 listing requires boto3')
+            self.s3_client = boto3.client('s3', endpoint_url=self.ENDPOINT)
+        return self.s3_client
+
+    def s3_pages(self, bucket_name, prefix, delimiter=None, prefetch=True):
+        """Yield ListObjectsV2 response pages for prefix in bucket_name.
+
+        With prefetch, the request for the next page is in flight while the
+        caller works through the current one.
+        """
+        client = self.get_s3_client()
+        kwargs = {'Bucket': bucket_name, 'Prefix': prefix,
+                  'MaxKeys': S3_MAX_PAGESIZE}
+        if 0 < self.STORAGE_PAGESIZE < S3_MAX_PAGESIZE:
+            kwargs['MaxKeys'] = self.STORAGE_PAGESIZE
+        if delimiter is not None:
+            kwargs['Delimiter'] = delimiter
+
+        def fetch(token):
+            if token is None:
+                return client.list_objects_v2(**kwargs)
+            return client.list_objects_v2(ContinuationToken=token, **kwargs)
+
+        if not prefetch:
+            token = None
+            while True:
+                page = fetch(token)
+                yield page
+                token = page.get('NextContinuationToken')
+                if not page.get('IsTruncated') or token is None:
+                    return
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(fetch, None)
+            while future is not None:
+                page = future.result()
+                token = page.get('NextContinuationToken')
+                future = None
+                if page.get('IsTruncated') and token is not None:
+                    future = pool.submit(fetch, token)
+                yield page
+
+    def iterdir_s3native(self, path, recurse=True, bucket=None, directories=True, prefetch=True,
+                         ordered=False):
+        """Yield (relpath, S3Entry) for objects below path from the S3 API.
+
+        relpath has the same form as iterdir_s3_posix() produces. Objects
+        are streamed page by page in key order. Without recurse, only the
+        objects and, if directories is True, the common prefixes directly
+        below path are listed. Key order puts "a/b" before "a.txt", so if
+        ordered is True the prefixes are instead listed one at a time like
+        directories, in the order of iterdir_s3_posix() with ordered.
+        """
+        if bucket is None:
+            bucket = self.BUCKET
+        reldir = self.relativepath(self.mapped_catalog_path(path, bucket)).rstrip('/')
+        bucket_name, _, key_prefix = reldir.partition('/')
+        if key_prefix != '':
+            key_prefix = key_prefix + '/'
+        if ordered:
+            stack = [key_prefix]
+            while len(stack) > 0:
+                prefix = stack.pop()
+                subdirs = []
+                files = []
+                for page in self.s3_pages(bucket_name, prefix, '/', prefetch):
+                    subdirs.extend(common['Prefix'] for common in page.get('CommonPrefixes', []))
+                    files.extend(page.get('Contents', []))
+                # Sorted by name: "a-b/" precedes "a/" in key order
+                subdirs.sort(key=lambda prefix: prefix.rstrip('/'))
+                files.sort(key=lambda obj: obj['Key'])
+                for item in self.s3_entries(bucket_name, subdirs, files, directories):
+                    yield item
+                if recurse:
+                    stack.extend(reversed(subdirs))
+            return
+        delimiter = None if recurse else '/'
+        for page in self.s3_pages(bucket_name, key_prefix, delimiter, prefetch):
+            prefixes = [common['Prefix'] for common in page.get('CommonPrefixes', [])]
+            for item in self.s3_entries(bucket_name, prefixes, page.get('Contents', []), directories):
+                yield item
+
+    def s3_entries(self, bucket_name, prefixes, objects, directories=True):
+        # (relpath, S3Entry) for common prefixes and objects of a listing
+        if directories is True:
+            for prefix in prefixes:
+                name = prefix.rstrip('/')
+                yield (os.path.join(bucket_name, name),
+                       S3Entry(bucket_name, name, is_dir=True))
+        for obj in objects:
+            if obj['Key'].endswith('/'):
+                # Zero-byte "folder" placeholder objects
+                continue
+            yield (os.path.join(bucket_name, obj['Key']),
+                   S3Entry(bucket_name, obj['Key'], obj['Size'],
+                           obj['ETag'].strip('"'),
+                           obj['LastModified'].timestamp()))
+
+
+class S3Entry(object):
+    """An object from a native S3 listing, usable where an os.DirEntry is
+    expected for name, path, is_dir() and stat()"""
+
+    def __init__(self, bucket_name, key, size=0, etag=None, mtime=0,
+                 is_dir=False):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.name = os.path.basename(key)
+        self.path = os.path.join(bucket_name, key)
+        self.size = size
+        self.etag = etag
+        self.mtime = mtime
+        self._is_dir = is_dir
+
+    def is_dir(self, follow_symlinks=True):
+        return self._is_dir
+
+    def is_file(self, follow_symlinks=True):
+        return not self._is_dir
+
+    def is_symlink(self):
+        return False
+
+    def stat(self, follow_symlinks=True):
+        mode = stat.S_IFDIR | 0o755 if self._is_dir else stat.S_IFREG | 0o644
+        return os.stat_result((mode, 0, 0, 1, 0, 0, self.size,
+                               self.mtime, self.mtime, self.mtime))
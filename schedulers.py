@@ -0,0 +1,121 @@
+"""
+Ordering policies for directory sync tasks
+
+Listings are streamed, so every policy here works over a bounded window of
+pending items rather than the full listing. The policy used for directory
+syncs is chosen by config.yml#batch.scheduler (see from_settings).
+"""
+import os
+from collections import OrderedDict, deque
+from heapq import heappop, heappush, heappushpop
+from random import randrange, shuffle
+
+
+def windowed_shuffle(iterable, window=10000):
+    """Yield items from iterable in random order using a bounded reservoir
+
+    Each incoming item displaces a random item from a window of at most
+    window items, which is yielded. An item is never yielded more than
+    window positions early, but how long one stays in the window is
+    unbounded: each later item has a 1/window chance of displacing it, so
+    most leave within a few windows while a few are held until the end of
+    the listing. That spreads load across a POSIX-ordered listing without
+    holding all of it in memory.
+    """
+    buffer = list()
+    for item in iterable:
+        if len(buffer) < window:
+            buffer.append(item)
+            continue
+        idx = randrange(window)
+        yield buffer[idx]
+        buffer[idx] = item
+    shuffle(buffer)
+    for item in buffer:
+        yield item
+
+
+def windowed_priority(iterable, window=10000, key=None):
+    """Yield items from iterable lowest key first within a bounded window
+
+    Once window items are pending, each incoming item is added and the
+    pending item with the lowest key is yielded. Items with equal keys keep
+    their listing order. Items with high keys wait until lower ones stop
+    arriving, at the latest until the listing ends.
+    """
+    heap = list()
+    for seq, item in enumerate(iterable):
+        entry = (key(item), seq, item)
+        if len(heap) < window:
+            heappush(heap, entry)
+            continue
+        yield heappushpop(heap, entry)[2]
+    while len(heap) > 0:
+        yield heappop(heap)[2]
+
+
+def round_robin(iterable, window=10000, key=None):
+    """Yield items from iterable taking turns between groups
+
+    Items are grouped by key, such as their parent directory, and once
+    window items are pending one is yielded from each group in turn, so
+    that consecutive tasks land in different directories.
+    """
+    groups = OrderedDict()
+    pending = 0
+
+    def take():
+        group = next(iter(groups))
+        items = groups[group]
+        item = items.popleft()
+        if len(items) > 0:
+            groups.move_to_end(group)
+        else:
+            del groups[group]
+        return item
+
+    for item in iterable:
+        group = key(item)
+        if group in groups:
+            groups[group].append(item)
+        else:
+            groups[group] = deque([item])
+        pending += 1
+        if pending > window:
+            pending -= 1
+            yield take()
+    while len(groups) > 0:
+        yield take()
+
+
+def from_settings(settings, uri, size):
+    """Return a function that orders an iterable of directory sync items by
+    the policy in settings.batch.scheduler
+
+    uri(item) and size(item) return an item's Agave URI and size in bytes.
+    """
+    scheduler = settings.batch.scheduler
+    window = settings.batch.shuffle_window
+    policy = scheduler.policy
+    if policy == 'shuffle':
+        return lambda items: windowed_shuffle(items, window)
+    if policy == 'smallest_first':
+        return lambda items: windowed_priority(items, window, size)
+    if policy == 'round_robin':
+        return lambda items: round_robin(
+            items, window, lambda item: os.path.dirname(uri(item)))
+    if policy == 'route_priority':
+        # Deferred so that other policies do not load the routing table
+        from routemsg import routing_table
+        table = routing_table(settings)
+        ranks = dict((name, rank) for rank, name in
+                     enumerate(scheduler.routes))
+
+        def priority(item):
+            rank = min([ranks.get(route['name'], len(ranks))
+                        for route in table.match(uri(item))],
+                       default=len(ranks))
+            return rank, size(item)
+
+        return lambda items: windowed_priority(items, window, priority)
+    raise ValueError('Unknown scheduler policy: {}'.format(policy))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Serve a local stand-in for the Abaco sendMessage endpoint
+
+Usage: abaco_standin.py [--port 8000] [--latency 0.05] [--jitter 0.05]
+                        [--error-rate 0.01] [--hang-rate 0] [--record FILE]
+
+POST /actors/v2/<actor>/messages answers like Abaco with a new executionId
+after --latency seconds (plus up to --jitter). A fraction --error-rate of
+requests get an HTTP 500 and a fraction --hang-rate are held for --hang
+seconds before answering, to exercise client timeouts. GET /stats returns
+counters as JSON. Received messages can be appended to --record as JSONL.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGES_PATH = re.compile(r'^/actors/v2/([^/]+)/messages/?$')
+
+
+class StandIn(object):
+    def __init__(self, latency=0.05, jitter=0.05, error_rate=0.0,
+                 hang_rate=0.0, hang=120, record=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.record = record
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stats = {'received': 0, 'accepted': 0, 'errors': 0, 'hung': 0}
+
+    def decide(self):
+        """Return (delay, ok) for the next request"""
+        with self.lock:
+            self.stats['received'] += 1
+            pick = self.random.random()
+            delay = self.latency + self.random.random() * self.jitter
+            if pick < self.error_rate:
+                self.stats['errors'] += 1
+                return delay, False
+            if pick < self.error_rate + self.hang_rate:
+                self.stats['hung'] += 1
+                return self.hang, True
+            self.stats['accepted'] += 1
+            return delay, True
+
+    def log_message(self, actor_id, body):
+        if self.record is None:
+            return
+        with self.lock:
+            self.record.write(json.dumps({'actor_id': actor_id,
+                                          'body': body}) + '\n')
+            self.record.flush()
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        elapsed = time.time() - self.started
+        stats['seconds'] = round(elapsed, 3)
+        stats['received_per_s'] = round(stats['received'] / elapsed, 3)
+        return stats
+
+
+def make_handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, status, doc):
+            payload = json.dumps(doc).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip('/') == '/stats':
+                self.reply(200, standin.snapshot())
+            else:
+                self.reply(404, {'status': 'error', 'message': 'Not found'})
+
+        def do_POST(self):
+            match = MESSAGES_PATH.match(self.path.split('?')[0])
+            length = int(self.headers.get('Content-Length', 0))
+            raw = self.rfile.read(length)
+            if match is None:
+                self.reply(404, {'status': 'error', 'message': 'Not found'})
+                return
+            try:
+                body = json.loads(raw.decode() or '{}')
+            except ValueError:
+                self.reply(400, {'status': 'error',
+                                 'message': 'Body is not JSON'})
+                return
+            delay, ok = standin.decide()
+            time.sleep(delay)
+            if not ok:
+                self.reply(500, {'status': 'error',
+                                 'message': 'Injected failure'})
+                return
+            standin.log_message(match.group(1), body)
+            self.reply(200, {'status': 'success',
+                             'message': 'The request was successful',
+                             'result': {'executionId': uuid.uuid4().hex,
+                                        'msg': body.get('message')}})
+
+        def log_message(self, format, *args):
+            # Keep the console quiet at high request rates
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--hang', type=float, default=120)
+    parser.add_argument('--record', default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    record = open(args.record, 'a') if args.record is not None else None
+    standin = StandIn(args.latency, args.jitter, args.error_rate,
+                      args.hang_rate, args.hang, record, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(standin))
+    server.daemon_threads = True
+    print('Abaco stand-in listening on http://{}:{}'.format(
+        args.host, server.server_port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(standin.snapshot()))
+        if record is not None:
+            record.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Rebuild the sync-state index from scratch by comparing source and
+destination trees
+
+Usage: rebuild_sync_index.py [--config config.yml] [--index PATH]
+                             [--source DIR] [--destination DIR]
+"""
+import argparse
+import os
+import sys
+import yaml
+from attrdict import AttrDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from cmpfiles import sync_policy
+from syncindex import SyncIndex, index_path
+
+
+def pairs(source, destination, safen=False):
+    if safen:
+        from datacatalog.utils import safen_path
+    for dirname, dirnames, filenames in os.walk(source):
+        for filename in filenames:
+            posix_src = os.path.join(dirname, filename)
+            relpath = os.path.relpath(posix_src, source)
+            if safen:
+                relpath = safen_path(relpath, no_unicode=True, no_spaces=True)
+            yield posix_src, os.path.join(destination, relpath)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default='config.yml')
+    parser.add_argument('--index', default=None)
+    parser.add_argument('--source', default=None)
+    parser.add_argument('--destination', default=None)
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as conf:
+        settings = AttrDict(yaml.safe_load(conf))
+    source = args.source or settings.source.posix_path
+    destination = args.destination or settings.destination.posix_path
+    path = args.index or settings.sync.index_path or index_path(destination)
+    policy = sync_policy(settings)
+
+    index = SyncIndex(path)
+    count = index.rebuild(pairs(source, destination, settings.safen_paths),
+                          **policy)
+    index.close()
+    print('Indexed {} files in sync between {} and {} ({})'.format(
+        count, source, destination, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""Replay messages to an Abaco actor with bounded concurrency
+
+Usage: replay_messages.py SOURCE --actor ACTOR [--concurrency 16]
+                          [--rate 50] [--adaptive] [--api-server URL]
+                          [--checkpoint FILE] [--failures FILE]
+
+SOURCE is either a JSONL file with one message per line or a directory of
+JSON message files. Messages are sent through agavepy unless --api-server
+points at another Abaco-compatible endpoint such as abaco_standin.py.
+
+Every accepted message is appended to the checkpoint file, and messages
+already in it are skipped, so an interrupted replay resumes where it left
+off. Messages that still fail after --retries attempts are written to the
+failures file and left out of the checkpoint, so rerunning retries them.
+The failures file is rewritten by every run and so lists only the messages
+that failed in the latest one.
+--rate caps messages per second; with --adaptive the rate is also backed
+off while the endpoint is slow or failing (see ratecontrol.py).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+from ratecontrol import SubmissionController
+
+SESSION = os.path.basename(__file__)
+
+
+class AgaveSender(object):
+    def __init__(self, actor_id, session=SESSION):
+        from agavepy.agave import Agave
+        self.actor_id = actor_id
+        self.session = session
+        self.client = Agave.restore()
+
+    def send(self, message):
+        resp = self.client.actors.sendMessage(
+            actorId=self.actor_id,
+            body={'message': message},
+            environment={'x-session': self.session})
+        return resp['executionId']
+
+
+class HttpSender(object):
+    def __init__(self, api_server, actor_id, token=None, timeout=30):
+        self.url = '{}/actors/v2/{}/messages'.format(
+            api_server.rstrip('/'), actor_id)
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, message):
+        request = urllib.request.Request(
+            self.url, data=json.dumps({'message': message}).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        if self.token is not None:
+            request.add_header('Authorization', 'Bearer ' + self.token)
+        with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode())['result']['executionId']
+
+
+def read_messages(source, field=None, id_field=None):
+    """Yield (message_id, message) from a JSONL file or a directory"""
+    def unwrap(doc, default_id):
+        msg_id = default_id
+        if id_field is not None and id_field in doc:
+            msg_id = str(doc[id_field])
+        return msg_id, doc[field] if field is not None else doc
+
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            with open(os.path.join(source, filename), 'r') as jsondoc:
+                yield unwrap(json.load(jsondoc), filename)
+    else:
+        with open(source, 'r') as jsonl:
+            for lineno, line in enumerate(jsonl, start=1):
+                if line.strip() != '':
+                    yield unwrap(json.loads(line), str(lineno))
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as checkpoint:
+        return set(line.split('\t', 1)[0] for line in checkpoint
+                   if line.strip() != '')
+
+
+def send_one(sender, message, retries=3, backoff=1.0):
+    """Send message, retrying with exponential backoff.
+
+    Returns (execution_id, latency of the last attempt, attempts, error)
+    """
+    for attempt in range(1, retries + 1):
+        start = time.monotonic()
+        try:
+            return sender.send(message), time.monotonic() - start, \
+                attempt, None
+        except Exception as exc:
+            error = exc
+            latency = time.monotonic() - start
+            if attempt < retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    return None, latency, retries, error
+
+
+def make_controller(rate, adaptive, concurrency):
+    if rate <= 0:
+        return None
+    if adaptive:
+        # Let the rate drop to a tenth of the cap while the endpoint struggles
+        return SubmissionController(min_rate=rate / 10.0, max_rate=rate,
+                                    initial_rate=rate, burst=concurrency,
+                                    max_backoff=30)
+    return SubmissionController(min_rate=rate, max_rate=rate,
+                                burst=concurrency)
+
+
+def replay(messages, sender, checkpoint_path, failures_path,
+           concurrency=16, controller=None, retries=3, backoff=1.0,
+           progress_every=1000, out=sys.stdout):
+    """Send messages not yet in the checkpoint. Returns a summary dict"""
+    done = load_checkpoint(checkpoint_path)
+    counts = {'sent': 0, 'failed': 0, 'skipped': 0, 'retries': 0}
+    start = time.monotonic()
+
+    def progress():
+        elapsed = max(time.monotonic() - start, 1e-9)
+        summary = dict(counts, seconds=round(elapsed, 3),
+                       sent_per_s=round(counts['sent'] / elapsed, 3))
+        if controller is not None:
+            summary['rate'] = controller.state()['rate']
+        return summary
+
+    with open(checkpoint_path, 'a') as checkpoint, \
+            open(failures_path, 'w') as failures, \
+            ThreadPoolExecutor(max_workers=concurrency) as pool:
+        inflight = dict()
+
+        def finish(futures):
+            for future in futures:
+                msg_id, message = inflight.pop(future)
+                execution_id, latency, attempts, error = future.result()
+                counts['retries'] += attempts - 1
+                if controller is not None:
+                    controller.record(latency, ok=error is None)
+                if error is None:
+                    counts['sent'] += 1
+                    checkpoint.write('{}\t{}\n'.format(msg_id, execution_id))
+                else:
+                    counts['failed'] += 1
+                    failures.write(json.dumps({'id': msg_id,
+                                               'message': message,
+                                               'error': str(error)}) + '\n')
+                completed = counts['sent'] + counts['failed']
+                if completed % progress_every == 0:
+                    checkpoint.flush()
+                    failures.flush()
+                    print(json.dumps(progress()), file=out)
+
+        try:
+            for msg_id, message in messages:
+                if msg_id in done:
+                    counts['skipped'] += 1
+                    continue
+                # Keep a bounded number of messages queued or in flight
+                while len(inflight) >= concurrency * 2:
+                    finished, pending = wait(inflight,
+                                             return_when=FIRST_COMPLETED)
+                    finish(finished)
+                if controller is not None:
+                    controller.acquire()
+                future = pool.submit(send_one, sender, message, retries,
+                                     backoff)
+                inflight[future] = (msg_id, message)
+        except KeyboardInterrupt:
+            print('Interrupted; waiting for {} in-flight messages'.format(
+                len(inflight)), file=out)
+        finish(list(wait(inflight).done))
+    return progress()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='JSONL file or directory of messages')
+    parser.add_argument('--actor', required=True)
+    parser.add_argument('--field', default=None,
+                        help='Send this key of each document as the message')
+    parser.add_argument('--id-field', default=None,
+                        help='Key of each document to checkpoint it by')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Maximum messages per second (0: unlimited)')
+    parser.add_argument('--adaptive', action='store_true')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=1.0)
+    parser.add_argument('--api-server', default=None)
+    parser.add_argument('--token', default=os.environ.get('ABACO_TOKEN'))
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--checkpoint', default=None)
+    parser.add_argument('--failures', default=None)
+    parser.add_argument('--progress-every', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    base = args.source.rstrip('/')
+    checkpoint_path = args.checkpoint or base + '.checkpoint'
+    failures_path = args.failures or base + '.failures.jsonl'
+    if args.api_server is not None:
+        sender = HttpSender(args.api_server, args.actor, args.token,
+                            args.timeout)
+    else:
+        sender = AgaveSender(args.actor)
+    summary = replay(read_messages(args.source, args.field, args.id_field),
+                     sender, checkpoint_path, failures_path,
+                     concurrency=args.concurrency,
+                     controller=make_controller(args.rate, args.adaptive,
+                                                args.concurrency),
+                     retries=args.retries, backoff=args.backoff,
+                     progress_every=args.progress_every)
+    print(json.dumps(summary))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
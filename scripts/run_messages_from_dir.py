@@ -1,26 +1,19 @@
 #!/usr/bin/env python
+"""Send every JSON message in a directory to an actor
 
-import json
+Usage: run_messages_from_dir.py JOBS_DIR ACTOR [replay_messages.py options]
+
+Kept for existing callers; see replay_messages.py for the options.
+"""
 import os
 import sys
-from agavepy.agave import Agave, AgaveError
 
-jobs_dir = sys.argv[1]
-actor = sys.argv[2]
-session = os.path.basename(__file__)
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from replay_messages import main
 
-ag = Agave.restore()
-jobs = os.listdir(sys.argv[1])
-for j in jobs:
-    with open(os.path.join(jobs_dir, j), 'r') as jsondoc:
-        try:
-            jsonobj = json.load(jsondoc)
-            print(jsonobj)
-            resp = ag.actors.sendMessage(
-                actorId=actor,
-                body={'message': jsonobj},
-                environment={'x-session': session})
-            # print(resp)
-            print(resp.get('executionId', 'Message failed'))
-        except Exception as exc:
-            raise AgaveError(exc)
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    jobs_dir, actor = sys.argv[1:3]
+    sys.exit(main([jobs_dir, '--actor', actor] + sys.argv[3:]))
@@ -0,0 +1,197 @@
+"""
+Persistent record of files that have been synced to the destination
+
+Each row stores the source size and mtime observed when the destination file
+was last written, plus an optional content fingerprint. When a source stat
+still matches its row, the destination is presumed current and does not need
+to be stat'd. On a local filesystem the database uses SQLite in WAL mode so
+concurrent executions can read while one of them is writing. WAL relies on
+shared memory that network filesystems such as Lustre and NFS (/work) cannot
+provide, so there the rollback journal is used instead.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from cmpfiles import cmpfiles
+from fingerprint import fingerprint
+
+# Filesystem types, as in /proc/mounts, on which WAL is unsafe
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'lustre', 'cifs', 'smb3', 'gpfs',
+                       'beegfs', 'ceph', 'glusterfs', 'fuse.sshfs')
+MOUNTS = '/proc/mounts'
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS synced (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    fingerprint TEXT,
+    synced REAL NOT NULL
+)"""
+
+
+class SyncIndexException(Exception):
+    pass
+
+
+def index_path(posix_path):
+    """Default index location: a dotfile alongside the destination root"""
+    posix_path = posix_path.rstrip('/')
+    return os.path.join(os.path.dirname(posix_path),
+                        '.{}.syncindex.sqlite'.format(
+                            os.path.basename(posix_path)))
+
+
+def filesystem_type(path, mounts=MOUNTS):
+    """Return the type of the filesystem holding path, or None if unknown"""
+    path = os.path.realpath(path)
+    best = None
+    fstype = None
+    try:
+        with open(mounts, 'r') as table:
+            for line in table:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # Mount points escape spaces as \040
+                mountpoint = fields[1].replace('\\040', ' ')
+                if path == mountpoint or \
+                        path.startswith(mountpoint.rstrip('/') + '/'):
+                    if best is None or len(mountpoint) >= len(best):
+                        best = mountpoint
+                        fstype = fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+def journal_mode(path, mounts=MOUNTS):
+    """SQLite journal mode for a database at path: WAL unless path is on a
+    network filesystem"""
+    if filesystem_type(os.path.dirname(os.path.abspath(path)),
+                       mounts) in NETWORK_FILESYSTEMS:
+        return 'DELETE'
+    return 'WAL'
+
+
+def open_index(settings):
+    """Return a SyncIndex configured by config.yml#sync or None if disabled"""
+    if not settings.sync.index:
+        return None
+    path = settings.sync.index_path
+    if path is None:
+        path = index_path(settings.destination.posix_path)
+    return SyncIndex(path)
+
+
+class SyncIndex(object):
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            self.db = sqlite3.connect(path, timeout=timeout,
+                                      check_same_thread=False)
+            mode = journal_mode(path)
+            self.db.execute('PRAGMA journal_mode={}'.format(mode))
+            # NORMAL is only crash-safe with WAL
+            self.db.execute('PRAGMA synchronous={}'.format(
+                'NORMAL' if mode == 'WAL' else 'FULL'))
+            self.db.execute(SCHEMA)
+            self.db.commit()
+        except sqlite3.Error as exc:
+            raise SyncIndexException(
+                'Unable to open sync index {}'.format(path), exc)
+
+    def get(self, posix_dest):
+        """Return (size, mtime, fingerprint, synced) for posix_dest or None"""
+        with self.lock:
+            return self.db.execute(
+                'SELECT size, mtime, fingerprint, synced FROM synced '
+                'WHERE path = ?', (posix_dest, )).fetchone()
+
+    def record(self, posix_dest, stat_src, fingerprint=None, synced=None,
+               commit=True):
+        """Record that posix_dest was written from a source with stat_src"""
+        if synced is None:
+            synced = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO synced VALUES (?, ?, ?, ?, ?)',
+                (posix_dest, stat_src.st_size, stat_src.st_mtime,
+                 fingerprint, synced))
+            if commit:
+                self.db.commit()
+
+    def record_copy(self, posix_src, posix_dest, stat_src=None, cksum=False):
+        """Record a completed copy. Pass the source stat taken before copying
+        so a source modified mid-copy is not recorded as in sync"""
+        if stat_src is None:
+            stat_src = os.stat(posix_src)
+        fp = None
+        if cksum:
+            if cksum is True:
+                cksum = 'sampled'
+            fp = fingerprint(posix_src, cksum, stat_src.st_size)
+        self.record(posix_dest, stat_src, fp)
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+
+    def forget(self, posix_dest):
+        with self.lock:
+            self.db.execute('DELETE FROM synced WHERE path = ?',
+                            (posix_dest, ))
+            self.db.commit()
+
+    def matches(self, posix_src, posix_dest, stat_src=None, cksum=False):
+        """Return True if the index says posix_dest is current with posix_src
+
+        Only the source is stat'd. A False return means the index cannot
+        vouch for the destination, not that the files differ.
+        """
+        row = self.get(posix_dest)
+        if row is None:
+            return False
+        if stat_src is None:
+            try:
+                stat_src = os.stat(posix_src)
+            except FileNotFoundError:
+                return False
+        size, mtime, fp, synced = row
+        if stat_src.st_size != size or stat_src.st_mtime != mtime:
+            return False
+        if cksum:
+            if cksum is True:
+                cksum = 'sampled'
+            if fp is None or fp != fingerprint(posix_src, cksum,
+                                               stat_src.st_size):
+                return False
+        return True
+
+    def rebuild(self, pairs, mtime=False, size=True, cksum=False):
+        """Replace the index contents by comparing (src, dest) pairs"""
+        if cksum is True:
+            cksum = 'sampled'
+        count = 0
+        with self.lock:
+            self.db.execute('DELETE FROM synced')
+            self.db.commit()
+        for posix_src, posix_dest in pairs:
+            if cmpfiles(posix_src, posix_dest, mtime=mtime, size=size,
+                        cksum=cksum):
+                stat_src = os.stat(posix_src)
+                fp = None
+                if cksum:
+                    fp = fingerprint(posix_src, cksum, stat_src.st_size)
+                self.record(posix_dest, stat_src, fp, commit=False)
+                count += 1
+                if count % 1000 == 0:
+                    self.commit()
+        self.commit()
+        return count
+
+    def close(self):
+        with self.lock:
+            self.db.close()
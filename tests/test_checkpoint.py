@@ -0,0 +1,94 @@
+"""Tests for code in checkpoint.py"""
+import os
+import sys
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from checkpoint import SyncCheckpoint, checkpoint_path, expire, order_key
+
+
+def test_cursor_is_low_water_mark(tmpdir):
+    path = checkpoint_path(str(tmpdir), 's3://uploads/run/')
+    assert path == checkpoint_path(str(tmpdir), 's3://uploads/run')
+    checkpoint = SyncCheckpoint(path, 's3://uploads/run', every=3600)
+    listing = [('b.txt', ), ('c.txt', ), ('a', 'x.txt'), ('a', 'y.txt')]
+    assert sorted(listing, key=order_key) == listing
+    seqs = [checkpoint.issue(parts) for parts in listing]
+    checkpoint.complete(seqs[1])
+    checkpoint.complete(seqs[3])
+    assert checkpoint.cursor is None
+    checkpoint.complete(seqs[0])
+    assert checkpoint.cursor == ('c.txt', )
+    checkpoint.save()
+
+    resumed = SyncCheckpoint.load(path)
+    assert resumed.cursor == ('c.txt', )
+    assert resumed.done == set([('a', 'y.txt')])
+    pending = [parts for parts in listing + [('d.txt', )]
+               if resumed.pending(parts)]
+    assert pending == [('a', 'x.txt'), ('d.txt', )]
+    resumed.remove()
+    assert SyncCheckpoint.load(path) is None
+
+
+def test_failed_files_do_not_hold_cursor(tmpdir):
+    path = checkpoint_path(str(tmpdir), 's3://uploads/run')
+    checkpoint = SyncCheckpoint(path, 's3://uploads/run', every=3600)
+    listing = [('a.txt', ), ('b.txt', ), ('c.txt', )]
+    seqs = [checkpoint.issue(parts) for parts in listing]
+    checkpoint.complete(seqs[0], ok=False)
+    checkpoint.complete(seqs[1])
+    checkpoint.complete(seqs[2])
+    # Nothing is left waiting behind the failed file
+    assert checkpoint.cursor == ('c.txt', )
+    assert checkpoint.finished == {}
+    checkpoint.save()
+
+    resumed = SyncCheckpoint.load(path)
+    assert [parts for parts in listing if resumed.pending(parts)] == \
+        [('a.txt', )]
+    seq = resumed.issue(('a.txt', ))
+    resumed.complete(seq)
+    assert resumed.failed == set()
+
+
+def test_done_set_is_capped(tmpdir):
+    path = checkpoint_path(str(tmpdir), 's3://uploads/run')
+    checkpoint = SyncCheckpoint(path, 's3://uploads/run', every=3600,
+                                max_done=2)
+    listing = [('a.txt', ), ('b.txt', ), ('c.txt', ), ('d.txt', ),
+               ('e.txt', )]
+    seqs = [checkpoint.issue(parts) for parts in listing]
+    # A scheduler holds the first file back until the end
+    for seq in seqs[1:]:
+        checkpoint.complete(seq)
+    assert len(checkpoint.finished) == 2
+    checkpoint.complete(seqs[0])
+    assert checkpoint.cursor == ('c.txt', )
+    checkpoint.save()
+
+    resumed = SyncCheckpoint.load(path)
+    assert [parts for parts in listing if resumed.pending(parts)] == \
+        [('d.txt', ), ('e.txt', )]
+
+
+def test_fan_out_is_recorded(tmpdir):
+    path = checkpoint_path(str(tmpdir), 's3://uploads/run')
+    checkpoint = SyncCheckpoint(path, 's3://uploads/run', every=3600)
+    checkpoint.fan_out('plate_1')
+    checkpoint.save()
+    assert SyncCheckpoint.load(path).fanned_out == set(['plate_1'])
+
+
+def test_expire(tmpdir):
+    old = checkpoint_path(str(tmpdir), 's3://uploads/old')
+    new = checkpoint_path(str(tmpdir), 's3://uploads/new')
+    SyncCheckpoint(old, 's3://uploads/old').save()
+    SyncCheckpoint(new, 's3://uploads/new').save()
+    os.utime(old, (0, 0))
+    assert expire(str(tmpdir), 3600) == 1
+    assert os.listdir(str(tmpdir)) == [os.path.basename(new)]
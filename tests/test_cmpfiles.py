@@ -0,0 +1,116 @@
+"""Tests for code in cmpfiles.py and fingerprint.py"""
+import os
+import sys
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from cmpfiles import cmpfiles
+from fingerprint import sampled_fingerprint, full_fingerprint, SAMPLE_THRESHOLD
+
+
+@pytest.fixture()
+def pair(tmpdir):
+    src = tmpdir.join('src.bin')
+    dest = tmpdir.join('dest.bin')
+    data = os.urandom(SAMPLE_THRESHOLD * 4)
+    src.write_binary(data)
+    dest.write_binary(data)
+    return str(src), str(dest)
+
+
+def test_cmpfiles_missing(pair, tmpdir):
+    src, dest = pair
+    assert cmpfiles(src, str(tmpdir.join('nope'))) is False
+    assert cmpfiles(str(tmpdir.join('nope')), dest) is False
+
+
+def test_cmpfiles_same_size_edit(pair):
+    src, dest = pair
+    with open(dest, 'r+b') as f:
+        f.write(b'\x00' * 8)
+    # Size-only comparison cannot see a same-size edit
+    assert cmpfiles(src, dest, mtime=False) is True
+    assert cmpfiles(src, dest, mtime=False, cksum='sampled') is False
+    assert cmpfiles(src, dest, mtime=False, cksum=True) is False
+    assert cmpfiles(src, dest, mtime=False, cksum='full') is False
+
+
+def test_cmpfiles_identical(pair):
+    src, dest = pair
+    assert cmpfiles(src, dest, mtime=False, cksum='sampled') is True
+    assert cmpfiles(src, dest, mtime=False, cksum='full') is True
+
+
+def test_fingerprint_small_file_is_full(tmpdir):
+    small = tmpdir.join('small.txt')
+    small.write_binary(b'potato')
+    assert sampled_fingerprint(str(small)) == full_fingerprint(str(small))
+
+
+def test_syncindex_skips_dest_stat(pair, tmpdir):
+    from syncindex import SyncIndex
+    src, dest = pair
+    index = SyncIndex(str(tmpdir.join('index.sqlite')))
+    assert index.matches(src, dest) is False
+    # A successful comparison populates the index
+    assert cmpfiles(src, dest, mtime=False, index=index) is True
+    assert index.matches(src, dest) is True
+    # Index alone vouches for the destination once recorded
+    os.unlink(dest)
+    assert cmpfiles(src, dest, mtime=False, index=index) is True
+    # Touching the source invalidates the record
+    os.utime(src, (1, 1))
+    assert cmpfiles(src, dest, mtime=False, index=index) is False
+
+
+def test_syncindex_rebuild(pair, tmpdir):
+    from syncindex import SyncIndex
+    src, dest = pair
+    index = SyncIndex(str(tmpdir.join('index.sqlite')))
+    assert index.rebuild([(src, dest), (src, str(tmpdir.join('nope')))]) == 1
+    assert index.get(dest)[0] == os.stat(src).st_size
+
+
+def test_syncindex_journal_mode(tmpdir):
+    from syncindex import filesystem_type, journal_mode
+    mounts = tmpdir.join('mounts')
+    mounts.write('rootfs / ext4 rw 0 0\n'
+                 'corral:/ingest /corral nfs4 rw 0 0\n'
+                 '10.0.0.1@o2ib:/work /work lustre rw 0 0\n'
+                 'tmpfs /work/tmp tmpfs rw 0 0\n')
+    assert filesystem_type('/work/projects', str(mounts)) == 'lustre'
+    assert filesystem_type('/workspace', str(mounts)) == 'ext4'
+    assert journal_mode('/work/projects/.index.sqlite', str(mounts)) == \
+        'DELETE'
+    assert journal_mode('/corral/.index.sqlite', str(mounts)) == 'DELETE'
+    assert journal_mode('/work/tmp/.index.sqlite', str(mounts)) == 'WAL'
+    assert journal_mode('/var/.index.sqlite', str(tmpdir.join('x'))) == \
+        'WAL'
+
+
+def test_cmpdirs_matches_cmpfiles(tmpdir):
+    from cmpfiles import cmpdirs
+    src_dir = tmpdir.mkdir('src')
+    dest_dir = tmpdir.mkdir('dest')
+    items = list()
+    for name, src_data, dest_data in [('same', b'abc', b'abc'),
+                                      ('resized', b'abc', b'abcd'),
+                                      ('missing', b'abc', None)]:
+        src_dir.join(name).write_binary(src_data)
+        if dest_data is not None:
+            dest_dir.join(name).write_binary(dest_data)
+        items.append((str(src_dir.join(name)), os.stat(str(src_dir.join(name))),
+                      str(dest_dir.join(name)), name))
+    # Destination directory that does not exist at all
+    items.append((items[0][0], items[0][1],
+                  str(tmpdir.join('nodir', 'same')), 'nodir'))
+    results = dict(cmpdirs(iter(items), mtime=False))
+    assert results == {'same': True, 'resized': False, 'missing': False,
+                       'nodir': False}
+    for posix_src, stat_src, posix_dest, name in items:
+        assert results[name] == cmpfiles(posix_src, posix_dest, mtime=False)
@@ -0,0 +1,96 @@
+"""Tests for code in copyengine.py"""
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+import copyengine
+from copyengine import ParallelCopier
+
+
+class Recorder(object):
+    def __init__(self):
+        self.errors = list()
+        self.infos = list()
+
+    def error(self, message):
+        self.errors.append(message)
+
+    def info(self, message):
+        self.infos.append(message)
+
+
+def reactor():
+    return SimpleNamespace(logger=Recorder())
+
+
+def test_copies_and_failures(monkeypatch):
+    copied = list()
+    routed = list()
+
+    def copyfile(r, posix_src, posix_dest, agave_dest):
+        if posix_src == 'bad':
+            # Reactor.on_failure() exits
+            raise SystemExit(1)
+        copied.append(posix_src)
+        return {'size': 1}
+
+    monkeypatch.setattr(copyengine, 'copyfile', copyfile)
+    monkeypatch.setattr(copyengine, 'routemsg',
+                        lambda r, uri, details: routed.append(uri))
+    r = reactor()
+    copier = ParallelCopier(r, workers=4)
+    outcomes = dict()
+    for name in ('a', 'bad', 'b'):
+        copier.submit(name, name + '.dest', 'agave://' + name,
+                      os.stat_result((0, ) * 6 + (10, 0, 0, 0)),
+                      done=lambda ok, name=name: outcomes.update({name: ok}))
+    stats = copier.join()
+    assert outcomes == {'a': True, 'bad': False, 'b': True}
+    assert sorted(copied) == ['a', 'b']
+    assert sorted(routed) == ['agave://a', 'agave://b']
+    assert stats['files'] == 2 and stats['failed'] == 1
+    assert stats['bytes'] == 20
+    assert copier.inflight_files == 0 and copier.inflight_bytes == 0
+    assert len(r.logger.errors) == 1
+
+
+def test_inflight_limits(monkeypatch):
+    release = threading.Event()
+    peak = {'files': 0, 'bytes': 0}
+    lock = threading.Lock()
+
+    def copyfile(r, posix_src, posix_dest, agave_dest):
+        with lock:
+            peak['files'] = max(peak['files'], copier.inflight_files)
+            peak['bytes'] = max(peak['bytes'], copier.inflight_bytes)
+        release.wait(5)
+
+    monkeypatch.setattr(copyengine, 'copyfile', copyfile)
+    monkeypatch.setattr(copyengine, 'routemsg', lambda *args: None)
+    copier = ParallelCopier(reactor(), workers=2, max_inflight_bytes=100,
+                            max_inflight_files=3)
+    # Zero-byte files are bounded by count
+    submitter = threading.Thread(target=lambda: [
+        copier.submit(str(i), 'dest', 'agave://x',
+                      os.stat_result((0, ) * 10)) for i in range(10)])
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive()
+    assert copier.inflight_files == 3
+    release.set()
+    submitter.join(5)
+    copier.join()
+    assert peak['files'] <= 3
+
+    # A file larger than the byte limit runs alone
+    assert copier.admits(500) is True
+    copier.inflight_bytes = 10
+    assert copier.admits(500) is False
+    assert copier.admits(90) is True
@@ -0,0 +1,96 @@
+"""Tests for code in dedup.py"""
+import os
+import sqlite3
+import sys
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from dedup import DedupStore, claim_event, event_key, store_path
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_store_path():
+    assert store_path('/work/data/uploads/') == \
+        '/work/data/.uploads.dedup.sqlite'
+
+
+def test_event_key_changes_with_content(tmpdir):
+    src = os.path.join(str(tmpdir), 'a.txt')
+    with open(src, 'w') as f:
+        f.write('one')
+    first = event_key('s3://uploads/a.txt', src)
+    assert first == event_key('s3://uploads/a.txt', src)
+    with open(src, 'w') as f:
+        f.write('three')
+    assert event_key('s3://uploads/a.txt', src) != first
+    assert event_key('s3://uploads/a.txt', src, fingerprinted=True) != \
+        event_key('s3://uploads/a.txt', src)
+
+
+def test_claim_window(tmpdir):
+    clock = Clock()
+    store = DedupStore(os.path.join(str(tmpdir), 'dedup.sqlite'), 60,
+                       clock=clock)
+    assert store.claim('k') is True
+    assert store.claim('k') is False
+    assert store.claim('k') is False
+    assert store.suppressed('k') == 2
+    clock.now += 61
+    assert store.claim('k') is True
+    assert store.suppressed() == 0
+    clock.now += 61
+    assert store.evict() == 1
+
+
+def test_release(tmpdir):
+    path = os.path.join(str(tmpdir), 'dedup.sqlite')
+    store = DedupStore(path, 60)
+    assert store.claim('k') is True
+    store.release('k')
+    # A second execution sharing the store may claim it again
+    assert DedupStore(path, 60).claim('k') is True
+    assert store.claim('k') is False
+
+
+class Logger(object):
+    def __init__(self):
+        self.warnings = list()
+
+    def info(self, message):
+        pass
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+
+def test_claim_event_degrades(tmpdir):
+    path = os.path.join(str(tmpdir), 'dedup.sqlite')
+    src = os.path.join(str(tmpdir), 'a.txt')
+    with open(src, 'w') as f:
+        f.write('one')
+    store = DedupStore(path, 60, timeout=0.1)
+    logger = Logger()
+    assert claim_event(store, 's3://uploads/a.txt', src, logger) == \
+        (True, event_key('s3://uploads/a.txt', src))
+    assert claim_event(store, 's3://uploads/a.txt', src, logger)[0] is False
+    # Another execution holds the write lock past the timeout
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    assert claim_event(store, 's3://uploads/a.txt', src, logger) == \
+        (True, None)
+    other.execute('ROLLBACK')
+    # The source vanished before it could be fingerprinted
+    assert claim_event(store, 's3://uploads/b.txt', src + '.gone',
+                       logger) == (True, None)
+    assert len(logger.warnings) == 2
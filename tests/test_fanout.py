@@ -0,0 +1,53 @@
+"""Tests for code in fanout.py"""
+import os
+import sys
+
+from attrdict import AttrDict
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from fanout import fan_out, survey
+
+
+def settings(mode='message', **fanout):
+    limits = {'min_entries': 10, 'min_depth': 0, 'max_depth': 2,
+              'max_width': 100}
+    limits.update(fanout)
+    return AttrDict({'batch': {'mode': mode, 'fanout': limits}})
+
+
+def make_tree(root, dirs=3, files=5):
+    for d in range(dirs):
+        sub = root.join('d{}'.format(d))
+        sub.ensure(dir=True)
+        for f in range(files):
+            sub.join('{}.txt'.format(f)).write('x')
+    root.join('top.txt').write('x')
+    root.join('d0', 'deep', 'deeper').ensure(dir=True)
+
+
+def test_survey(tmpdir):
+    make_tree(tmpdir)
+    assert survey(str(tmpdir), min_entries=10)
+    assert not survey(str(tmpdir), min_entries=100)
+    assert survey(str(tmpdir), min_depth=3)
+    assert not survey(str(tmpdir), min_depth=4)
+    assert not survey(str(tmpdir))
+
+
+def test_fan_out(tmpdir):
+    make_tree(tmpdir)
+    os.symlink(str(tmpdir.join('d1')), str(tmpdir.join('link')))
+    subdirs = fan_out(settings(), str(tmpdir))
+    assert [entry.name for entry in subdirs] == ['d0', 'd1', 'd2']
+    # Small trees, deep fan-out and wide directories are synced whole
+    assert fan_out(settings(min_entries=100), str(tmpdir)) is None
+    assert fan_out(settings(), str(tmpdir), depth=2) is None
+    assert fan_out(settings(max_width=2), str(tmpdir)) is None
+    assert fan_out(settings(min_entries=0), str(tmpdir)) is None
+    assert fan_out(settings(mode='local'), str(tmpdir)) is None
+    assert fan_out(settings(), str(tmpdir.join('d2'))) is None
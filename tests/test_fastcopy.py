@@ -0,0 +1,205 @@
+"""Tests for code in fastcopy.py"""
+import fcntl
+import hashlib
+import os
+import sys
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+import fastcopy
+from fastcopy import copy_atomic, temp_path
+from fingerprint import new_digests
+
+
+@pytest.fixture()
+def src(tmpdir):
+    path = tmpdir.join('src.bin')
+    path.write_binary(os.urandom(3 * 1024 * 1024 + 17))
+    return str(path)
+
+
+@pytest.mark.parametrize('engine', fastcopy.ENGINES)
+def test_copy_atomic_engines(src, tmpdir, engine, monkeypatch):
+    monkeypatch.setattr(fastcopy, 'CHUNK_SIZE', 1024 * 1024)
+    dest = str(tmpdir.join('dest.bin'))
+    assert copy_atomic(src, dest, engine=engine) == os.stat(src).st_size
+    assert open(dest, 'rb').read() == open(src, 'rb').read()
+    assert not os.path.exists(temp_path(dest))
+
+
+def test_copy_atomic_overwrites(src, tmpdir):
+    dest = tmpdir.join('dest.bin')
+    dest.write_binary(b'stale')
+    copy_atomic(src, str(dest))
+    assert dest.read_binary() == open(src, 'rb').read()
+
+
+def test_copy_atomic_resumes(src, tmpdir):
+    dest = str(tmpdir.join('dest.bin'))
+    data = open(src, 'rb').read()
+    with open(temp_path(dest), 'wb') as part:
+        part.write(data[:1024 * 1024])
+    # Only the remainder is copied
+    assert copy_atomic(src, dest) == len(data) - 1024 * 1024
+    assert open(dest, 'rb').read() == data
+
+
+def test_copy_atomic_discards_stale_part(src, tmpdir):
+    dest = str(tmpdir.join('dest.bin'))
+    with open(temp_path(dest), 'wb') as part:
+        part.write(b'x' * 1024)
+    # Partial copy predates the source, so it cannot be trusted
+    os.utime(temp_path(dest), (1, 1))
+    assert copy_atomic(src, dest) == os.stat(src).st_size
+    assert open(dest, 'rb').read() == open(src, 'rb').read()
+
+
+def test_copy_atomic_contended_part(src, tmpdir):
+    dest = str(tmpdir.join('dest.bin'))
+    data = open(src, 'rb').read()
+    with open(temp_path(dest), 'wb') as part:
+        part.write(data[:1024])
+        part.flush()
+        # Another copy is writing the partial copy; it is left alone
+        fcntl.flock(part, fcntl.LOCK_EX)
+        assert copy_atomic(src, dest) == len(data)
+        assert os.path.getsize(temp_path(dest)) == 1024
+    assert open(dest, 'rb').read() == data
+    # No uniquely named partial copy is left behind
+    assert not tmpdir.listdir(lambda p: p.basename.startswith('.dest.bin.uploads-manager.part.'))
+
+
+def test_copy_atomic_without_locks(src, tmpdir, monkeypatch):
+    def noflock(fd, operation):
+        raise OSError(fastcopy.errno.ENOSYS, 'Function not implemented')
+    monkeypatch.setattr(fastcopy.fcntl, 'flock', noflock)
+    dest = str(tmpdir.join('dest.bin'))
+    data = open(src, 'rb').read()
+    with open(temp_path(dest), 'wb') as part:
+        part.write(data[:1024])
+    # Unlocked partial copies cannot be trusted, so nothing is resumed
+    assert copy_atomic(src, dest) == len(data)
+    assert open(dest, 'rb').read() == data
+    assert not tmpdir.listdir(lambda p: p.basename.startswith('.dest.bin.uploads-manager.part.'))
+
+
+@pytest.mark.parametrize('engine', ['auto', 'chunked'])
+def test_copy_atomic_ranged(src, tmpdir, engine, monkeypatch):
+    monkeypatch.setattr(fastcopy, 'CHUNK_SIZE', 64 * 1024)
+    dest = str(tmpdir.join('dest.bin'))
+    # A stale partial copy is not resumed by a ranged copy
+    with open(temp_path(dest), 'wb') as part:
+        part.write(b'x' * 1024)
+    size = os.stat(src).st_size
+    assert copy_atomic(src, dest, engine=engine, ranged_threshold=1024,
+                       range_size=1024 * 1024 + 3, threads=4) == size
+    assert open(dest, 'rb').read() == open(src, 'rb').read()
+    assert not os.path.exists(temp_path(dest, fastcopy.RANGED_PART_SUFFIX))
+    assert os.path.getsize(temp_path(dest)) == 1024
+
+
+def test_copy_atomic_ranged_then_resume(src, tmpdir, monkeypatch):
+    dest = str(tmpdir.join('dest.bin'))
+    data = open(src, 'rb').read()
+
+    def interrupted(fd_in, fd_out, start, end, engine):
+        raise OSError('interrupted')
+
+    monkeypatch.setattr(fastcopy, 'copy_range_at', interrupted)
+    with pytest.raises(OSError):
+        copy_atomic(src, dest, ranged_threshold=1024, threads=4)
+    assert not os.path.exists(temp_path(dest, fastcopy.RANGED_PART_SUFFIX))
+    # A preallocated ranged part left by a killed copy is not resumed
+    with open(temp_path(dest, fastcopy.RANGED_PART_SUFFIX), 'wb') as part:
+        part.truncate(len(data))
+    hashers = new_digests(['md5'])
+    assert copy_atomic(src, dest, hashers=hashers) == len(data)
+    assert open(dest, 'rb').read() == data
+    assert hashers['md5'].hexdigest() == hashlib.md5(data).hexdigest()
+
+
+def test_ranges():
+    assert fastcopy.ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert fastcopy.ranges(8, 4) == [(0, 4), (4, 8)]
+    assert fastcopy.ranges(0, 4) == []
+
+
+@pytest.mark.parametrize('engine', fastcopy.ENGINES)
+def test_copy_atomic_hashes(src, tmpdir, engine):
+    dest = str(tmpdir.join('dest.bin'))
+    data = open(src, 'rb').read()
+    # Bytes kept from a partial copy are hashed too
+    with open(temp_path(dest), 'wb') as part:
+        part.write(data[:1024 * 1024])
+    hashers = new_digests(['sha256', 'md5'])
+    assert copy_atomic(src, dest, engine=engine, hashers=hashers,
+                       ranged_threshold=1024) == len(data) - 1024 * 1024
+    assert open(dest, 'rb').read() == data
+    assert hashers['sha256'].hexdigest() == hashlib.sha256(data).hexdigest()
+    assert hashers['md5'].hexdigest() == hashlib.md5(data).hexdigest()
+
+
+def test_new_digests():
+    with pytest.raises(ValueError):
+        new_digests(['sha256', 'crc99'])
+
+
+def test_copy_file_strategies(src, tmpdir, monkeypatch):
+    data = open(src, 'rb').read()
+    dest = str(tmpdir.join('dest.bin'))
+    strategy, copied = fastcopy.copy_file(src, dest, reflink=False,
+                                          hardlink=True)
+    assert strategy == 'hardlink' and copied == 0
+    assert os.path.samefile(src, dest)
+    assert not os.path.exists(temp_path(dest))
+    # Linking again leaves nothing behind for a later copy to resume from
+    assert fastcopy.copy_file(src, dest, reflink=False,
+                              hardlink=True) == ('hardlink', 0)
+    assert sorted(os.listdir(str(tmpdir))) == ['dest.bin', 'src.bin']
+
+    # Filesystems without clone support fall back to copying bytes
+    def no_clone(fd, request, arg):
+        raise OSError(fastcopy.errno.EOPNOTSUPP, 'Operation not supported')
+    monkeypatch.setattr(fastcopy.fcntl, 'ioctl', no_clone)
+    os.unlink(dest)
+    hashers = new_digests(['sha256'])
+    strategy, copied = fastcopy.copy_file(src, dest, hashers=hashers)
+    assert strategy == 'copy' and copied == len(data)
+    assert not os.path.samefile(src, dest)
+    assert open(dest, 'rb').read() == data
+    assert hashers['sha256'].hexdigest() == hashlib.sha256(data).hexdigest()
+    assert not os.path.exists(temp_path(dest))
+
+
+def test_copy_file_reflink(src, tmpdir, monkeypatch):
+    def fake_clone(fd_out, request, fd_in):
+        assert request == fastcopy.FICLONE
+        os.write(fd_out, os.pread(fd_in, os.fstat(fd_in).st_size, 0))
+    monkeypatch.setattr(fastcopy.fcntl, 'ioctl', fake_clone)
+    dest = str(tmpdir.join('dest.bin'))
+    hashers = new_digests(['md5'])
+    assert fastcopy.copy_file(src, dest, hardlink=True,
+                              hashers=hashers) == ('reflink', 0)
+    data = open(src, 'rb').read()
+    assert open(dest, 'rb').read() == data
+    assert hashers['md5'].hexdigest() == hashlib.md5(data).hexdigest()
+    assert sorted(os.listdir(str(tmpdir))) == ['dest.bin', 'src.bin']
+
+
+def test_reflink_keeps_partial_copy(src, tmpdir, monkeypatch):
+    def no_clone(fd, request, arg):
+        raise OSError(fastcopy.errno.EXDEV, 'Invalid cross-device link')
+    monkeypatch.setattr(fastcopy.fcntl, 'ioctl', no_clone)
+    dest = str(tmpdir.join('dest.bin'))
+    data = open(src, 'rb').read()
+    with open(temp_path(dest), 'wb') as part:
+        part.write(data[:1024])
+    # The failed clone leaves the partial copy to be resumed
+    assert fastcopy.copy_file(src, dest) == ('copy', len(data) - 1024)
+    assert open(dest, 'rb').read() == data
+    assert sorted(os.listdir(str(tmpdir))) == ['dest.bin', 'src.bin']
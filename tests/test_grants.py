@@ -0,0 +1,74 @@
+"""Tests for code in grants.py and grant-related helpers in copyfile.py"""
+import os
+import sys
+from collections import namedtuple
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+import grants
+from grants import GrantManager, coalesce
+from copyfile import created_agave_parents, missing_parent
+
+Grant = namedtuple('Grant', ['username', 'pem', 'recursive'])
+ROOT = 'agave://data-sd2e-community/uploads'
+
+
+class FakeClock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def manager(monkeypatch, floor=None):
+    calls = list()
+    monkeypatch.setattr(grants, 'resilient_files_pems',
+                        lambda client, uri, user, pem, rec: calls.append(
+                            (uri, user, pem, rec)))
+    clock = FakeClock()
+    return GrantManager(None, ttl=60, floor=floor, clock=clock), calls, clock
+
+
+def test_coalesce():
+    paths = [ROOT + '/a/x.txt', ROOT + '/a', ROOT + '/a/b/y.txt',
+             ROOT + '/c/z.txt']
+    assert coalesce(paths) == [ROOT + '/a', ROOT + '/c/z.txt']
+    # Never coalesced up to the floor itself
+    assert coalesce(paths, floor=ROOT) == [ROOT + '/a', ROOT + '/c/z.txt']
+    assert coalesce([ROOT + '/p/a/x', ROOT + '/p/b/y'], floor=ROOT) == [
+        ROOT + '/p']
+
+
+def test_cache_skips_repeats(monkeypatch):
+    gm, calls, clock = manager(monkeypatch)
+    world = [Grant('world', 'READ', False)]
+    assert gm.grant([ROOT + '/a', ROOT + '/a/x'], world) == (2, 0)
+    assert gm.grant([ROOT + '/a', ROOT + '/a/y'], world) == (1, 0)
+    assert len(calls) == 3
+    clock.now = 61
+    gm.grant([ROOT + '/a'], world)
+    assert len(calls) == 4
+
+
+def test_recursive_grant_covers_children(monkeypatch):
+    gm, calls, clock = manager(monkeypatch, floor=ROOT)
+    rec = [Grant('world', 'READ', True)]
+    gm.grant([ROOT + '/p/a/x', ROOT + '/p/b/y'], rec)
+    assert calls == [(ROOT + '/p', 'world', 'READ', True)]
+    gm.grant([ROOT + '/p/c/z'], rec)
+    assert len(calls) == 1
+
+
+def test_created_agave_parents(tmpdir):
+    base = str(tmpdir)
+    posix_dest = os.path.join(base, 'uploads/new/deeper/file.txt')
+    os.makedirs(os.path.join(base, 'uploads'))
+    created = missing_parent(os.path.dirname(posix_dest))
+    assert created == os.path.join(base, 'uploads/new')
+    assert created_agave_parents(
+        created, posix_dest, ROOT + '/new/deeper/file.txt') == [
+            ROOT + '/new/deeper', ROOT + '/new']
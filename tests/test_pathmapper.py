@@ -0,0 +1,48 @@
+"""Tests for code in pathmapper.py"""
+import os
+import sys
+
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from datacatalog.utils import safen_path
+from pathmapper import PathMapper
+from s3helpers import S3Helper
+
+
+class WorkHelper(object):
+    def mapped_posix_path(self, path):
+        return os.path.join('/work/projects/data', path.lstrip('/'))
+
+
+@pytest.mark.parametrize('relpath', [
+    'uploads/emerald/201809/protein.png',
+    'uploads/emerald/plate map/día 1.csv',
+    'uploads/top.txt'])
+@pytest.mark.parametrize('safen', [True, False])
+def test_map_matches_per_call(relpath, safen):
+    sh = S3Helper()
+    ah = WorkHelper()
+    ag_relpath = safen_path(relpath, no_unicode=True, no_spaces=True) \
+        if safen else relpath
+    mapper = PathMapper(sh, ah, safen=safen)
+    assert mapper.map(relpath) == (
+        ag_relpath,
+        'agave://data-sd2e-community/' + ag_relpath,
+        sh.mapped_catalog_path(relpath),
+        ah.mapped_posix_path('/' + ag_relpath))
+    assert mapper.map_uri('s3://' + relpath) == mapper.map(relpath)
+
+
+def test_directories_are_cached():
+    mapper = PathMapper(S3Helper(), WorkHelper())
+    relpaths = ['uploads/run 1/file-{}.txt'.format(i) for i in range(10)]
+    mapped = [mapping for relpath, mapping in mapper.map_many(relpaths)]
+    assert mapped[3][0] == 'uploads/run-1/file-3.txt'
+    assert mapper.cache_info().misses == 1
+    assert mapper.cache_info().hits == 9
@@ -0,0 +1,94 @@
+"""Tests for code in planner.py"""
+import io
+import json
+import os
+import sys
+
+import pytest
+from attrdict import AttrDict
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from planner import plan
+from posixhelpers import walk_sorted
+
+
+class LocalS3Helper(object):
+    def __init__(self, root):
+        self.root = root
+
+    def from_s3_uri(self, uri):
+        path = uri[len('s3://'):]
+        bucket, dirpath = path.split('/', 1)
+        return bucket, os.path.dirname(dirpath), os.path.basename(dirpath)
+
+    def mapped_catalog_path(self, path):
+        return os.path.join(self.root, path)
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def trees(tmpdir):
+    src = os.path.join(str(tmpdir), 'src')
+    dest = os.path.join(str(tmpdir), 'dest')
+    write(os.path.join(src, 'uploads', 'run', 'a.txt'), 'aaaa')
+    write(os.path.join(src, 'uploads', 'run', 'sub', 'b.txt'), 'bb')
+    write(os.path.join(src, 'uploads', 'run', 'sub', 'c.txt'), 'cccccc')
+    write(os.path.join(dest, 'run', 'a.txt'), 'aaaa')
+    write(os.path.join(dest, 'run', 'sub', 'c.txt'), 'ccc')
+    write(os.path.join(dest, 'run', 'sub', 'z.txt'), 'z')
+    settings = AttrDict({
+        'safen_paths': False,
+        'sync': {'mtime': False, 'size': True, 'cksum': False},
+        'destination': {'posix_path': dest,
+                        'bucket': 'agave://data-sd2e-community/uploads'},
+        'planner': {'throughput_mb_s': 1, 'per_file_seconds': 1}})
+    return settings, LocalS3Helper(src)
+
+
+def test_walk_sorted(trees):
+    settings, sh = trees
+    root = os.path.join(sh.root, 'uploads', 'run')
+    assert [parts for parts, entry in walk_sorted(root)] == [
+        ('a.txt', ), ('sub', 'b.txt'), ('sub', 'c.txt')]
+
+
+def test_plan(trees):
+    settings, sh = trees
+    out = io.StringIO()
+    summary = plan(settings, 's3://uploads/run/', out, sh=sh)
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines[-1] == {'summary': summary}
+    actions = {os.path.basename(l['dest']): l['action'] for l in lines[:-1]}
+    assert actions == {'a.txt': 'skip', 'b.txt': 'copy', 'c.txt': 'copy'}
+    assert summary['files'] == 3
+    assert summary['copy_bytes'] == 8
+    assert summary['dest_only'] == 1
+    assert summary['estimated_seconds'] == 2.0
+
+
+def test_plan_single_file(trees):
+    settings, sh = trees
+    out = io.StringIO()
+    summary = plan(settings, 's3://uploads/run/sub/c.txt', out, sh=sh)
+    decision = json.loads(out.getvalue().splitlines()[0])
+    assert decision['agave_uri'] == \
+        'agave://data-sd2e-community/uploads/run/sub/c.txt'
+    assert decision['action'] == 'copy'
+    assert summary['files'] == 1
+    assert summary['dest_only'] == 0
+
+
+def test_plan_refuses_unmounted_source(trees):
+    settings, sh = trees
+    with pytest.raises(ValueError):
+        plan(settings, 's3://uploads/missing', io.StringIO())
@@ -0,0 +1,59 @@
+"""Tests for code in ratecontrol.py"""
+import os
+import sys
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from ratecontrol import SubmissionController
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def controller(**kwargs):
+    clock = FakeClock()
+    ctl = SubmissionController(min_rate=1, max_rate=10, initial_rate=2,
+                               clock=clock, sleep=clock.sleep, **kwargs)
+    return ctl, clock
+
+
+def test_paces_at_rate():
+    ctl, clock = controller()
+    for _ in range(5):
+        ctl.acquire()
+    # One token of burst, then 2/s
+    assert abs(clock.now - 2.0) < 1e-9
+
+
+def test_additive_increase_bounded():
+    ctl, clock = controller()
+    for _ in range(20):
+        ctl.record(0.1, ok=True)
+    assert ctl.rate == 10
+
+
+def test_multiplicative_decrease_and_hold():
+    ctl, clock = controller(max_backoff=5)
+    ctl.rate = 8
+    ctl.record(0.1, ok=False)
+    assert ctl.rate == 4
+    # Failure holds off the next submission
+    assert ctl.acquire() > 0
+    ctl.record(30.0, ok=True)
+    assert ctl.rate == 2
+    ctl.record(30.0, ok=True)
+    assert ctl.rate == 1
+    assert ctl.state()['failed'] == 1
+    assert ctl.state()['slow'] == 2
@@ -0,0 +1,101 @@
+"""Tests for scripts/replay_messages.py against scripts/abaco_standin.py"""
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+sys.path.insert(0, os.path.join(PARENT, 'scripts'))
+
+from abaco_standin import StandIn, make_handler
+from replay_messages import HttpSender, read_messages, replay
+
+
+@pytest.fixture
+def serve():
+    servers = list()
+
+    def start(standin):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(standin))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return 'http://127.0.0.1:{}'.format(server.server_port)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class Counting(object):
+    """Sender wrapper recording the most sends in flight at once"""
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.peak = 0
+
+    def send(self, message):
+        with self.lock:
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+        try:
+            return self.sender.send(message)
+        finally:
+            with self.lock:
+                self.inflight -= 1
+
+
+@pytest.fixture
+def messages(tmpdir):
+    path = tmpdir.join('messages.jsonl')
+    path.write(''.join(json.dumps({'uri': 's3://uploads/{}.txt'.format(i)})
+                       + '\n' for i in range(40)))
+    return str(path)
+
+
+def run(url, messages, tmpdir, concurrency=4):
+    sender = Counting(HttpSender(url, 'uploads-manager', timeout=5))
+    summary = replay(read_messages(messages), sender,
+                     str(tmpdir.join('checkpoint')),
+                     str(tmpdir.join('failures.jsonl')),
+                     concurrency=concurrency, retries=1, backoff=0,
+                     out=open(os.devnull, 'w'))
+    return summary, sender
+
+
+def test_replay_bounded(serve, messages, tmpdir):
+    standin = StandIn(latency=0.02, jitter=0)
+    summary, sender = run(serve(standin), messages, tmpdir, concurrency=4)
+    assert summary['sent'] == 40 and summary['failed'] == 0
+    assert standin.snapshot()['accepted'] == 40
+    assert 1 < sender.peak <= 4
+
+
+def test_replay_failures_then_resume(serve, messages, tmpdir):
+    standin = StandIn(latency=0, jitter=0, error_rate=0.3, seed=7)
+    summary, sender = run(serve(standin), messages, tmpdir)
+    errors = standin.snapshot()['errors']
+    assert 0 < errors < 40
+    assert summary['failed'] == errors and summary['sent'] == 40 - errors
+    failures = [json.loads(line) for line in tmpdir.join('failures.jsonl')
+                .readlines()]
+    assert len(failures) == errors
+    assert 'Internal Server Error' in failures[0]['error']
+
+    # A rerun sends only what failed and the failures log is current
+    standin = StandIn(latency=0, jitter=0)
+    summary, sender = run(serve(standin), messages, tmpdir)
+    assert summary['skipped'] == 40 - errors and summary['sent'] == errors
+    assert standin.snapshot()['received'] == errors
+    assert tmpdir.join('failures.jsonl').read() == ''
+    assert len(tmpdir.join('checkpoint').readlines()) == 40
@@ -0,0 +1,84 @@
+"""Tests for code in routemsg.py"""
+import os
+import re
+import sys
+import threading
+import time
+import yaml
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from routemsg import RoutingTable, routemsg
+
+
+@pytest.fixture()
+def routings():
+    with open(os.path.join(CWD, 'config.yml'), "r") as conf:
+        y = yaml.safe_load(conf)
+    return y['routings'], y['linked_reactors']
+
+
+@pytest.mark.parametrize('path', [
+    'agave://data-sd2e-community/uploads/emerald/201808/protein.png',
+    'agave://data-sd2e-community/uploads/biofab/samples.json',
+    'agave://data-sd2e-community/uploads/biofab/samples.json.bak',
+    ''])
+def test_table_matches_per_pattern_search(routings, path):
+    table = RoutingTable(*routings)
+    expected = [name for name, globs in routings[0].items()
+                if any(re.compile(g).search(path) for g in globs)]
+    assert [route['name'] for route in table.match(path)] == expected
+
+
+def test_table_route_settings():
+    table = RoutingTable({'a': ['^agave://x/', r'\.csv$'], 'b': ['zzz']},
+                         {'a': {'id': 'actor-a', 'ignore_err': True,
+                                'timeout': 5}})
+    routes = table.match('agave://y/file.csv')
+    assert len(routes) == 1
+    assert routes[0]['actor_id'] == 'actor-a'
+    assert routes[0]['ignore_err'] is True
+    assert routes[0]['timeout'] == 5
+    assert table.match('agave://y/zzz.txt')[0]['actor_id'] is None
+
+
+class HungSettings(object):
+    routings = {'a': ['.']}
+    linked_reactors = {'a': {'id': 'actor-a', 'ignore_err': True,
+                             'timeout': 0.1}}
+
+
+class Hung(object):
+    """Reactor stand-in whose sends block until released"""
+
+    def __init__(self):
+        self.local = False
+        self.settings = HungSettings()
+        self.release = threading.Event()
+        self.warnings = list()
+        self.logger = self
+
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+    def send_message(self, actor_id, message=None):
+        self.release.wait()
+
+
+def test_route_timeout_does_not_hold_exit():
+    r = Hung()
+    start = time.time()
+    routemsg(r, 'agave://x/file.txt')
+    assert time.time() - start < 5
+    assert 'No response after 0.1s' in r.warnings[0]
+    senders = [t for t in threading.enumerate() if t.name == 'routemsg']
+    assert senders and all(t.daemon for t in senders)
+    r.release.set()
@@ -118,6 +118,22 @@ def test_listdir(s3helper, s3bucket):
                                 'uploads/emerald/201808/protein.png', 'uploads/emerald/201808/dna/sequence.fa']
 
 
+def test_iterdir(s3helper, s3bucket):
+    # Streaming listing matches listdir() ordering and yields DirEntry
+    listing = list(s3helper.iterdir('uploads/emerald', bucket=s3bucket,
+                                    directories=False))
+    assert [relpath for relpath, entry in listing] == s3helper.listdir(
+        'uploads/emerald', bucket=s3bucket, directories=False)
+    for relpath, entry in listing:
+        assert entry.path == s3helper.mapped_catalog_path(relpath)
+        assert entry.stat().st_size == os.stat(entry.path).st_size
+
+    # Non-recursive listing only returns the top level
+    assert list(relpath for relpath, entry in s3helper.iterdir(
+        'uploads/emerald', recurse=False, bucket=s3bucket)) == [
+            'uploads/emerald/201808']
+
+
 def test_paths_to_uris(s3helper, s3bucket):
     filepaths = s3helper.listdir(
         'uploads/emerald/201808', bucket=s3bucket, directories=False)
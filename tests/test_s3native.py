@@ -0,0 +1,110 @@
+"""Tests for native S3 listings in s3helpers.py, run against moto"""
+import hashlib
+import os
+import sys
+
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from cmpfiles import cmpobject
+from fingerprint import s3_etag, matches_s3_etag
+from s3helpers import S3Helper
+
+KEYS = ['proj/a.txt', 'proj/run 1/b.txt', 'proj/run 1/deep/c.txt',
+        'proj/z.txt', 'other/d.txt']
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    mock = getattr(moto, 'mock_aws', None) or getattr(moto, 'mock_s3')
+    with mock():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='uploads')
+        for key in KEYS:
+            client.put_object(Bucket='uploads', Key=key,
+                              Body=key.encode() * 3)
+        sh = S3Helper()
+        sh.STORAGE_PAGESIZE = 2
+        sh.LISTING = 'native'
+        yield sh
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_iterdir_s3native(s3, prefetch):
+    listing = list(s3.iterdir_s3native('uploads/proj', prefetch=prefetch))
+    assert [relpath for relpath, entry in listing] == [
+        'uploads/' + key for key in sorted(KEYS) if key.startswith('proj/')]
+    entry = listing[0][1]
+    assert entry.size == len('proj/a.txt') * 3
+    assert entry.stat().st_size == entry.size
+    assert entry.etag == hashlib.md5(b'proj/a.txt' * 3).hexdigest()
+
+
+def test_iterdir_s3native_ordered(s3):
+    s3.get_s3_client().put_object(Bucket='uploads',
+                                  Key='proj/run 1-2/e.txt', Body=b'e')
+    listing = [relpath for relpath, entry in s3.iterdir(
+        'uploads/proj', directories=False, ordered=True)]
+    # Files of a directory first, then its subdirectories, all by name
+    assert listing == ['uploads/proj/a.txt', 'uploads/proj/z.txt',
+                       'uploads/proj/run 1/b.txt',
+                       'uploads/proj/run 1/deep/c.txt',
+                       'uploads/proj/run 1-2/e.txt']
+
+
+def test_listdir_native_not_recursive(s3):
+    assert s3.listdir('uploads/proj', recurse=False) == [
+        'uploads/proj/run 1', 'uploads/proj/a.txt', 'uploads/proj/z.txt']
+    assert s3.listdir('uploads/proj', recurse=False, directories=False) == [
+        'uploads/proj/a.txt', 'uploads/proj/z.txt']
+
+
+def test_pagesize_from_environment(monkeypatch):
+    assert S3Helper().STORAGE_PAGESIZE == -1
+    monkeypatch.setenv('TACC_S3_PAGESIZE', '250')
+    assert S3Helper().STORAGE_PAGESIZE == 250
+
+
+def test_auto_listing(s3, tmpdir):
+    s3.LISTING = 'auto'
+    s3.STORAGE_PREFIX = str(tmpdir)
+    assert s3.use_native('uploads/proj') is True
+    tmpdir.join('uploads', 'proj').ensure(dir=True)
+    assert s3.use_native('uploads/proj') is False
+
+
+def test_cmpobject(s3, tmpdir):
+    relpath, entry = next(s3.iterdir('uploads/proj'))
+    dest = os.path.join(str(tmpdir), 'a.txt')
+    assert cmpobject(entry, dest) is False
+    with open(dest, 'wb') as f:
+        f.write(b'proj/a.txt' * 3)
+    assert cmpobject(entry, dest, etag=True) is True
+    with open(dest, 'wb') as f:
+        f.write(b'proj/a.tx!' * 3)
+    assert cmpobject(entry, dest) is True
+    assert cmpobject(entry, dest, etag=True) is False
+
+
+def test_multipart_etag(tmpdir):
+    path = os.path.join(str(tmpdir), 'big')
+    part_size = 5 * 1024 * 1024
+    with open(path, 'wb') as f:
+        f.write(os.urandom(part_size * 2 + 10))
+    etag = s3_etag(path, part_size)
+    assert etag.endswith('-3')
+    assert matches_s3_etag(path, etag)
+    assert not matches_s3_etag(path, '0' * 32 + '-3')
+    assert not matches_s3_etag(path, etag[:-1] + '4')
+    assert matches_s3_etag(path, s3_etag(path))
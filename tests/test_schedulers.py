@@ -0,0 +1,88 @@
+"""Tests for code in schedulers.py"""
+import os
+import sys
+
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+from attrdict import AttrDict
+
+from schedulers import (from_settings, round_robin, windowed_priority,
+                        windowed_shuffle)
+
+
+def test_windowed_shuffle_is_permutation():
+    items = list(range(1000))
+    shuffled = list(windowed_shuffle(iter(items), window=50))
+    assert sorted(shuffled) == items
+    assert shuffled != items
+
+
+def test_windowed_shuffle_is_lazy():
+    def endless():
+        n = 0
+        while True:
+            yield n
+            n += 1
+    gen = windowed_shuffle(endless(), window=10)
+    first = [next(gen) for _ in range(100)]
+    # Nothing is emitted from further ahead than the window allows
+    assert max(first) < 110
+
+
+def test_windowed_priority():
+    sizes = [50, 3, 40, 1, 7, 2, 90, 5]
+    assert list(windowed_priority(sizes, window=100, key=int)) == \
+        sorted(sizes)
+    # A small window only reorders nearby items
+    assert list(windowed_priority(sizes, window=2, key=int)) == \
+        [3, 1, 7, 2, 40, 5, 50, 90]
+    ties = [('a', 1), ('b', 0), ('c', 1), ('d', 0)]
+    assert [name for name, size in windowed_priority(
+        ties, window=10, key=lambda item: item[1])] == ['b', 'd', 'a', 'c']
+
+
+def test_round_robin():
+    paths = ['a/1', 'a/2', 'a/3', 'b/1', 'b/2', 'c/1']
+    ordered = list(round_robin(paths, window=10, key=os.path.dirname))
+    assert ordered == ['a/1', 'b/1', 'c/1', 'a/2', 'b/2', 'a/3']
+    assert sorted(round_robin(paths, window=2,
+                              key=os.path.dirname)) == sorted(paths)
+
+
+@pytest.mark.parametrize('policy', ['shuffle', 'smallest_first',
+                                    'route_priority', 'round_robin'])
+def test_from_settings(policy):
+    settings = AttrDict({
+        'batch': {'shuffle_window': 100,
+                  'scheduler': {'policy': policy,
+                                'routes': ['etl', 'fixity']}},
+        'routings': {'fixity': ['.'], 'etl': ['.json$']},
+        'linked_reactors': {}})
+    items = [('agave://data/run/big.fastq', 9000),
+             ('agave://data/run/small.fastq', 10),
+             ('agave://data/run/meta.json', 500),
+             ('agave://data/other/x.csv', 20)]
+    order = from_settings(settings, uri=lambda item: item[0],
+                          size=lambda item: item[1])
+    ordered = [os.path.basename(item[0]) for item in order(iter(items))]
+    assert sorted(ordered) == ['big.fastq', 'meta.json', 'small.fastq',
+                               'x.csv']
+    if policy == 'smallest_first':
+        assert ordered == ['small.fastq', 'x.csv', 'meta.json', 'big.fastq']
+    elif policy == 'route_priority':
+        assert ordered == ['meta.json', 'small.fastq', 'x.csv', 'big.fastq']
+    elif policy == 'round_robin':
+        assert ordered == ['big.fastq', 'x.csv', 'small.fastq', 'meta.json']
+
+
+def test_unknown_policy():
+    settings = AttrDict({'batch': {'shuffle_window': 10,
+                                   'scheduler': {'policy': 'fifo'}}})
+    with pytest.raises(ValueError):
+        from_settings(settings, uri=None, size=None)
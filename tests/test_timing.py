@@ -0,0 +1,37 @@
+"""Tests for code in timing.py"""
+import os
+import sys
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+import timing
+
+
+def test_span_and_counters():
+    timing.reset()
+    with timing.span('copy', nbytes=10):
+        pass
+    timing.record('copy', 0.003, 5)
+    timing.count('retries')
+    timing.retry_counter('retries')(None)
+    summary = timing.summary(histograms=True)
+    assert summary['spans']['copy']['count'] == 2
+    assert summary['spans']['copy']['bytes'] == 15
+    assert summary['spans']['copy']['histogram_ms']['<=4'] == 1
+    assert summary['counters'] == {'retries': 2}
+    timing.reset()
+    assert timing.summary() == {'spans': {}, 'counters': {}}
+
+
+def test_run_profiled(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), 'run.prof')
+    monkeypatch.setenv(timing.PROFILE_ENV, path)
+    assert timing.run_profiled(sum, [1, 2]) == 3
+    assert os.path.exists(path)
+    monkeypatch.setenv(timing.PROFILE_ENV, str(tmpdir))
+    timing.run_profiled(sum, [1])
+    assert len(os.listdir(str(tmpdir))) == 2
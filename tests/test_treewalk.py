@@ -0,0 +1,117 @@
+"""Tests for code in treewalk.py"""
+import os
+import sys
+import time
+
+import pytest
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+import treewalk
+from s3helpers import S3Helper
+
+
+@pytest.fixture()
+def s3helper(tmpdir, monkeypatch):
+    root = tmpdir.mkdir('ingest')
+    for d in range(4):
+        for s in range(3):
+            sub = root.join('uploads', 'run {}'.format(d), 'plate_{}'.format(s))
+            sub.ensure(dir=True)
+            for f in range(5):
+                sub.join('{}.txt'.format(f)).write('x')
+        root.join('uploads', 'run {}'.format(d), 'manifest.json').write('{}')
+    os.symlink(str(root.join('uploads', 'run 0')),
+               str(root.join('uploads', 'run 1', 'link')))
+    monkeypatch.setenv('TACC_S3_ROOTDIR', str(root))
+    return S3Helper()
+
+
+def posix_ordered(s3helper, path, recurse=True, directories=True):
+    return [relpath for relpath, entry in s3helper.iterdir_s3_posix(
+        path, recurse, directories=directories, ordered=True)]
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_lustre_matches_posix(s3helper, threads):
+    s3helper.WALK_THREADS = threads
+    posix = s3helper.listdir_s3_posix('/uploads')
+    assert sorted(s3helper.listdir_s3_lustre('/uploads')) == sorted(posix)
+    assert s3helper.listdir_s3_lustre('/uploads', ordered=True) == \
+        posix_ordered(s3helper, '/uploads')
+    assert sorted(posix_ordered(s3helper, '/uploads')) == sorted(posix)
+    assert 'uploads/run 1/link' in posix
+    assert 'uploads/run 1/link/manifest.json' not in posix
+
+
+def test_lustre_options(s3helper):
+    for recurse in (True, False):
+        for directories in (True, False):
+            assert s3helper.listdir_s3_lustre(
+                '/uploads', recurse, directories=directories,
+                ordered=True) == posix_ordered(
+                    s3helper, '/uploads', recurse, directories)
+    s3helper.LISTING = 'lustre'
+    assert sorted(s3helper.listdir('/uploads')) == \
+        sorted(s3helper.listdir_s3_posix('/uploads'))
+
+
+def test_ordered_despite_latency(tmpdir):
+    for name in ('a', 'b', 'c', 'd'):
+        tmpdir.join(name, 'sub').ensure(dir=True)
+        tmpdir.join(name, 'sub', 'f').write('x')
+
+    def slow_scandir(path):
+        # Earlier directories answer last
+        if os.path.basename(path) in ('a', 'b'):
+            time.sleep(0.05)
+        return os.scandir(path)
+
+    walked = [reldir for reldir, subdirs, files in
+              treewalk.walk(str(tmpdir), threads=4, ordered=True,
+                            scandir=slow_scandir)]
+    expected = [reldir for reldir, subdirs, files in
+                treewalk.walk(str(tmpdir), threads=1, ordered=True)]
+    assert walked == expected
+    assert len(walked) == 9
+
+
+@pytest.mark.parametrize('buffered', [1, 3])
+@pytest.mark.parametrize('ordered', [True, False])
+def test_read_ahead_is_bounded(tmpdir, ordered, buffered):
+    for d in range(6):
+        for s in range(4):
+            tmpdir.join(str(d), str(s)).ensure(dir=True)
+    reads = []
+
+    def slow_scandir(path):
+        reads.append(path)
+        # Earlier directories answer last
+        if os.path.basename(path) == '0':
+            time.sleep(0.02)
+        return os.scandir(path)
+
+    walked = []
+    for reldir, subdirs, files in treewalk.walk(
+            str(tmpdir), threads=4, ordered=ordered, scandir=slow_scandir,
+            buffered=buffered):
+        walked.append(reldir)
+        assert len(reads) - len(walked) <= buffered
+    assert len(walked) == 31 and len(reads) == 31
+    if ordered:
+        assert walked == [reldir for reldir, subdirs, files in
+                          treewalk.walk(str(tmpdir), threads=1, ordered=True)]
+
+
+def test_errors_are_raised(tmpdir):
+    tmpdir.join('a').ensure(dir=True)
+
+    def broken(path):
+        raise RuntimeError('boom')
+
+    with pytest.raises(treewalk.TreeWalkError):
+        list(treewalk.walk(str(tmpdir), threads=2, scandir=broken))
@@ -0,0 +1,50 @@
+"""Tests for the spool handling in worker.py"""
+import os
+import sys
+
+CWD = os.getcwd()
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARENT = os.path.dirname(HERE)
+sys.path.insert(0, CWD)
+sys.path.insert(0, PARENT)
+
+import worker
+from worker import claim, finish, recover, spool_dirs
+
+
+def test_claim_and_finish(tmpdir):
+    dirs = spool_dirs(str(tmpdir))
+    for name in ('b.json', 'a.json', 'partial.tmp'):
+        with open(os.path.join(dirs['incoming'], name), 'w') as f:
+            f.write('{"uri": "s3://uploads/a.txt"}')
+    first = claim(dirs)
+    assert os.path.dirname(first) == dirs['processing']
+    assert worker.message_name(first) == 'a.json'
+    second = claim(dirs)
+    assert claim(dirs) is None
+    finish(dirs, first)
+    finish(dirs, second, 'Traceback')
+    assert os.listdir(dirs['done']) == ['a.json']
+    assert sorted(os.listdir(dirs['failed'])) == ['b.json', 'b.json.error']
+    assert os.listdir(dirs['incoming']) == ['partial.tmp']
+
+
+def test_recover(tmpdir, monkeypatch):
+    dirs = spool_dirs(str(tmpdir))
+    for name in ('a.json', 'b.json', 'c.json'):
+        with open(os.path.join(dirs['incoming'], name), 'w') as f:
+            f.write('{}')
+    mine = claim(dirs)
+    dead = claim(dirs)
+    old = claim(dirs)
+    # b was claimed by a process that has since exited, and c by a worker
+    # on another host long ago
+    os.rename(dead, dead.rsplit(':', 1)[0] + ':999999999')
+    os.rename(old, os.path.join(dirs['processing'],
+                                'c.json' + worker.OWNER_SEP + 'other:1'))
+    os.utime(os.path.join(dirs['processing'],
+                          'c.json' + worker.OWNER_SEP + 'other:1'), (1, 1))
+    assert recover(dirs, stale=3600) == 2
+    assert sorted(os.listdir(dirs['incoming'])) == ['b.json', 'c.json']
+    assert os.listdir(dirs['processing']) == [os.path.basename(mine)]
+    assert recover(dirs, stale=None) == 0
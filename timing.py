@@ -0,0 +1,130 @@
+"""
+Lightweight per-phase timing for an execution
+
+Code wraps each phase in span(), which records the number of calls, total
+seconds and, optionally, bytes under the span's name. Counters such as retry
+counts are kept with count(). Everything is recorded in one process-wide
+registry so that helpers like copyfile() and routemsg() need no extra
+arguments, and summary() turns it into a dictionary suitable for a single
+JSON log line. Per-span histograms bucket durations by powers of two of a
+millisecond and are most useful for directory runs.
+
+Setting UPLOADS_MANAGER_PROFILE to a file path runs the execution under
+cProfile and writes the profile there (or into the directory, if the path
+is one).
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PROFILE_ENV = 'UPLOADS_MANAGER_PROFILE'
+
+_LOCK = threading.Lock()
+_SPANS = {}
+_COUNTERS = {}
+
+
+def _bucket(seconds):
+    # Upper bound in ms of the power-of-two bucket holding seconds
+    bound = 1
+    while bound < seconds * 1000:
+        bound *= 2
+    return bound
+
+
+def record(name, seconds, nbytes=None):
+    """Add one observation of seconds (and optionally bytes) to span name"""
+    with _LOCK:
+        span_stats = _SPANS.get(name)
+        if span_stats is None:
+            span_stats = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                          'bytes': 0, 'histogram': {}}
+            _SPANS[name] = span_stats
+        span_stats['count'] += 1
+        span_stats['seconds'] += seconds
+        span_stats['max_seconds'] = max(span_stats['max_seconds'], seconds)
+        if nbytes is not None:
+            span_stats['bytes'] += nbytes
+        bucket = _bucket(seconds)
+        span_stats['histogram'][bucket] = \
+            span_stats['histogram'].get(bucket, 0) + 1
+
+
+@contextmanager
+def span(name, nbytes=None):
+    """Time the enclosed block as one observation of span name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, nbytes)
+
+
+def count(name, increment=1):
+    with _LOCK:
+        _COUNTERS[name] = _COUNTERS.get(name, 0) + increment
+
+
+def retry_counter(name):
+    """A tenacity before_sleep callback that counts retries under name"""
+    def before_sleep(*args, **kwargs):
+        count(name)
+    return before_sleep
+
+
+def reset():
+    with _LOCK:
+        _SPANS.clear()
+        _COUNTERS.clear()
+
+
+def summary(histograms=False):
+    """Return recorded spans and counters as a JSON-serializable dict"""
+    with _LOCK:
+        spans = dict()
+        for name, span_stats in _SPANS.items():
+            spans[name] = {'count': span_stats['count'],
+                           'seconds': round(span_stats['seconds'], 6),
+                           'max_seconds': round(span_stats['max_seconds'], 6)}
+            if span_stats['bytes'] > 0:
+                spans[name]['bytes'] = span_stats['bytes']
+            if histograms:
+                spans[name]['histogram_ms'] = dict(
+                    ('<={}'.format(bound), hits) for bound, hits in
+                    sorted(span_stats['histogram'].items()))
+        return {'spans': spans, 'counters': dict(_COUNTERS)}
+
+
+def log_summary(r, histograms=False, **extra):
+    """Log summary() plus any extra fields as one JSON line"""
+    run_summary = dict(extra)
+    run_summary.update(summary(histograms))
+    r.logger.info('Execution summary: {}'.format(
+        json.dumps(run_summary, sort_keys=True)))
+    return run_summary
+
+
+def profile_path(environ=os.environ):
+    """Where to write a cProfile dump, or None if profiling is off"""
+    path = environ.get(PROFILE_ENV)
+    if path is None or path == '':
+        return None
+    if os.path.isdir(path):
+        path = os.path.join(path, 'uploads-manager-{}-{}.prof'.format(
+            os.getpid(), int(time.time())))
+    return path
+
+
+def run_profiled(func, *args, **kwargs):
+    """Call func, under cProfile if UPLOADS_MANAGER_PROFILE is set"""
+    path = profile_path()
+    if path is None:
+        return func(*args, **kwargs)
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
@@ -0,0 +1,235 @@
+"""
+Parallel directory tree walks
+
+Walking a wide tree on Lustre or NFS is bound by the latency of each
+directory read rather than by bandwidth, so walk() reads several directories
+at once. Every thread keeps its own deque of directories to read. It pushes
+the subdirectories it finds onto its own deque and takes its next directory
+from the same end, staying depth-first; a thread that runs out steals from
+the other end of another thread's deque, where the directories found
+earliest, and so usually the largest subtrees, wait.
+
+Threads only read ahead of the consumer by a bounded number of directories.
+In ordered mode the threads share one heap instead, keyed by path so that
+the directories due soonest are read first, and should the allowance still
+be spent on directories that are not due yet, the consumer reads the
+directory it needs next itself.
+"""
+import heapq
+import os
+import queue
+import threading
+from collections import deque
+
+DEFAULT_THREADS = 8
+# Directory listings read but not yet consumed
+DEFAULT_BUFFERED = 256
+_DONE = object()
+
+
+class TreeWalkError(Exception):
+    pass
+
+
+class _Walk(object):
+    def __init__(self, threads, recurse, scandir, ordered=False,
+                 buffered=DEFAULT_BUFFERED):
+        self.recurse = recurse
+        self.ordered = ordered
+        self.scandir = scandir
+        self.deques = [deque() for i in range(threads)]
+        # Ordered walks sort subdirectories by name, so the order of the
+        # path components below root is the order directories are yielded
+        self.heap = []
+        self.cond = threading.Condition()
+        # Each listing takes a credit until it is consumed, so the queue
+        # also holds at most one error per thread and the end marker
+        self.credits = max(1, buffered)
+        self.results = queue.Queue(maxsize=self.credits + threads + 1)
+        # Directories queued or being read. The walk is over at zero
+        self.pending = 0
+        self.stopped = False
+        self.threads = [threading.Thread(target=self.work, args=(i, ),
+                                         daemon=True)
+                        for i in range(threads)]
+
+    def start(self, root, reldir):
+        self.pending = 1
+        self.queue_dirs(self.deques[0], [(root, reldir, ())])
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+    def queue_dirs(self, own, items):
+        """Queue (path, reldir, key) items to be read, first item first"""
+        if self.ordered:
+            for path, reldir, key in items:
+                heapq.heappush(self.heap, (key, path, reldir))
+        else:
+            own.extend(reversed(items))
+
+    def take(self, index):
+        if self.ordered:
+            if len(self.heap) == 0:
+                return None
+            key, path, reldir = heapq.heappop(self.heap)
+            return path, reldir, key
+        try:
+            return self.deques[index].pop()
+        except IndexError:
+            pass
+        count = len(self.deques)
+        for offset in range(1, count):
+            try:
+                return self.deques[(index + offset) % count].popleft()
+            except IndexError:
+                continue
+        return None
+
+    def read(self, path, reldir, key):
+        """Return (path, reldir, subdirs, files, descend) for a directory"""
+        subdirs = []
+        files = []
+        try:
+            with self.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        subdirs.append(entry)
+                    else:
+                        files.append(entry)
+        except OSError:
+            pass
+        if self.ordered:
+            subdirs.sort(key=lambda entry: entry.name)
+            files.sort(key=lambda entry: entry.name)
+        descend = []
+        if self.recurse:
+            # Symlinked directories are listed but not followed
+            descend = [(entry.path, os.path.join(reldir, entry.name),
+                        key + (entry.name, ))
+                       for entry in subdirs if not entry.is_symlink()]
+        return path, reldir, subdirs, files, descend
+
+    def work(self, index):
+        own = self.deques[index]
+        while True:
+            item = None
+            with self.cond:
+                while not self.stopped and self.pending > 0:
+                    if self.credits > 0:
+                        item = self.take(index)
+                        if item is not None:
+                            self.credits -= 1
+                            break
+                    self.cond.wait(0.05)
+            if item is None:
+                return
+            try:
+                listing = self.read(*item)
+            except Exception as exc:
+                self.results.put(exc)
+                with self.cond:
+                    self.stopped = True
+                    self.cond.notify_all()
+                return
+            self.publish(listing, own)
+
+    def publish(self, listing, own, queued=True):
+        descend = listing[4]
+        with self.cond:
+            # Count the subdirectories before this directory is discounted,
+            # so pending cannot touch zero in between. They are queued
+            # before the listing is seen, so the consumer never waits on a
+            # directory that has not been found yet
+            self.pending += len(descend) - 1
+            self.queue_dirs(own, descend)
+            if queued:
+                self.results.put(listing)
+            if self.pending == 0:
+                self.results.put(_DONE)
+                self.cond.notify_all()
+            elif len(descend) > 1:
+                self.cond.notify(len(descend) - 1)
+
+    def claim(self, path):
+        """Read path here if no thread has started it and none can, because
+        the read-ahead allowance is spent. Returns its listing or None"""
+        with self.cond:
+            # Being ordered, the directory due next is first in the heap
+            # unless a thread is reading it
+            if self.credits > 0 or len(self.heap) == 0 or \
+                    self.heap[0][1] != path:
+                return None
+            item = self.take(0)
+            self.credits -= 1
+        listing = self.read(*item)
+        self.publish(listing, None, queued=False)
+        return listing
+
+    def release(self):
+        """Return the credit of a consumed listing"""
+        with self.cond:
+            self.credits += 1
+            self.cond.notify()
+
+    def next_listing(self, timeout=None):
+        try:
+            listing = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if isinstance(listing, Exception):
+            raise TreeWalkError('Walk failed', listing)
+        return listing
+
+
+def walk(root, threads=DEFAULT_THREADS, ordered=False, recurse=True,
+         reldir='', scandir=os.scandir, buffered=DEFAULT_BUFFERED):
+    """Yield (reldir, subdirs, files) for root and the directories below it
+
+    subdirs and files are lists of os.DirEntry, split as
+    S3Helper.iterdir_s3_posix() splits them, and reldir is the directory's
+    path relative to root, prefixed by reldir. Directories are read by up to
+    threads threads and yielded as they are read unless ordered is True, in
+    which case subdirs and files are sorted by name and directories are
+    yielded in the top-down, depth-first order of iterdir_s3_posix() whatever
+    order the threads finish in. At most buffered listings are read ahead of
+    the caller. scandir can be replaced, for instance to simulate metadata
+    latency.
+    """
+    walker = _Walk(max(1, threads), recurse, scandir, ordered, buffered)
+    walker.start(root, reldir)
+    try:
+        if not ordered:
+            while True:
+                listing = walker.next_listing()
+                if listing is _DONE:
+                    return
+                yield listing[1:4]
+                walker.release()
+        # Hold listings that arrive early until their turn comes
+        early = dict()
+        stack = [root]
+        while len(stack) > 0:
+            path = stack.pop()
+            while path not in early:
+                listing = walker.claim(path)
+                if listing is None:
+                    listing = walker.next_listing(timeout=0.05)
+                if listing is not None and listing is not _DONE:
+                    early[listing[0]] = listing
+            listing = early.pop(path)
+            yield listing[1:4]
+            walker.release()
+            stack.extend(item[0] for item in reversed(listing[4]))
+    finally:
+        walker.stop()
@@ -0,0 +1,199 @@
+"""
+Process messages from a spool directory in one long-running process
+
+    python worker.py /path/to/spool [--poll 1.0] [--once] [--stale 86400]
+
+The Reactor, helpers, indexes and config are built once and each message is
+then handled exactly as reactor.main() would handle it, so only the work of
+the message itself is paid for. Messages are JSON files placed in
+<spool>/incoming (write them elsewhere and rename them in, so a worker never
+reads a partial file). A worker claims a message by renaming it into
+<spool>/processing under a name that records the claiming host and process,
+which lets several workers share a spool, and moves it to <spool>/done or,
+with an accompanying .error file, <spool>/failed. On startup, a worker puts
+messages back into incoming if the process that claimed them has died on
+this host, or if they were claimed more than --stale seconds ago.
+
+Outside of Abaco there is no actor to message, so directory syncs should use
+batch.mode: local.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from attrdict import AttrDict
+
+import timing
+
+SPOOL_DIRS = ('incoming', 'processing', 'done', 'failed')
+# Separates a message name from its claimant in processing/
+OWNER_SEP = '.claimed-by.'
+
+
+def spool_dirs(spool):
+    dirs = dict((name, os.path.join(spool, name)) for name in SPOOL_DIRS)
+    for path in dirs.values():
+        os.makedirs(path, exist_ok=True)
+    return dirs
+
+
+def owner():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def message_name(path):
+    """Name of a message in incoming, without any claimant suffix"""
+    return os.path.basename(path).rsplit(OWNER_SEP, 1)[0]
+
+
+def claim(dirs):
+    """Claim the first message in incoming in name order, so messages with
+    timestamped names are handled oldest first. Returns its path or None"""
+    for name in sorted(os.listdir(dirs['incoming'])):
+        if not name.endswith('.json'):
+            continue
+        claimed = os.path.join(dirs['processing'],
+                               name + OWNER_SEP + owner())
+        try:
+            os.rename(os.path.join(dirs['incoming'], name), claimed)
+        except FileNotFoundError:
+            # Another worker got there first
+            continue
+        # The claim time, for recover()
+        os.utime(claimed)
+        return claimed
+    return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def recover(dirs, stale=86400, now=None):
+    """Return abandoned messages in processing to incoming
+
+    A message is abandoned if the process that claimed it on this host no
+    longer exists, or if it was claimed more than stale seconds ago.
+    Returns the number of messages re-queued.
+    """
+    if now is None:
+        now = time.time()
+    host = socket.gethostname()
+    requeued = 0
+    for name in os.listdir(dirs['processing']):
+        path = os.path.join(dirs['processing'], name)
+        claimant = name.rsplit(OWNER_SEP, 1)[1] if OWNER_SEP in name else ''
+        claim_host, _, pid = claimant.rpartition(':')
+        try:
+            abandoned = claim_host == host and pid.isdigit() and \
+                not _alive(int(pid))
+            if not abandoned and stale is not None:
+                abandoned = now - os.stat(path).st_mtime > stale
+            if abandoned:
+                os.rename(path, os.path.join(dirs['incoming'],
+                                             message_name(name)))
+                requeued += 1
+        except FileNotFoundError:
+            # Finished or recovered by another worker meanwhile
+            continue
+    return requeued
+
+
+def finish(dirs, path, error=None):
+    name = message_name(path)
+    if error is None:
+        os.rename(path, os.path.join(dirs['done'], name))
+        return
+    os.rename(path, os.path.join(dirs['failed'], name))
+    with open(os.path.join(dirs['failed'], name + '.error'), 'w') as err:
+        err.write(error)
+
+
+class Worker(object):
+    def __init__(self, spool, poll=1.0, stale=86400):
+        # Deferred so that --help does not pay for the Reactor imports
+        import reactor
+        self.reactor = reactor
+        self.dirs = spool_dirs(spool)
+        self.poll = poll
+        self.stopping = False
+        self.handled = 0
+        self.failed = 0
+        start = time.perf_counter()
+        self.r = reactor.Reactor()
+        self.context = reactor.setup(self.r)
+        requeued = recover(self.dirs, stale)
+        if requeued > 0:
+            self.r.logger.warning(
+                'Re-queued {} abandoned messages'.format(requeued))
+        self.r.logger.info('Worker ready in {:.3f}s'.format(
+            time.perf_counter() - start))
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def handle(self, path):
+        timing.reset()
+        start = time.perf_counter()
+        try:
+            with open(path, 'r') as msg:
+                m = AttrDict(json.load(msg))
+            self.reactor.handle_message(self.r, self.context, m)
+        except (Exception, SystemExit):
+            # r.on_failure() exits; in a worker that only fails the message
+            self.failed += 1
+            self.r.logger.error('Message {} failed'.format(
+                message_name(path)))
+            finish(self.dirs, path, traceback.format_exc())
+        else:
+            finish(self.dirs, path)
+        self.handled += 1
+        self.r.logger.debug('Message {} handled in {:.3f}s'.format(
+            message_name(path), time.perf_counter() - start))
+
+    def run(self, once=False):
+        """Handle messages until stopped, or until the spool is empty"""
+        while not self.stopping:
+            path = claim(self.dirs)
+            if path is None:
+                if once:
+                    break
+                time.sleep(self.poll)
+                continue
+            self.handle(path)
+        self.r.logger.info('Worker handled {} messages ({} failed)'.format(
+            self.handled, self.failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('spool', help='Spool directory')
+    parser.add_argument('--poll', type=float, default=1.0,
+                        help='Seconds to wait when the spool is empty')
+    parser.add_argument('--once', action='store_true',
+                        help='Exit when the spool is empty')
+    parser.add_argument('--stale', type=float, default=86400,
+                        help='Seconds after which a claimed message is '
+                        'considered abandoned')
+    args = parser.parse_args()
+
+    worker = Worker(args.spool, args.poll, args.stale)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(args.once)
+    return 0 if worker.failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(timing.run_profiled(main))